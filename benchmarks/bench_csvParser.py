@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Parsing benchmarks for AIT test sequence CSV files.
+
+A synthetic sequence in the AIT format (45 columns, 4 header rows) is
+generated with a fixed seed, with a mix of techs, WCU settings, filters and
+missing values, so that all the mapping branches of csvParser are used. The
+benchmarks follow the asv conventions, and can also be run directly:
+
+    python benchmarks/bench_csvParser.py [--rows N] [--repeat N]
+
+which prints the median time to parse the file with iterCSV and loadCSV.
+The warnings of the parser (e.g. unmapped filters) are not shown, so that
+the parsing and not the terminal is timed.
+"""
+
+import argparse
+import csv
+import logging
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from metis_simulations import csvParser
+
+NROWS = 100000
+
+# the columns read by csvParser
+USED_COLUMNS = ["test_ID", "step_number", "templateName", "DPR.CATG", "DPR.TYPE", "DPR.TECH",
+                "INS.OPTI3.NAME", "INS.OPTI9.NAME", "INS.OPTI10.NAME", "INS.OPTI11.NAME",
+                "INS.OPTI13.NAME", "INS.OPTI14.NAME", "INS.OPTI17.NAME", "INS.OPTI19.NAME",
+                "INS.OPTI20.NAME", "SEQ.WCU_BB_TEMP",
+                "DET1.DIT", "DET1.NDIT", "SEQ.NEXPO1", "DET2.DIT", "DET2.NDIT", "SEQ.NEXPO2",
+                "DET3.DIT", "DET3.NDIT", "SEQ.NEXPO3"]
+
+# other columns of the AIT format, which are not used
+OTHER_COLUMNS = [f"INS.OPTI{i}.NAME" for i in (1, 2, 4, 5, 6, 7, 8, 12, 15, 16, 18)] + \
+                ["TEL.AO.MODE", "SEQ.CHOP.ST", "SEQ.NOD.ST", "SEQ.WCU_IS_TEMP", "SEQ.COMMENT",
+                 "DET1.READ.CURNAME", "DET2.READ.CURNAME", "DET3.READ.CURNAME", "OCS.DURATION"]
+
+COLUMNS = USED_COLUMNS + OTHER_COLUMNS
+
+
+def writeSequence(path, nRows=NROWS, seed=1):
+
+    """write a synthetic AIT test sequence of nRows rows"""
+
+    r = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerow(["component"] * len(COLUMNS))
+        writer.writerow(["description"] * len(COLUMNS))
+        writer.writerow(["string"] * len(COLUMNS))
+        for i in range(nRows):
+            row = dict.fromkeys(COLUMNS, "NULL")
+            row.update({
+                "test_ID": f"AIT_{i // 10:05d}", "step_number": str(i % 10),
+                "templateName": r.choice(["METIS_img_lm_cal_DetLin", "METIS_gen_cal_dark", ""]),
+                "DPR.CATG": r.choice(["CALIB", "SCIENCE", "TEST"]),
+                "DPR.TYPE": r.choice(["DARK", "OBJECT", "FLAT_LAMP", "DETLIN", "WAVE", "DARK_WCUOFF", "PSF_OFFAXIS"]),
+                "DPR.TECH": r.choice(["IMAGE_LM", "IMAGE_N", "IFU", "LSS_LM", "LSS_N",
+                                      "[IMAGE_LM, IMAGE_N]", "UNKNOWN", "NULL"]),
+                "INS.OPTI3.NAME": r.choice(["SLIT-A", "SLIT-C", "NULL"]),
+                "INS.OPTI9.NAME": r.choice(["GRISM-M", "GRISM-L"]),
+                "INS.OPTI10.NAME": r.choice(["L'", "M'", "PAH3.3", "full_L", "DARK-LM", "NULL"]),
+                "INS.OPTI11.NAME": r.choice(["OPEN", "ND1", "ND3", "DARK", "NULL"]),
+                "INS.OPTI13.NAME": r.choice(["N1", "[NeII]", "full_N", "DARK-N"]),
+                "INS.OPTI14.NAME": r.choice(["OPEN", "ND2", "DARK"]),
+                "INS.OPTI17.NAME": r.choice(["IN", "OUT"]),
+                "INS.OPTI19.NAME": r.choice(["MASK03", "MASK10", "OPEN", "CLOSED"]),
+                "INS.OPTI20.NAME": r.choice(["LM-GRID", "FLATFIELD", "N-PINHOLE"]),
+                "SEQ.WCU_BB_TEMP": r.choice(["0", "1000", "800", "NULL"]),
+                "SEQ.COMMENT": f"step {i}",
+            })
+            for d in "123":
+                if r.random() < 0.7:
+                    row[f"DET{d}.DIT"] = r.choice(["0.25", "1.0", "10", "30.5"])
+                    row[f"DET{d}.NDIT"] = r.choice(["1", "4", "NULL"])
+                    row[f"SEQ.NEXPO{d}"] = r.choice(["1", "2", "3", "NULL"])
+            writer.writerow([row[c] for c in COLUMNS])
+
+
+_tmpDir = None
+_sequence = None
+
+
+def setup():
+    global _tmpDir, _sequence
+    logging.getLogger(csvParser.__name__).setLevel(logging.ERROR)
+    if _sequence is None:
+        _tmpDir = tempfile.TemporaryDirectory()
+        _sequence = Path(_tmpDir.name) / "sequence.csv"
+        writeSequence(_sequence)
+
+
+def time_iterCSV():
+    for name, recipe in csvParser.iterCSV(_sequence):
+        pass
+
+
+def time_loadCSV():
+    csvParser.loadCSV(_sequence)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--rows', type=int, default=NROWS,
+                        help='number of rows of the synthetic sequence')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of times each benchmark is run')
+    args = parser.parse_args()
+
+    logging.getLogger(csvParser.__name__).setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmpDir:
+        _sequence = Path(tmpDir) / "sequence.csv"
+        writeSequence(_sequence, args.rows)
+        nBlocks = sum(1 for _ in csvParser.iterCSV(_sequence))
+        print(f"{args.rows} rows, {nBlocks} recipe blocks")
+
+        for name, fct in sorted(globals().items()):
+            if not name.startswith("time_"):
+                continue
+            times = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                fct()
+                times.append(time.perf_counter() - t0)
+            print(f"{name:40s} median {statistics.median(times):7.3f}s  "
+                  f"min {min(times):7.3f}s  ({1e6 * statistics.median(times) / args.rows:.1f} us/row)")
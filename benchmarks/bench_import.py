@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Import-time benchmarks.
+
+Importing metis_simulations.sources (and through it scopesimWrapper) is done
+by every worker process, so it should not build any optical trains or load
+any input images. The benchmarks follow the asv conventions (timeraw_*
+functions return code that is timed in a fresh interpreter), and can also be
+run directly:
+
+    python benchmarks/bench_import.py [--repeat N]
+
+which prints the median import time of each module, and checks that no
+optical train was built while importing.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+def timeraw_import_sources():
+    return "import metis_simulations.sources"
+
+
+def timeraw_import_scopesimWrapper():
+    return "import metis_simulations.scopesimWrapper"
+
+
+def timeraw_import_setupSimulations():
+    return "import metis_simulations.setupSimulations"
+
+
+TIMING_CODE = """
+import time
+import scopesim as sim
+nTrains = 0
+_init = sim.OpticalTrain.__init__
+def _count(self, *args, **kwargs):
+    global nTrains
+    nTrains += 1
+    _init(self, *args, **kwargs)
+sim.OpticalTrain.__init__ = _count
+t0 = time.perf_counter()
+{code}
+print(time.perf_counter() - t0, nTrains)
+"""
+
+
+def measure(code, repeat=5):
+
+    """
+    run code in fresh interpreters; return the import times and the number of
+    optical trains built. ScopeSim itself is imported before the timer starts,
+    so that OpticalTrain can be instrumented.
+    """
+
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", TIMING_CODE.format(code=code)],
+                             check=True, capture_output=True, text=True).stdout
+        elapsed, nTrains = out.split()[-2:]
+        times.append(float(elapsed))
+    return times, int(nTrains)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of fresh interpreters per benchmark')
+    args = parser.parse_args()
+
+    benchmarks = [(name, fct) for name, fct in sorted(globals().items())
+                  if name.startswith("timeraw_")]
+
+    ok = True
+    for name, fct in benchmarks:
+        times, nTrains = measure(fct(), repeat=args.repeat)
+        print(f"{name:40s} median {statistics.median(times):7.3f}s  "
+              f"min {min(times):7.3f}s  optical trains built: {nTrains}")
+        ok = ok and nTrains == 0
+
+    if not ok:
+        sys.exit("Optical trains were built on import")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Check that the memory of a long-lived worker stays bounded.
+
+A worker keeps its optical trains and sources cached between exposures, so
+nothing else of an exposure (the readout, the fields of view, the copy of
+the source) may stay behind. track_rssGrowth simulates NEXPOSURES exposures
+of a mode with 32x32 detectors in this process, as a worker does (through
+executor.runExposures with a single core, without any worker limits), and
+returns the growth of the resident memory in MB from exposure WARMUP, when
+the caches are filled, to the last one.
+
+The benchmarks need ScopeSim, scopesim_templates and the IRDB in
+DEFAULT_IRDB_LOCATION, and the recipes of bench_simulate. They follow the
+asv conventions, and can also be run directly:
+
+    python benchmarks/bench_leak.py [--mode img_lm lms ...] [-n 200]
+
+which prints the resident memory along the way, and exits with 1 if it grew
+by more than MAX_GROWTH_MB in any mode.
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from metis_simulations.executor import runExposures
+from metis_simulations.stageTiming import rssMB
+
+try:
+    from .bench_simulate import loadRecipes, planExposures
+except ImportError:
+    # run as a script
+    from bench_simulate import loadRecipes, planExposures
+
+MODES = ["img_lm", "lms", "lss_l"]
+
+NEXPOSURES = 200
+
+# exposures before the caches are filled
+WARMUP = 20
+
+# growth of the resident memory in MB after WARMUP that counts as a leak
+MAX_GROWTH_MB = 50
+
+
+def rssTrace(mode, nExposures=NEXPOSURES):
+
+    """the resident memory in MB after each of nExposures small exposures of a mode"""
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        os.environ.pop("MSIM_OUTPUT_CACHE", None)
+        os.environ["MSIM_STAGE_LOG"] = os.path.join(tmpDir, "stageTimes.jsonl")
+        trace = []
+        with redirect_stdout(io.StringIO()):
+            plan = planExposures(loadRecipes([mode])[mode], Path(tmpDir) / mode, True, nObs=nExposures)
+            runExposures(plan, 1, maxTasks=0, maxRssMB=0,
+                         onDone=lambda exposures: trace.append(rssMB()[0]))
+    return trace
+
+
+def growth(trace):
+
+    """the growth of the resident memory in MB after the warmup"""
+
+    return trace[-1] - trace[min(WARMUP, len(trace)) - 1]
+
+
+def track_rssGrowth(mode):
+    return growth(rssTrace(mode))
+
+
+track_rssGrowth.params = MODES
+track_rssGrowth.param_names = ["mode"]
+track_rssGrowth.unit = "MB"
+track_rssGrowth.timeout = 3600
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--mode', nargs='+', default=MODES,
+                        help=f'modes to simulate (default {" ".join(MODES)})')
+    parser.add_argument('-n', '--nExposures', type=int, default=NEXPOSURES,
+                        help='number of exposures of each mode')
+    args = parser.parse_args()
+
+    leaks = []
+    for mode in args.mode:
+        trace = rssTrace(mode, args.nExposures)
+        steps = ", ".join(f"{trace[i]:.0f}" for i in range(0, len(trace), max(len(trace) // 10, 1)))
+        print(f"{mode:10s} RSS {steps}, {trace[-1]:.0f} MB; {growth(trace):+.1f} MB after {WARMUP} exposures")
+        if growth(trace) > MAX_GROWTH_MB:
+            leaks.append(mode)
+    if leaks:
+        sys.exit(f"the memory grew by more than {MAX_GROWTH_MB} MB for {', '.join(leaks)}")
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the bookkeeping around the simulations: planning, fixing the
+headers of written files and the summary.
+
+- time_plan plans the YAML files of the imgLM, lssLM and ifu ESO blocks, with
+  3 darks and flats of each kind, as runSimulationBlock does before running.
+- time_updateHeaders applies the header fixes to NFILES synthetic raw files
+  that were written without them, with setupSimulations.updateHeaders; the
+  files are written again by the setup of each repeat.
+- time_generateSummary writes the summary of the same files from their
+  headers, and time_generateSummary_index from an up to date header index,
+  as python -m metis_simulations.generateSummary does.
+
+The raw files have the keywords of a readout and an image extension of
+32x32 (as with --small) or 2048x2048 pixels; both sizes are benchmarked.
+The parsing of CSV files (loadCSV) is in bench_csvParser.py. The benchmarks
+follow the asv conventions, and can also be run directly:
+
+    python benchmarks/bench_pipeline.py [--small] [--repeat N]
+
+which prints the median time of each benchmark, or with runBenchmarks.py.
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+
+import numpy as np
+from astropy.io import fits
+
+from metis_simulations import runSimulationBlock as rs
+from metis_simulations.generateSummary import SUMMARY_KEYWORDS, generateSummary, summaryLines, writeSummary
+from metis_simulations.headerIndex import IndexSet
+from metis_simulations.headers import fixHeaders
+from metis_simulations.setupSimulations import setupSimulations
+
+YAML_DIR = Path(__file__).parents[1] / "YAML" / "ESO"
+
+# the YAML files of the imgLM, lssLM and ifu blocks in simulationBlocks/ESO
+PLAN_YAMLS = ["scienceLM.yaml", "stdLM.yaml", "distortionLM.yaml", "detlinLM.yaml",
+              "scienceLSSLM.yaml", "stdLSSLM.yaml", "rsrfLSSLM.yaml", "rsrfPinhLSSLM.yaml",
+              "wavecalLSSLM.yaml", "slitlossLSSLM.yaml",
+              "wavecalIFU.yaml", "scienceIFU.yaml", "stdIFU.yaml", "detlinIFU.yaml",
+              "distortionIFU.yaml", "rsrfIFU.yaml", "rsrfPinhIFU.yaml"]
+
+# number of raw files of each size
+NFILES = {True: 500, False: 20}
+
+# (DPR.TECH, DRS.FILTER) of the raw files, one of each kind of fix
+TECHS = [("IMAGE,LM", "Lp"), ("IMAGE,N", "N2"), ("LSS,LM", "L_spec"), ("LSS,N", "N_spec"),
+         ("IFU", "open"), ("RAVC,LM", "Lp"), ("APP,LM", "Mp"), ("RAVC,IFU", "open")]
+
+
+def writeRawFiles(outDir, nFiles, small, fixed=True, seed=1):
+
+    """
+    write nFiles raw files with the keywords of a ScopeSim readout to outDir,
+    with the header fixes applied as in the simulations if fixed is set.
+
+    Returns the file names and their MJD-OBS.
+    """
+
+    r = random.Random(seed)
+    size = 32 if small else 2048
+    data = np.zeros((size, size), dtype=np.float32)
+    os.makedirs(outDir, exist_ok=True)
+
+    fNames, mjds = [], []
+    for i in range(nFiles):
+        tech, filt = r.choice(TECHS)
+        mjd = 61430.0 + i / 1440
+        hdr = fits.Header()
+        hdr["MJD-OBS"] = 0.0
+        hdr["HIERARCH ESO DPR CATG"] = r.choice(["CALIB", "SCIENCE"])
+        hdr["HIERARCH ESO DPR TECH"] = tech
+        hdr["HIERARCH ESO DPR TYPE"] = r.choice(["OBJECT", "SKY", "DARK", "WAVE", "FLAT,LAMP"])
+        hdr["HIERARCH ESO DRS FILTER"] = filt
+        hdr["HIERARCH ESO DRS ND_FILTER"] = "open"
+        hdr["HIERARCH ESO DET DIT"] = r.choice([0.25, 1.0, 10.0])
+        hdr["HIERARCH ESO DET NDIT"] = r.choice([1, 4])
+        hdr["HIERARCH ESO TPL NAME"] = "METIS_benchmark"
+        hdr["HIERARCH ESO TPL START"] = "2027-01-25T00:00:00"
+        hdr["HIERARCH ESO TPL EXPNO"] = i
+        for j in range(1, 21):
+            hdr[f"HIERARCH ESO INS OPTI{j} NAME"] = r.choice(["open", "closed", True])
+        ext = fits.ImageHDU(data, name="DET1.DATA")
+        ext.header["pixel_size"] = 0.0547
+
+        hdul = fits.HDUList([fits.PrimaryHDU(header=hdr), ext])
+        if fixed:
+            with redirect_stdout(io.StringIO()):
+                fixHeaders(hdul, mjd)
+
+        fName = os.path.join(outDir, f"METIS.BENCH_{i:05d}.fits")
+        hdul.writeto(fName, overwrite=True)
+        fNames.append(fName)
+        mjds.append(mjd)
+    return fNames, mjds
+
+
+_tmpDir = None
+_rawFiles = {}
+
+
+def setup(small=None):
+    global _tmpDir
+    if _tmpDir is None:
+        _tmpDir = tempfile.TemporaryDirectory()
+    if small is not None and small not in _rawFiles:
+        # relative to _tmpDir, as generateSummary takes the block from the path
+        outDir = os.path.join("output", "small" if small else "full")
+        with _inTmpDir():
+            _rawFiles[small] = writeRawFiles(outDir, NFILES[small], small)
+
+
+@contextmanager
+def _inTmpDir():
+
+    """run in the temporary directory"""
+
+    cwd = os.getcwd()
+    os.chdir(_tmpDir.name)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def time_plan():
+    params = {"outputDir": os.path.join(_tmpDir.name, "plan"), "small": False, "doStatic": False,
+              "doCalib": 3, "sequence": True, "startMJD": "2027-01-25 00:00:00", "calibFile": None,
+              "nCores": 1, "testRun": True}
+    with redirect_stdout(io.StringIO()):
+        rs.planSimulationBlock([str(YAML_DIR / y) for y in PLAN_YAMLS], params, [])
+
+
+def setup_updateHeaders(small):
+    setup(small)
+    outDir = os.path.join("output", "small" if small else "full")
+    with _inTmpDir():
+        writeRawFiles(outDir, NFILES[small], small, fixed=False)
+
+
+def time_updateHeaders(small):
+    simulationSet = setupSimulations()
+    fNames, mjds = _rawFiles[small]
+    simulationSet.allFileNames = [os.path.join(_tmpDir.name, fName) for fName in fNames]
+    simulationSet.allmjd = mjds
+    with redirect_stdout(io.StringIO()):
+        simulationSet.updateHeaders()
+
+
+def time_generateSummary(small):
+    fNames, mjds = _rawFiles[small]
+    with _inTmpDir(), redirect_stdout(io.StringIO()):
+        generateSummary(fNames, "summary.csv")
+
+
+def setup_summaryIndex(small):
+    setup(small)
+    time_generateSummary_index(small)
+
+
+def time_generateSummary_index(small):
+    fNames, mjds = _rawFiles[small]
+    with _inTmpDir():
+        indexes = IndexSet()
+        index = indexes.indexFor(os.path.dirname(fNames[0]))
+        index.update()
+        fNames = index.select("METIS*.fits")
+        writeSummary(summaryLines(indexes.table(fNames, SUMMARY_KEYWORDS)), "summary.csv")
+        index.close()
+
+
+for _fct in (time_updateHeaders, time_generateSummary, time_generateSummary_index):
+    _fct.params = [True, False]
+    _fct.param_names = ["small"]
+time_updateHeaders.setup = setup_updateHeaders
+time_updateHeaders.number = 1
+time_generateSummary_index.setup = setup_summaryIndex
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--small', action="store_true",
+                        help='only use files of 32x32 pixels')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of times each benchmark is run')
+    args = parser.parse_args()
+
+    for name, fct in sorted(globals().items()):
+        if not name.startswith("time_"):
+            continue
+        for small in ([True] if args.small else [True, False]) if hasattr(fct, "params") else [None]:
+            params = () if small is None else (small,)
+            times = []
+            for _ in range(args.repeat):
+                getattr(fct, "setup", setup)(*params)
+                t0 = time.perf_counter()
+                fct(*params)
+                times.append(time.perf_counter() - t0)
+            label = name if small is None else f"{name}({'32x32' if small else 'full'})"
+            print(f"{label:50s} median {statistics.median(times):7.3f}s  min {min(times):7.3f}s")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Check that the repeats simulated with reuseSignal match independent exposures.
+
+With reuseSignal, the repeats of a dark or flat are read out one after the
+other from a single observed image plane (scopesimWrapper.simulateRepeats).
+This is only right if a readout doesn't change the image plane for the next
+one. For each calibration in CALIBS, NREPEATS repeats are planned as in a
+block with doCalib, with 32x32 detectors, and simulated twice: once with
+simulateRepeats and once with simulate for each repeat. Each pair of files
+must have
+
+- the same headers, apart from HEADER_IGNORE (DIT, NDIT, TPL.EXPNO and
+  MJD-OBS included)
+- for each detector, means that differ by less than MAX_Z standard errors,
+  and variances within the same number of standard errors of their ratio
+
+track_repeatsDeviation returns the largest deviation of the means and the
+variances, in standard errors, over the repeats of a calibration.
+
+The check needs ScopeSim, scopesim_templates and the IRDB in
+DEFAULT_IRDB_LOCATION. It follows the asv conventions, and can also be run
+directly:
+
+    python benchmarks/bench_reuseSignal.py [--repeats N]
+
+which prints the comparison of each repeat, and exits with 1 if any of them
+differ. reuseSignal stays off by default.
+"""
+
+import argparse
+import copy
+import io
+import math
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import numpy as np
+from astropy.io import fits
+
+from metis_simulations.scopesimWrapper import simulate, simulateRepeats
+from metis_simulations.setupSimulations import setupSimulations
+
+try:
+    from .bench_simulate import loadRecipes
+except ImportError:
+    # run as a script
+    from bench_simulate import loadRecipes
+
+# (kind, parameters as collected by setupSimulations.calculateCalibs)
+CALIBS = {"dark_lm": ("dark", (1.0, 4, "IMAGE,LM")),
+          "dark_n": ("dark", (0.1, 4, "IMAGE,N")),
+          "dark_ifu": ("dark", (10.0, 1, "IFU")),
+          "lampFlat_lm": ("lampFlat", ("Lp", "open", "IMAGE,LM")),
+          "lampFlat_n": ("lampFlat", ("N2", "open", "IMAGE,N"))}
+
+NREPEATS = 5
+
+# largest deviation of the means and variances, in standard errors
+MAX_Z = 5
+
+# keywords that may differ between two files with the same inputs
+HEADER_IGNORE = {"DATE", "CHECKSUM", "DATASUM"}
+
+
+def planRepeats(calib, outDir, nRepeats=NREPEATS):
+
+    """the Exposures of the repeats of a calibration, with outDir as output directory"""
+
+    kind, elem = CALIBS[calib]
+    recipe = copy.deepcopy(loadRecipes(["img_lm"])["img_lm"])
+    recipe["properties"]["nObs"] = 1
+
+    simulationSet = setupSimulations()
+    simulationSet.params = {"outputDir": str(outDir), "small": True, "startMJD": "2027-01-25 00:00:00",
+                            "testRun": True, "doCalib": nRepeats}
+    simulationSet.allrcps = {"benchmark": recipe}
+    simulationSet.getStartDate()
+    simulationSet.runSimulations(execute=False)
+
+    simulationSet.plan = []
+    if kind == "dark":
+        simulationSet.calculateDarks([elem], execute=False)
+    else:
+        simulationSet.calculateFlats([elem], kind, execute=False)
+    return simulationSet.plan
+
+
+def headerDifferences(header1, header2):
+
+    """the keywords whose values differ between two headers"""
+
+    keys = (set(header1) | set(header2)) - HEADER_IGNORE
+    return sorted(key for key in keys if header1.get(key) != header2.get(key))
+
+
+def deviation(data1, data2):
+
+    """the difference of the means and the log ratio of the variances of two images, in standard errors"""
+
+    n = data1.size
+    var1, var2 = float(np.var(data1)), float(np.var(data2))
+    if var1 == 0 and var2 == 0:
+        return (0.0 if np.mean(data1) == np.mean(data2) else math.inf), 0.0
+    if var1 == 0 or var2 == 0:
+        return math.inf, math.inf
+    zMean = abs(float(np.mean(data1) - np.mean(data2))) / math.sqrt((var1 + var2) / n)
+    # the standard error of the log of a variance is sqrt(2 / (n - 1))
+    zVar = abs(math.log(var1 / var2)) / math.sqrt(4 / (n - 1))
+    return zMean, zVar
+
+
+def compareFiles(fname1, fname2):
+
+    """
+    compare two files; returns the differing keywords of each HDU, and the
+    largest deviation of the means and variances of their images
+    """
+
+    differences, zMax = [], 0.0
+    with fits.open(fname1) as hdul1, fits.open(fname2) as hdul2:
+        if len(hdul1) != len(hdul2):
+            return [f"{len(hdul1)} HDUs instead of {len(hdul2)}"], math.inf
+        for i, (hdu1, hdu2) in enumerate(zip(hdul1, hdul2)):
+            differences += [f"HDU {i}: {key}" for key in headerDifferences(hdu1.header, hdu2.header)]
+            if hdu1.data is not None and hdu2.data is not None and hdu1.data.ndim >= 2:
+                zMax = max(zMax, *deviation(hdu1.data, hdu2.data))
+    return differences, zMax
+
+
+def compareRepeats(calib, nRepeats=NREPEATS):
+
+    """
+    simulate the repeats of a calibration with and without reuseSignal;
+    returns (differing keywords, largest deviation) for each repeat
+    """
+
+    with tempfile.TemporaryDirectory() as tmpDir, redirect_stdout(io.StringIO()):
+        os.environ.pop("MSIM_OUTPUT_CACHE", None)
+        os.environ["MSIM_STAGE_LOG"] = os.path.join(tmpDir, "stageTimes.jsonl")
+        reused = planRepeats(calib, Path(tmpDir) / "reused", nRepeats)
+        single = planRepeats(calib, Path(tmpDir) / "single", nRepeats)
+
+        simulateRepeats([exp.fname for exp in reused], [exp.recipe() for exp in reused], small=True)
+        for exp in single:
+            simulate(exp.fname, exp.recipe(), small=True)
+        return [compareFiles(exp1.fname, exp2.fname) for exp1, exp2 in zip(reused, single)]
+
+
+def track_repeatsDeviation(calib):
+    return max(zMax for differences, zMax in compareRepeats(calib))
+
+
+track_repeatsDeviation.params = list(CALIBS)
+track_repeatsDeviation.param_names = ["calib"]
+track_repeatsDeviation.unit = "sigma"
+track_repeatsDeviation.timeout = 1800
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--calib', nargs='+', default=list(CALIBS),
+                        help=f'calibrations to check (default {" ".join(CALIBS)})')
+    parser.add_argument('-n', '--repeats', type=int, default=NREPEATS,
+                        help='number of repeats of each calibration')
+    args = parser.parse_args()
+
+    failed = []
+    for calib in args.calib:
+        for i, (differences, zMax) in enumerate(compareRepeats(calib, args.repeats)):
+            ok = not differences and zMax < MAX_Z
+            print(f"{calib:12s} repeat {i + 1}: deviation {zMax:.2f} sigma"
+                  + (f", headers differ in {', '.join(differences)}" if differences else "")
+                  + ("" if ok else "  DIFFERENT"))
+            if not ok:
+                failed.append(f"{calib} repeat {i + 1}")
+    if failed:
+        sys.exit(f"the repeats with reuseSignal differ from independent exposures: {', '.join(failed)}")
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Benchmarks of single simulated exposures, for each mode.
+
+A representative exposure is simulated for each mode in
+simulationDefinitions.modeVals and each WCU mode, with 32x32 detectors (as
+with --small) and with the full detectors. The recipe of each mode is one of
+the YAML recipes of the repository (RECIPES: science exposures, and detector
+linearity or RSRF flats for the WCU modes), planned with setupSimulations so
+that it has all the time keywords of a real run. lss_m has no recipe of its
+own, and uses the lss_l one with the M_spec filter.
+
+time_simulate starts from empty source and optical train caches, as the first
+exposure of a worker; time_simulate_cachedTrain reuses the train built by its
+setup, as the following exposures with the same configuration. The output
+cache is disabled, and the stage times go to a stage log in a temporary
+directory (see stageTiming).
+
+The benchmarks need ScopeSim, scopesim_templates and the IRDB in
+DEFAULT_IRDB_LOCATION. They follow the asv conventions, and can also be run
+directly:
+
+    python benchmarks/bench_simulate.py [--mode img_lm lms ...] [--small] [--repeat N]
+
+which prints the median time of each mode, or with runBenchmarks.py.
+"""
+
+import argparse
+import copy
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from metis_simulations import scopesimWrapper
+from metis_simulations import simulationDefinitions as sd
+from metis_simulations.setupSimulations import setupSimulations
+
+YAML_DIR = Path(__file__).parents[1] / "YAML"
+
+WCU_MODES = ["wcu_img_lm", "wcu_img_n", "wcu_lms", "wcu_lss_l", "wcu_lss_m", "wcu_lss_n"]
+
+MODES = sorted(set(sd.modeVals)) + WCU_MODES
+
+# the recipe of each mode: YAML file (relative to YAML_DIR), name of the recipe
+RECIPES = {"img_lm": ("ESO/scienceLM.yaml", "LM_IMAGE_SCI_RAW"),
+           "img_n": ("ESO/scienceN.yaml", "N_IMAGE_SCI_RAW"),
+           "lms": ("ESO/scienceIFU.yaml", "IFU_SCI_RAW"),
+           "lss_l": ("ESO/scienceLSSLM.yaml", "LM_LSS_SCI_RAW"),
+           "lss_n": ("ESO/scienceLSSN.yaml", "N_LSS_SCI_RAW"),
+           "wcu_img_lm": ("ESO/detlinLM.yaml", "DETLIN_2RG_RAW1"),
+           "wcu_img_n": ("ESO/detlinN.yaml", "DETLIN_GEO_RAW1"),
+           "wcu_lms": ("ESO/detlinIFU.yaml", "DETLIN_IFU_RAW_ON1"),
+           "wcu_lss_l": ("ESO/rsrfLSSLM.yaml", "LM_LSS_RSRF_RAW1"),
+           "wcu_lss_m": ("AIT_Tests/LSS_RAD_03/LSS_RAD_03_lm_mspec.yaml", "LM_LSS_SCI_RAW_M"),
+           "wcu_lss_n": ("ESO/rsrfLSSN.yaml", "N_LSS_RSRF_RAW1")}
+
+# the modes without a recipe of their own: (mode they are derived from, changed properties)
+DERIVED = {"lss_m": ("lss_l", {"filter_name": "M_spec"})}
+
+
+def loadRecipes(modes=MODES):
+
+    """the recipe of each mode, by mode"""
+
+    recipes = {}
+    for mode in modes:
+        base, props = DERIVED.get(mode, (mode, {}))
+        yamlFile, name = RECIPES[base]
+        with (YAML_DIR / yamlFile).open(encoding="utf-8") as f:
+            recipe = yaml.safe_load(f)[name]
+        recipe["mode"] = mode
+        recipe["properties"].update(props)
+        recipes[mode] = recipe
+    return recipes
+
+
+def planExposures(recipe, outDir, small, nObs=1):
+
+    """the Exposures of nObs observations of a recipe, with outDir as output directory"""
+
+    recipe = copy.deepcopy(recipe)
+    recipe["properties"]["nObs"] = nObs
+
+    simulationSet = setupSimulations()
+    simulationSet.params = {"outputDir": str(outDir), "small": small, "startMJD": "2027-01-25 00:00:00",
+                            "testRun": True}
+    simulationSet.allrcps = {"benchmark": recipe}
+    simulationSet.getStartDate()
+    simulationSet.runSimulations(execute=False)
+    return simulationSet.plan
+
+
+def planExposure(recipe, outDir, small):
+
+    """the Exposure of a single observation of a recipe, with outDir as output directory"""
+
+    return planExposures(recipe, outDir, small)[0]
+
+
+_tmpDir = None
+_recipes = None
+_exposures = {}
+
+
+def setup(mode, small):
+    global _tmpDir, _recipes
+    if _recipes is None:
+        _tmpDir = tempfile.TemporaryDirectory()
+        os.environ.pop("MSIM_OUTPUT_CACHE", None)
+        os.environ["MSIM_STAGE_LOG"] = os.path.join(_tmpDir.name, "stageTimes.jsonl")
+        _recipes = loadRecipes()
+    if (mode, small) not in _exposures:
+        _exposures[mode, small] = planExposure(_recipes[mode], Path(_tmpDir.name) / mode, small)
+
+
+def _simulate(mode, small):
+    exposure = _exposures[mode, small]
+    scopesimWrapper.simulate(exposure.fname, exposure.recipe(), small=exposure.small)
+
+
+def _clearCaches():
+    scopesimWrapper._trainCache.clear()
+    scopesimWrapper._sourceCache.clear()
+
+
+def time_simulate(mode, small):
+    _clearCaches()
+    _simulate(mode, small)
+
+
+def setup_cachedTrain(mode, small):
+    setup(mode, small)
+    _clearCaches()
+    _simulate(mode, small)
+
+
+def time_simulate_cachedTrain(mode, small):
+    _simulate(mode, small)
+
+
+for _fct in (time_simulate, time_simulate_cachedTrain):
+    _fct.params = (MODES, [True, False])
+    _fct.param_names = ["mode", "small"]
+    _fct.timeout = 1800
+time_simulate_cachedTrain.setup = setup_cachedTrain
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--mode', nargs='+', default=MODES,
+                        help='modes to simulate (default all)')
+    parser.add_argument('-s', '--small', action="store_true",
+                        help='only use detectors of 32x32 pixels')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of times each benchmark is run')
+    args = parser.parse_args()
+
+    for mode in args.mode:
+        for small in ([True] if args.small else [True, False]):
+            for name, fct in (("time_simulate", time_simulate),
+                              ("time_simulate_cachedTrain", time_simulate_cachedTrain)):
+                getattr(fct, "setup", setup)(mode, small)
+                times = []
+                for _ in range(args.repeat):
+                    t0 = time.perf_counter()
+                    fct(mode, small)
+                    times.append(time.perf_counter() - t0)
+                label = f"{name}({mode}, {'32x32' if small else 'full'})"
+                print(f"{label:50s} median {statistics.median(times):7.3f}s  min {min(times):7.3f}s")
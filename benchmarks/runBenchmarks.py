@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+Run the benchmarks and keep the results, to compare them between versions.
+
+All the bench_*.py modules in this directory are run, following the asv
+conventions: time_* functions are timed in this process, after calling their
+setup (the setup attribute of the function, or the setup function of the
+module) before each repeat, and with every combination of their params;
+timeraw_* functions return code that is timed in a fresh interpreter, and
+track_* functions return the value to record (in their unit, e.g. MB).
+
+The results are written to RESULTS_DIR/<host>/<date>-<commit>.json, with the
+versions of ScopeSim and of the IRDB packages, so that a slowdown after
+updating them can be found:
+
+    python benchmarks/runBenchmarks.py [-b simulate] [--repeat N] [--compare latest]
+
+--compare gives a previous result file, or "latest" for the last one of this
+host, and lists the benchmarks whose median time went up by more than
+--threshold (or whose tracked value went up); the exit code is then 1 if
+there are any.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).parent
+RESULTS_DIR = BENCH_DIR / "results"
+
+TIMERAW_CODE = """
+import time
+t0 = time.perf_counter()
+{code}
+print(time.perf_counter() - t0)
+"""
+
+
+def findBenchmarks(pattern=None):
+
+    """the (name, module, function) of all the benchmarks whose name matches the regular expression pattern"""
+
+    sys.path.insert(0, str(BENCH_DIR.parent))
+    benchmarks = []
+    for path in sorted(BENCH_DIR.glob("bench_*.py")):
+        try:
+            module = importlib.import_module(f"{BENCH_DIR.name}.{path.stem}")
+        except Exception as e:
+            print(f"{path.stem}: can't be imported, skipped ({type(e).__name__}: {e})")
+            continue
+        for name, fct in sorted(vars(module).items()):
+            fullName = f"{path.stem}.{name}"
+            if name.startswith(("time_", "timeraw_", "track_")) and callable(fct):
+                if pattern is None or re.search(pattern, fullName):
+                    benchmarks.append((fullName, module, fct))
+    return benchmarks
+
+
+def paramSets(fct):
+
+    """the combinations of the params of a benchmark, as in asv"""
+
+    params = getattr(fct, "params", None)
+    if params is None:
+        return [()]
+    if not isinstance(params, tuple):
+        params = (params,)
+    return list(itertools.product(*params))
+
+
+def label(fullName, fct, params):
+
+    """the name of a benchmark with a set of params"""
+
+    if not params:
+        return fullName
+    names = getattr(fct, "param_names", [f"param{i+1}" for i in range(len(params))])
+    return f"{fullName}({', '.join(f'{n}={p}' for n, p in zip(names, params))})"
+
+
+def timeBenchmark(module, fct, params, repeat):
+
+    """the times (or tracked values) of repeat runs of a benchmark with a set of params"""
+
+    times = []
+    for _ in range(repeat):
+        if fct.__name__.startswith("timeraw_"):
+            out = subprocess.run([sys.executable, "-c", TIMERAW_CODE.format(code=fct(*params))],
+                                 check=True, capture_output=True, text=True).stdout
+            times.append(float(out.split()[-1]))
+            continue
+        setup = getattr(fct, "setup", getattr(module, "setup", None))
+        if setup is not None:
+            setup(*params)
+        t0 = time.perf_counter()
+        value = fct(*params)
+        times.append(value if fct.__name__.startswith("track_") else time.perf_counter() - t0)
+        teardown = getattr(fct, "teardown", getattr(module, "teardown", None))
+        if teardown is not None:
+            teardown(*params)
+    return times
+
+
+def gitCommit():
+
+    """the commit of the repository, with a + if there are local changes"""
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCH_DIR,
+                               check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("+" if dirty else "")
+
+
+def versions():
+
+    """the versions of ScopeSim and of the IRDB packages, as used by the output cache"""
+
+    try:
+        from metis_simulations.outputCache import getVersions
+        return getVersions()
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def runAll(benchmarks, repeat):
+
+    """run the benchmarks; returns the results by label"""
+
+    results = {}
+    for fullName, module, fct in benchmarks:
+        for params in paramSets(fct):
+            name = label(fullName, fct, params)
+            try:
+                times = timeBenchmark(module, fct, params, repeat)
+            except Exception:
+                print(f"{name}: failed")
+                traceback.print_exc()
+                results[name] = {"error": traceback.format_exc(limit=1)}
+                continue
+            unit = getattr(fct, "unit", "s")
+            results[name] = {"median": statistics.median(times), "min": min(times), "times": times, "unit": unit}
+            print(f"{name:70s} median {results[name]['median']:8.3f}{unit}  min {results[name]['min']:8.3f}{unit}")
+    return results
+
+
+def writeResults(results, resultsDir, repeat):
+
+    """write the results, with the commit and the versions; returns the file name"""
+
+    commit = gitCommit()
+    now = datetime.now()
+    record = {"commit": commit, "date": now.isoformat(timespec="seconds"), "host": socket.gethostname(),
+              "python": sys.version.split()[0], "versions": versions(), "repeat": repeat,
+              "results": results}
+    outDir = Path(resultsDir) / socket.gethostname()
+    outDir.mkdir(parents=True, exist_ok=True)
+    fName = outDir / f"{now.strftime('%Y%m%dT%H%M%S')}-{commit.replace('+', 'dirty')}.json"
+    with fName.open("w", encoding="utf-8") as f:
+        json.dump(record, f, indent=1, default=str)
+    return fName
+
+
+def latestResults(resultsDir, exclude=None):
+
+    """the last result file of this host, other than exclude"""
+
+    fNames = sorted(f for f in (Path(resultsDir) / socket.gethostname()).glob("*.json") if f != exclude)
+    return fNames[-1] if fNames else None
+
+
+def compare(old, new, threshold):
+
+    """
+    print the ratio of the median times of the benchmarks in two result records.
+
+    Returns the names of the benchmarks that are slower by more than threshold;
+    for tracked values (not in seconds), by more than the threshold as a
+    fraction of the old value.
+    """
+
+    print(f"compared with {old['commit']} of {old['date']}")
+    for package in sorted(set(old["versions"]) | set(new["versions"])):
+        before, after = old["versions"].get(package), new["versions"].get(package)
+        if before != after:
+            print(f"  {package} changed: {before!r} -> {after!r}")
+
+    slower = []
+    for name, result in new["results"].items():
+        before = old["results"].get(name, {}).get("median")
+        if before is None or "median" not in result:
+            continue
+        unit = result.get("unit", "s")
+        if unit != "s":
+            # tracked values can be 0, so compare the difference
+            flag = ""
+            if result["median"] - before > (threshold - 1) * max(abs(before), 1):
+                flag = "  WORSE"
+                slower.append(name)
+            print(f"{name:70s} {before:8.3f}{unit} -> {result['median']:8.3f}{unit}{flag}")
+            continue
+        ratio = result["median"] / before
+        flag = ""
+        if ratio > threshold:
+            flag = "  SLOWER"
+            slower.append(name)
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(f"{name:70s} {before:8.3f}s -> {result['median']:8.3f}s  x{ratio:5.2f}{flag}")
+    return slower
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--bench', type=str, default=None,
+                        help='only run the benchmarks matching this regular expression')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of times each benchmark is run')
+    parser.add_argument('--resultsDir', type=str, default=str(RESULTS_DIR),
+                        help='directory for the result files')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='result file to compare with, or "latest" for the last one of this host')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio of the median times above which a benchmark counts as slower')
+    args = parser.parse_args()
+
+    results = runAll(findBenchmarks(args.bench), args.repeat)
+    fName = writeResults(results, args.resultsDir, args.repeat)
+    print(f"Results written to {fName}")
+
+    if args.compare:
+        oldName = latestResults(args.resultsDir, exclude=fName) if args.compare == "latest" else args.compare
+        if oldName is None:
+            print("No earlier results to compare with")
+        else:
+            with open(oldName, encoding="utf-8") as f:
+                old = json.load(f)
+            with open(fName, encoding="utf-8") as f:
+                new = json.load(f)
+            if compare(old, new, args.threshold):
+                sys.exit(1)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Run a campaign of simulation blocks through a single pool of workers.
+
+runESO.sh runs the blocks in simulationBlocks/ one after the other, each in
+its own Python process. Here the block scripts are read (by running them with
+runSimulationBlock.collectBlocks active, so they only report their YAML files
+and parameters), all the blocks are planned, and all their exposures are run
+together by one worker pool of nCores processes. Within a block, the start
+dates are chained from one YAML file to the next as in runSimulationBlock;
+the blocks themselves are independent.
+
+    python -m metis_simulations.campaign [--only imgLM --only ifu] [--from lssN] [-n 16] [--small]
+
+Options that are not recognised here (e.g. --small, --reuseSignal, --resume)
+are passed on to each block, as with the individual block scripts.
+
+With --sofTemplates, the SOF files are written (see makeSOF) once all the
+exposures are done.
+"""
+
+import argparse
+import os
+import runpy
+import sys
+from pathlib import Path
+
+# the same defaults as runESO.sh; they are read when the modules are imported
+os.environ.setdefault("MSIM_YAML_DIR", "YAML/ESO")
+os.environ.setdefault("MSIM_NCORES", "4")
+os.environ.setdefault("MSIM_OUTDIR", "output")
+os.environ.setdefault("DEFAULT_IRDB_LOCATION", "inst_pkgs")
+
+from . import runSimulationBlock as rs
+from . import setupSimulations as ss
+from .runGraph import RunGraph
+from .makeSOF import makeSOF
+
+DEFAULT_BLOCKS = ["imgLM", "imgN", "lssLM", "lssN", "ifu", "calib",
+                  "hciRavcLM", "hciAppLm", "hciRavcIfu"]
+
+
+def loadBlock(blockFile):
+
+    """
+    read the YAML files and parameters of a block script, without running it.
+
+    Returns a list of (yamlFiles, params) for each call to runSimulationBlock in the script.
+    """
+
+    with rs.collectBlocks() as blocks:
+        runpy.run_path(str(blockFile), run_name="__main__")
+    return blocks
+
+
+def selectBlocks(only=None, start=None):
+
+    """the blocks to run, in the order of DEFAULT_BLOCKS, as selected by --only and --from"""
+
+    if only and start:
+        raise ValueError("--from cannot be combined with --only")
+    if only:
+        unknown = [b for b in only if b not in DEFAULT_BLOCKS]
+        if unknown:
+            raise ValueError(f"Unknown block(s): {', '.join(unknown)}")
+        return list(only)
+    if start:
+        if start not in DEFAULT_BLOCKS:
+            raise ValueError(f"Unknown block: {start}")
+        return DEFAULT_BLOCKS[DEFAULT_BLOCKS.index(start):]
+    return list(DEFAULT_BLOCKS)
+
+
+def planCampaign(blockNames, blockDir, args):
+
+    """
+    plan all the exposures of a list of blocks.
+
+    Returns a list of (name, plan, params) of the planned blocks.
+    """
+
+    planned = []
+    for name in blockNames:
+        for yamlFiles, params in loadBlock(Path(blockDir) / f"{name}.py"):
+            blockPlan = rs.planSimulationBlock(yamlFiles, params, args)
+            if blockPlan is None:
+                continue
+            print(f"[INFO] {name}: {len(blockPlan)} exposures planned")
+            planned.append((name, blockPlan, params))
+    return planned
+
+
+def runCampaign(blockNames, blockDir="simulationBlocks", nCores=None, args=(),
+                sofTemplates=None, sofDir="sofFiles"):
+
+    """
+    plan all the blocks, then run all their exposures with a single pool of
+    nCores processes. The static calibrations and summaries of the blocks
+    are made alongside (see runGraph). If sofTemplates is given, the SOF
+    files for the templates in it are written to sofDir at the end.
+    """
+
+    args = list(args)
+    planned = planCampaign(blockNames, blockDir, args)
+
+    # the options that apply to the whole run, as for the blocks
+    params = ss.setupSimulations().parseCommandLine(args)
+    params['nCores'] = int(nCores if nCores is not None else os.environ['MSIM_NCORES'])
+    params['testRun'] = bool(params['testRun'])
+
+    graph = RunGraph(params)
+    for name, blockPlan, blockParams in planned:
+        graph.addBlock(name, blockPlan, blockParams)
+
+    print(f"[INFO] Running {len(graph.plan)} exposures from {len(planned)} blocks on {params['nCores']} cores")
+    graph.run()
+
+    if sofTemplates and not params['testRun']:
+        makeSOF(sofTemplates, sofDir, os.environ["MSIM_OUTDIR"])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="run simulation blocks with a shared worker pool")
+    parser.add_argument("--blockDir", type=str, default="simulationBlocks",
+                        help="directory with the block scripts")
+    parser.add_argument("--only", action="append", default=None,
+                        help="run only the given block (can be repeated)")
+    parser.add_argument("--from", dest="start", type=str, default=None,
+                        help="run from the given block to the end")
+    parser.add_argument("-n", "--nCores", type=int, default=None,
+                        help="total number of cores for all blocks (default MSIM_NCORES)")
+    parser.add_argument("--sofTemplates", type=str, default=None,
+                        help="write the SOF files for the templates in this directory at the end")
+    parser.add_argument("--sofDir", type=str, default="sofFiles",
+                        help="directory for the SOF files (default sofFiles)")
+    parser.add_argument("--list", action="store_true",
+                        help="print the available blocks and exit")
+    campaignArgs, blockArgs = parser.parse_known_args()
+
+    if campaignArgs.list:
+        print("\n".join(DEFAULT_BLOCKS))
+        sys.exit()
+
+    try:
+        blockNames = selectBlocks(campaignArgs.only, campaignArgs.start)
+    except ValueError as err:
+        sys.exit(f"error: {err}")
+
+    runCampaign(blockNames, campaignArgs.blockDir, campaignArgs.nCores, blockArgs,
+                campaignArgs.sofTemplates, campaignArgs.sofDir)
@@ -7,59 +7,205 @@ METIS_DRLD> pip install -e .
 But that does not always work (TODO: fix), so you can also specify the
 Python path:
 export PYTHONPATH=/path/to/METIS_DRLD/codes
+
+Only the headers are read (see headerScan.readHeaderCards), by a pool of
+worker processes, and the keywords are checked as they are written in the
+files. All the problems are collected rather than stopping at the first one,
+and reported as (file, HDU, keyword, rule, detail); with --report they are also
+written to a CSV file. The exit code is 1 if there are any.
+
+    python check_headers.py [output/imgLM ...] [-n 8] [--report violations.csv]
 """
 
+import argparse
+import csv
 import sys
+from collections import Counter, namedtuple
+from functools import cache
+from multiprocessing import Pool
 from pathlib import Path
 
-from astropy.io import fits
-
 from codes.drld_parser.data_reduction_library_design import METIS_DataReductionLibraryDesign
 
 from compare_yaml_with_drld import HACK_RAWS_THAT_SHOULD_BE_ADDED_TO_THE_DRLD
 
-def checkHeaders(argv):
-    if(len(sys.argv) > 1):
-       inDir = argv[1]
-    else:
-       inDir = "output"
-    
-    PATH_HERE = Path(__file__).parents[1]
-    PATH_OUTPUT = PATH_HERE / inDir
-    
-    print(PATH_OUTPUT)
-    
-    ks_toplevel_allowed = {"ESO", "WISE"}
-    
-    fns_fits = PATH_OUTPUT.glob("*.fits")
-    
-    for fn_fits in fns_fits:
-        print(fn_fits)
-        hdus = fits.open(fn_fits)
-        for hdu in hdus:
-            for card in hdu.header.cards:
-                k, v, c = card
-                ks = k.split()
-                # Assert keyword is uppercase.
-                assert k.upper() == k, k
-                # Assert HIERARCH keywords start with allowed top level key.
-                if len(ks) > 1:
-                    assert ks[0] in ks_toplevel_allowed, k
-                # Assert all subsystems in HIERARCH keyword are max 8 characters.
-                assert all(len(ki) <= 8 for ki in ks), k
-    
-        fn_split = fn_fits.name.split(".")
-        catg = fn_split[1] if fn_split[0] == "METIS" else fn_split[0]
-        if catg in HACK_RAWS_THAT_SHOULD_BE_ADDED_TO_THE_DRLD:
-            continue
+from metis_simulations.headerIndex import doCatg
+from metis_simulations.headerScan import cardKeyword, cardValue, readHeaderCards
+
+KS_TOPLEVEL_ALLOWED = {"ESO", "WISE"}
+
+# the keywords of the primary header that are compared with the DRLD
+DPR_KEYWORDS = {"ESO DPR CATG": "dpr_catg", "ESO DPR TYPE": "dpr_type", "ESO DPR TECH": "dpr_tech"}
+
+# hdu and keyword are None for problems with the whole file
+Violation = namedtuple("Violation", ["fName", "hdu", "keyword", "rule", "detail"])
+
+
+def checkKeyword(k):
+
+    """the rules a keyword breaks"""
+
+    rules = []
+    ks = k.split()
+    # Keyword is uppercase.
+    if k.upper() != k:
+        rules.append("keyword is not upper case")
+    # HIERARCH keywords start with allowed top level key.
+    if len(ks) > 1 and ks[0] not in KS_TOPLEVEL_ALLOWED:
+        rules.append(f"top level is not one of {', '.join(sorted(KS_TOPLEVEL_ALLOWED))}")
+    # All subsystems in HIERARCH keyword are max 8 characters.
+    if not all(len(ki) <= 8 for ki in ks):
+        rules.append("part of the keyword is longer than 8 characters")
+    return rules
+
+
+def checkFile(fName):
+
+    """
+    check the keywords of all the headers of a file.
+
+    Returns the list of violations, and the DPR keywords of the primary header
+    (None if the headers can't be read).
+    """
+
+    try:
+        allCards = readHeaderCards(fName)
+    except (OSError, ValueError) as e:
+        return [Violation(fName, None, None, "headers can't be read", str(e))], None
+
+    violations = []
+    for hdu, cards in enumerate(allCards):
+        for card in cards:
+            k = cardKeyword(card)
+            # continuation of the previous card's value
+            if k == "CONTINUE":
+                continue
+            for rule in checkKeyword(k):
+                violations.append(Violation(fName, hdu, k, rule, ""))
+
+    dpr = {}
+    for card in allCards[0]:
+        k = cardKeyword(card)
+        if k in DPR_KEYWORDS and k not in dpr:
+            dpr[k] = cardValue(card)
+    return violations, dpr
+
+
+@cache
+def drldItem(catg):
+
+    """the DRLD values of the DPR keywords for a DO.CATG, None if it is not in the DRLD"""
+
+    try:
         di = METIS_DataReductionLibraryDesign.dataitems[catg]
-        if di.dpr_catg:
-            assert hdus[0].header["ESO DPR CATG"] == di.dpr_catg
-        if di.dpr_type:
-            assert hdus[0].header["ESO DPR TYPE"] == di.dpr_type
-        if di.dpr_tech:
-            assert hdus[0].header["ESO DPR TECH"] == di.dpr_tech
+    except KeyError:
+        return None
+    return {k: getattr(di, attr) for k, attr in DPR_KEYWORDS.items()}
+
+
+def checkDRLD(fName, dpr):
+
+    """compare the DPR keywords of a file with the DRLD entry of its DO.CATG"""
+
+    catg = doCatg(fName)
+    if catg in HACK_RAWS_THAT_SHOULD_BE_ADDED_TO_THE_DRLD:
+        return []
+    expected = drldItem(catg)
+    if expected is None:
+        return [Violation(fName, 0, None, "DO.CATG is not in the DRLD", catg)]
+
+    violations = []
+    for k, value in expected.items():
+        if not value:
+            continue
+        if k not in dpr:
+            violations.append(Violation(fName, 0, k, "missing", f"DRLD has {value}"))
+        elif dpr[k] != value:
+            violations.append(Violation(fName, 0, k, "differs from the DRLD",
+                                        f"{dpr[k]}, DRLD has {value}"))
+    return violations
+
+
+def checkHeaders(fNames, nCores=None):
+
+    """
+    check the headers of a list of files with a pool of nCores processes
+    (default one per core). Returns the list of violations, in the order of the files.
+    """
+
+    fNames = [str(fName) for fName in fNames]
+    if nCores == 1 or len(fNames) <= 1:
+        return _collect(fNames, map(checkFile, fNames))
+    with Pool(processes=nCores) as pool:
+        return _collect(fNames, pool.imap(checkFile, fNames, chunksize=16))
+
+
+def _collect(fNames, results):
+
+    """the violations of all the files; the DRLD checks are done in this process, with a cache"""
+
+    violations = []
+    for fName, (fileViolations, dpr) in zip(fNames, results):
+        violations.extend(fileViolations)
+        if dpr is not None:
+            violations.extend(checkDRLD(fName, dpr))
+    return violations
+
+
+def printReport(violations, nFiles):
+
+    """print the number of violations of each rule, and the first few of them"""
+
+    if not violations:
+        print(f"{nFiles} files checked, no problems found")
+        return
+    nBad = len({v.fName for v in violations})
+    print(f"{nFiles} files checked, {len(violations)} problems in {nBad} files")
+    counts = Counter(v.rule for v in violations)
+    for rule, n in counts.most_common():
+        examples = [v for v in violations if v.rule == rule][:3]
+        print(f"- {rule}: {n}")
+        for v in examples:
+            print(f"  - {v.fName} HDU {v.hdu} {v.keyword or ''} {v.detail}")
+
+
+def writeReport(violations, fName):
+
+    """write the violations to a CSV file"""
+
+    with open(fName, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(Violation._fields)
+        writer.writerows(violations)
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inDir', nargs='*', default=["output"],
+                        help='directories with the FITS files, relative to the repository')
+    parser.add_argument('-n', '--nCores', type=int, default=None,
+                        help='number of worker processes (default one per core)')
+    parser.add_argument('--report', type=str, default=None,
+                        help='write all the problems to this CSV file')
+    args = parser.parse_args(argv[1:])
+
+    PATH_HERE = Path(__file__).parents[1]
+
+    fNames = []
+    for inDir in args.inDir:
+        PATH_OUTPUT = PATH_HERE / inDir
+        print(PATH_OUTPUT)
+        fNames.extend(sorted(PATH_OUTPUT.glob("*.fits")))
+
+    violations = checkHeaders(fNames, args.nCores)
+    printReport(violations, len(fNames))
+    if args.report:
+        writeReport(violations, args.report)
+    return not violations
+
 
 if __name__ == "__main__":
-    
-    checkHeaders(sys.argv)
+
+    if not main(sys.argv):
+        sys.exit(1)
@@ -8,14 +8,28 @@ But that does not always work (TODO: fix), so you can also specify the
 Python path:
 export PYTHONPATH=/path/to/METIS_DRLD/codes
 """
+import os
+from functools import cache
 from pathlib import Path
 from codes.drld_parser.data_reduction_library_design import METIS_DataReductionLibraryDesign
 
+from metis_simulations.headerIndex import HeaderIndex
+
 
 PATH_HERE = Path(__file__).parent
 PATH_FITS = PATH_HERE / "output"
 
 
+@cache
+def output_files():
+    """The names of the FITS files in PATH_FITS, from its header index."""
+    if not PATH_FITS.is_dir():
+        return frozenset()
+    index = HeaderIndex(PATH_FITS)
+    index.update()
+    return frozenset(os.path.basename(fn) for fn in index.select())
+
+
 def check_sof_file(filename, problems_raws, problems_tags, problems_names, problems_input):
     # E.g. "metis_lm_img_flat.twilight.sof" -> "metis_lm_img_flat"
     recipe_name = filename.stem.split(".")[0]
@@ -56,7 +70,7 @@ def check_sof_file(filename, problems_raws, problems_tags, problems_names, probl
     fns_raw_missing = [
         fn
         for fn in fns_raw
-        if not (PATH_FITS / fn).exists()
+        if fn not in output_files()
     ]
     if fns_raw_missing:
         problems_raws.append((filename.name, fns_raw_missing))
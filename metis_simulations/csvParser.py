@@ -190,6 +190,45 @@ DO_CATG_MAP = {
 }
 
 
+# ScopeSim mode for each tech (LSS_LM depends on the grism, see _ModeSpec)
+MODE_MAP = {
+    "IMAGE_LM": "img_lm",
+    "IMAGE_N":  "img_n",
+    "IFU":      "lms",
+    "LSS_N":    "lss_n",
+}
+
+# For LSS modes, ScopeSim only accepts L_spec/M_spec/N_spec per the
+# validFilters configuration in simulationDefinitions.py. The imaging
+# filter wheel value from the CSV is NOT used for LSS modes.
+#
+# TODO: If ScopeSim adds support for imaging filters in LSS modes in
+# the future, map INS.OPTI10/13.NAME through the filter mapping tables
+# here instead of forcing the _spec filters.
+#
+# base mode -> fixed filter name, or (filter wheel column, mapping table, band)
+FILTER_SPEC = {
+    "lss_l":  "L_spec",
+    "lss_m":  "M_spec",
+    "lss_n":  "N_spec",
+    "lms":    "open",
+    "img_lm": ("INS.OPTI10.NAME", FILTER_MAP_LM, "LM"),
+    "img_n":  ("INS.OPTI13.NAME", FILTER_MAP_N, "N"),
+}
+
+# base mode -> ND filter wheel column; the other modes have no ND filter
+ND_COLUMN = {
+    "img_lm": "INS.OPTI11.NAME",
+    "lss_l":  "INS.OPTI11.NAME",
+    "lss_m":  "INS.OPTI11.NAME",
+    "img_n":  "INS.OPTI14.NAME",
+    "lss_n":  "INS.OPTI14.NAME",
+}
+
+# techs tried, in order, for darks with an UNKNOWN tech
+UNKNOWN_FALLBACK = ["IMAGE_LM", "IMAGE_N", "IFU"]
+
+
 def _clean_value(val):
     """Convert NULL/empty to None, strip whitespace"""
     if val is None:
@@ -210,135 +249,6 @@ def _parse_tech_list(tech_string):
     return [t.strip() for t in s.split(",") if t.strip()]
 
 
-def _determine_mode(tech, row):
-    """Derive ScopeSim mode from CSV tech + instrument state"""
-    wcu_active = (row.get("INS.OPTI17.NAME") == "IN")
-    prefix = "wcu_" if wcu_active else ""
-
-    if tech == "IMAGE_LM":
-        return prefix + "img_lm"
-    if tech == "IMAGE_N":
-        return prefix + "img_n"
-    if tech == "IFU":
-        return prefix + "lms"
-    if tech == "LSS_LM":
-        grism = row.get("INS.OPTI9.NAME")
-        if grism == "GRISM-M":
-            return prefix + "lss_m"
-        return prefix + "lss_l"
-    if tech == "LSS_N":
-        return prefix + "lss_n"
-    if tech == "UNKNOWN":
-        if row.get("DET1.DIT") is not None:
-            return prefix + "img_lm"
-        if row.get("DET2.DIT") is not None:
-            return prefix + "img_n"
-        if row.get("DET3.DIT") is not None:
-            return prefix + "lms"
-    raise ValueError(f"Cannot determine mode for tech={tech}")
-
-
-def _map_filter(mode, row):
-    """
-    Map the filter name for a given mode from CSV columns.
-
-    For LSS modes, ScopeSim only accepts L_spec/M_spec/N_spec per the
-    validFilters configuration in simulationDefinitions.py. The imaging
-    filter wheel value from the CSV is NOT used for LSS modes.
-
-    TODO: If ScopeSim adds support for imaging filters in LSS modes in
-    the future, update this function to map INS.OPTI10/13.NAME through
-    the filter mapping tables instead of forcing the _spec filters.
-    """
-    base_mode = mode.replace("wcu_", "")
-
-    if base_mode == "lss_l":
-        return "L_spec"
-    if base_mode == "lss_m":
-        return "M_spec"
-    if base_mode == "lss_n":
-        return "N_spec"
-    if base_mode == "lms":
-        return "open"
-    if base_mode == "img_lm":
-        ics_name = row.get("INS.OPTI10.NAME")
-        if ics_name is None:
-            return "open"
-        mapped = FILTER_MAP_LM.get(ics_name)
-        if mapped is None:
-            logger.warning("Unmapped LM filter '%s', passing through", ics_name)
-            return ics_name
-        return mapped
-    if base_mode == "img_n":
-        ics_name = row.get("INS.OPTI13.NAME")
-        if ics_name is None:
-            return "open"
-        mapped = FILTER_MAP_N.get(ics_name)
-        if mapped is None:
-            logger.warning("Unmapped N filter '%s', passing through", ics_name)
-            return ics_name
-        return mapped
-
-    return "open"
-
-
-def _map_nd_filter(mode, row):
-    """Map ND filter from CSV. Returns (nd_filter_name, is_dark_override)"""
-    base_mode = mode.replace("wcu_", "")
-
-    if base_mode in ("img_lm", "lss_l", "lss_m"):
-        ics_name = row.get("INS.OPTI11.NAME")
-    elif base_mode in ("img_n", "lss_n"):
-        ics_name = row.get("INS.OPTI14.NAME")
-    else:
-        return "open", False
-
-    if ics_name is None:
-        return "open", False
-
-    mapped = ND_MAP.get(ics_name, "open")
-    is_dark = (ics_name == "DARK")
-    return mapped, is_dark
-
-
-def _map_slit(row):
-    """Map CFO FP2 slit wheel to ScopeSim slit name, None if no slit"""
-    fp2 = row.get("INS.OPTI3.NAME")
-    if fp2 is None:
-        return None
-    return SLIT_MAP.get(fp2)
-
-
-def _build_wcu(row):
-    """Build WCU config dict if WCU periscopic arm is IN, else None"""
-    if row.get("INS.OPTI17.NAME") != "IN":
-        return None
-
-    aperture_name = row.get("INS.OPTI19.NAME")
-    bb_aperture = BB_APERTURE_MAP.get(aperture_name, 0.0) if aperture_name else 0.0
-
-    fpmask_name = row.get("INS.OPTI20.NAME")
-    current_fpmask = FPMASK_MAP.get(fpmask_name, "open") if fpmask_name else "open"
-
-    bb_temp_str = row.get("SEQ.WCU_BB_TEMP")
-    if bb_temp_str is not None and bb_temp_str != "0":
-        try:
-            bb_temp = int(float(bb_temp_str))
-        except (ValueError, TypeError):
-            bb_temp = 300
-    else:
-        bb_temp = 300
-
-    return {
-        "current_lamp": "bb",
-        "current_fpmask": current_fpmask,
-        "bb_aperture": bb_aperture,
-        "bb_temp": bb_temp,
-        "is_temp": 300,
-        "wcu_temp": 300,
-    }
-
-
 def _build_do_catg(tech_dpr, type_dpr):
     """Look up do.catg from DRLD Table 6, falls back to generic construction"""
     key = (tech_dpr, type_dpr)
@@ -368,166 +278,308 @@ def _map_type(type_str):
     return TYPE_MAP.get(type_str, type_str)
 
 
-def _map_tech(tech):
-    """Map a single CSV tech string to DPR.TECH YAML convention"""
-    return TECH_MAP.get(tech, tech)
-
-
-def _get_detector_params(tech, row):
-    """Get (dit, ndit, nObs) for the detector corresponding to this tech"""
-    det_keys = DET_MAP.get(tech)
-    if det_keys is None:
-        return None
+class _CleanValues(dict):
+    """
+    _clean_value of the values in a file, remembered as most cells
+    repeat (NULL, filter names, DITs); cleared when it gets large, so that
+    unique values (test IDs) don't accumulate
+    """
 
-    dit_key, ndit_key, nexpo_key = det_keys
-    dit_str = row.get(dit_key)
-    ndit_str = row.get(ndit_key)
+    def __missing__(self, val):
+        if len(self) > 10000:
+            self.clear()
+        cleaned = self[val] = _clean_value(val)
+        return cleaned
 
-    if dit_str is None:
-        return None
 
+def _to_int(val_str, default):
+    """int of a number in a CSV cell, default if empty or invalid"""
     try:
-        dit = float(dit_str)
+        return int(float(val_str)) if val_str is not None else default
     except (ValueError, TypeError):
-        return None
+        return default
 
-    try:
-        ndit = int(float(ndit_str)) if ndit_str is not None else 1
-    except (ValueError, TypeError):
-        ndit = 1
 
-    nexpo_str = row.get(nexpo_key)
-    try:
-        nObs = int(float(nexpo_str)) if nexpo_str is not None else 1
-    except (ValueError, TypeError):
-        nObs = 1
+class _ModeSpec():
+    """
+    Everything about a recipe that only depends on the tech, whether the
+    WCU is in, and the LSS grism, with the column positions of one file
+    """
 
-    return dit, ndit, nObs
+    def __init__(self, tech, wcu_active, grism_m, col):
+        base_mode = MODE_MAP.get(tech)
+        if tech == "LSS_LM":
+            base_mode = "lss_m" if grism_m else "lss_l"
+        self.mode = ("wcu_" if wcu_active else "") + base_mode
+        self.tech_dpr = TECH_MAP.get(tech, tech)
 
+        filt = FILTER_SPEC[base_mode]
+        if isinstance(filt, str):
+            self.filter_name, self.filter_col = filt, -1
+        else:
+            column, self.filter_map, self.band = filt
+            self.filter_name, self.filter_col = None, col(column)
+        self.nd_col = col(ND_COLUMN.get(base_mode))
 
-def loadCSV(filepath, write_yaml=False):
-    """
-    Parse an AIT Performance Test Sequence CSV file into a dict of recipe
-    blocks compatible with the YAML input format used by setupSimulations.
 
-    If write_yaml is True, also writes the parsed recipes to a .yaml file
-    next to the CSV for inspection.
+class RowTransformer():
     """
-    filepath = Path(filepath)
-    allrcps = {}
+    Maps the rows of one AIT CSV file to recipes.
 
-    with filepath.open(encoding="utf-8") as f:
-        reader = csv.reader(f)
-
-        column_ids = next(reader)
-        _components = next(reader)
-        _descriptions = next(reader)
-        _data_types = next(reader)
-
-        column_ids = [c.strip() for c in column_ids]
+    The column header is resolved once into the positions of the columns
+    that are used, and the mapping tables are combined into a _ModeSpec for
+    each (tech, WCU in, LSS grism), so a row is mapped with a few list and
+    dict lookups. Only the used columns of a row are cleaned; a column that
+    is not in the file has index -1, which is always None.
+    """
 
-        for raw_row in reader:
-            row = {}
-            for i, col_id in enumerate(column_ids):
-                val = raw_row[i] if i < len(raw_row) else None
-                row[col_id] = _clean_value(val)
+    def __init__(self, column_ids):
+        # with duplicated columns, the last one is used
+        positions = {col_id: i for i, col_id in enumerate(column_ids)}
+        self.columns = []
+
+        def col(name):
+            """index of a column in the cleaned row"""
+            if name not in positions:
+                return -1
+            if name not in self.columns:
+                self.columns.append(name)
+            return self.columns.index(name)
+
+        self.test_id = col("test_ID")
+        self.step = col("step_number")
+        self.template_name = col("templateName")
+        self.tech = col("DPR.TECH")
+        self.type = col("DPR.TYPE")
+        self.catg = col("DPR.CATG")
+        self.has_catg = "DPR.CATG" in positions
+        self.grism = col("INS.OPTI9.NAME")
+        self.slit = col("INS.OPTI3.NAME")
+        self.wcu = col("INS.OPTI17.NAME")
+        self.bb_aperture = col("INS.OPTI19.NAME")
+        self.fpmask = col("INS.OPTI20.NAME")
+        self.bb_temp = col("SEQ.WCU_BB_TEMP")
+        self.det = {tech: tuple(col(key) for key in keys) for tech, keys in DET_MAP.items()}
+
+        self.specs = {(tech, wcu_active, grism_m): _ModeSpec(tech, wcu_active, grism_m, col)
+                      for tech in DET_MAP
+                      for wcu_active in (False, True)
+                      for grism_m in (False, True)}
+
+        self.positions = [positions[name] for name in self.columns]
+        self.n_min = max(self.positions, default=-1) + 1
+        self.clean = _CleanValues().__getitem__
+        self.techs = {}
+
+    def _row(self, raw_row):
+        """the cleaned values of the used columns, and a trailing None"""
+        clean = self.clean
+        if len(raw_row) >= self.n_min:
+            row = [clean(raw_row[i]) for i in self.positions]
+        else:
+            n = len(raw_row)
+            row = [clean(raw_row[i]) if i < n else None for i in self.positions]
+        row.append(None)
+        return row
+
+    def _det_params(self, tech, row):
+        """(dit, ndit, nObs) for the detector of this tech, None if there is no valid DIT"""
+        dit_i, ndit_i, nexpo_i = self.det[tech]
+        dit_str = row[dit_i]
+        if dit_str is None:
+            return None
+        try:
+            dit = float(dit_str)
+        except (ValueError, TypeError):
+            return None
+        return dit, _to_int(row[ndit_i], 1), _to_int(row[nexpo_i], 1)
+
+    def transform(self, raw_row):
+        """
+        list the (block name, recipe) of a row, one for each of its techs;
+        the block names are not made unique yet
+        """
+        row = self._row(raw_row)
+
+        test_id = row[self.test_id]
+        step = row[self.step]
+
+        tech_str = row[self.tech]
+        if tech_str is None:
+            logger.info("Skipping row %s/%s: no DPR.TECH", test_id, step)
+            return []
+
+        techs = self.techs.get(tech_str)
+        if techs is None:
+            techs = self.techs[tech_str] = _parse_tech_list(tech_str)
+
+        wcu_active = (row[self.wcu] == "IN")
+        grism_m = (row[self.grism] == "GRISM-M")
+
+        recipes = []
+        for tech in techs:
+            det_params = self._det_params(tech, row) if tech in self.det else None
+            if det_params is None:
+                # For UNKNOWN tech, try all detectors
+                if tech == "UNKNOWN":
+                    for fallback_tech in UNKNOWN_FALLBACK:
+                        det_params = self._det_params(fallback_tech, row)
+                        if det_params is not None:
+                            tech = fallback_tech
+                            break
+                if det_params is None:
+                    logger.info("Skipping %s/%s tech=%s: no detector data",
+                                test_id, step, tech)
+                    continue
 
-            test_id = row.get("test_ID")
-            step = row.get("step_number")
-            template_name = row.get("templateName")
+            dit, ndit, nObs = det_params
+            spec = self.specs[(tech, wcu_active, grism_m)]
+
+            type_dpr = _map_type(row[self.type])
+            catg = row[self.catg] if self.has_catg else "CALIB"
+
+            filter_name = spec.filter_name
+            if filter_name is None:
+                ics_name = row[spec.filter_col]
+                if ics_name is None:
+                    filter_name = "open"
+                else:
+                    filter_name = spec.filter_map.get(ics_name)
+                    if filter_name is None:
+                        logger.warning("Unmapped %s filter '%s', passing through", spec.band, ics_name)
+                        filter_name = ics_name
+
+            # ND filter (may override filter_name for darks)
+            nd_name = row[spec.nd_col]
+            nd_filter_name = ND_MAP.get(nd_name, "open") if nd_name is not None else "open"
+            if nd_name == "DARK":
+                filter_name = "closed"
+                nd_filter_name = "open"
+
+            # Properties
+            properties = {
+                "dit": dit,
+                "ndit": ndit,
+                "filter_name": filter_name,
+                "nd_filter_name": nd_filter_name,
+                "catg": catg,
+                "tech": spec.tech_dpr,
+                "type": type_dpr,
+                "nObs": nObs,
+                "tplname": row[self.template_name] or "",
+            }
+
+            # CFO FP2 slit wheel
+            slit_name = row[self.slit]
+            slit = SLIT_MAP.get(slit_name) if slit_name is not None else None
+            if slit is not None:
+                properties["slit"] = slit
+
+            recipes.append((f"{test_id}_{step}_{tech.replace(',', '_')}", {
+                "do.catg": _build_do_catg(spec.tech_dpr, type_dpr),
+                "mode": spec.mode,
+                # Source — always empty_sky for AIT test sequences
+                "source": {"name": "empty_sky", "kwargs": {}},
+                "properties": properties,
+                "wcu": self._wcu(row) if wcu_active else None,
+            }))
 
-            tech_str = row.get("DPR.TECH")
-            if tech_str is None:
-                logger.info("Skipping row %s/%s: no DPR.TECH", test_id, step)
-                continue
+        return recipes
 
-            techs = _parse_tech_list(tech_str)
+    def _wcu(self, row):
+        """WCU config dict, for rows with the WCU periscopic arm IN"""
+        aperture_name = row[self.bb_aperture]
+        bb_aperture = BB_APERTURE_MAP.get(aperture_name, 0.0) if aperture_name else 0.0
 
-            for tech in techs:
-                det_params = _get_detector_params(tech, row)
-                if det_params is None:
-                    # For UNKNOWN tech, try all detectors
-                    if tech == "UNKNOWN":
-                        for fallback_tech in ["IMAGE_LM", "IMAGE_N", "IFU"]:
-                            det_params = _get_detector_params(fallback_tech, row)
-                            if det_params is not None:
-                                tech = fallback_tech
-                                break
-                    if det_params is None:
-                        logger.info("Skipping %s/%s tech=%s: no detector data",
-                                    test_id, step, tech)
-                        continue
-
-                dit, ndit, nObs = det_params
-
-                try:
-                    mode = _determine_mode(tech, row)
-                except ValueError as e:
-                    logger.warning("Skipping %s/%s: %s", test_id, step, e)
-                    continue
+        fpmask_name = row[self.fpmask]
+        current_fpmask = FPMASK_MAP.get(fpmask_name, "open") if fpmask_name else "open"
 
-                tech_dpr = _map_tech(tech)
-                type_dpr = _map_type(row.get("DPR.TYPE"))
-                catg = row.get("DPR.CATG", "CALIB")
+        bb_temp_str = row[self.bb_temp]
+        if bb_temp_str is not None and bb_temp_str != "0":
+            bb_temp = _to_int(bb_temp_str, 300)
+        else:
+            bb_temp = 300
 
-                filter_name = _map_filter(mode, row)
+        return {
+            "current_lamp": "bb",
+            "current_fpmask": current_fpmask,
+            "bb_aperture": bb_aperture,
+            "bb_temp": bb_temp,
+            "is_temp": 300,
+            "wcu_temp": 300,
+        }
 
-                # ND filter (may override filter_name for darks)
-                nd_filter_name, is_nd_dark = _map_nd_filter(mode, row)
-                if is_nd_dark:
-                    filter_name = "closed"
 
-                do_catg = _build_do_catg(tech_dpr, type_dpr)
+def iterCSV(filepath):
+    """
+    Parse an AIT Performance Test Sequence CSV file row by row, yielding
+    (block name, recipe) pairs in the order of the file.
 
-                # Properties
-                properties = {
-                    "dit": dit,
-                    "ndit": ndit,
-                    "filter_name": filter_name,
-                    "nd_filter_name": nd_filter_name if not is_nd_dark else "open",
-                    "catg": catg,
-                    "tech": tech_dpr,
-                    "type": type_dpr,
-                    "nObs": nObs,
-                    "tplname": template_name if template_name else "",
-                }
+    The recipes are the same as the entries of loadCSV, without building the
+    dict of all of them; the block names seen so far are kept, to make
+    duplicate names unique.
+    """
+    filepath = Path(filepath)
+    names = set()
 
-                slit = _map_slit(row)
-                if slit is not None:
-                    properties["slit"] = slit
+    with filepath.open(encoding="utf-8") as f:
+        reader = csv.reader(f)
 
-                # Source — always empty_sky for AIT test sequences
-                source = {"name": "empty_sky", "kwargs": {}}
+        column_ids = next(reader)
+        _components = next(reader)
+        _descriptions = next(reader)
+        _data_types = next(reader)
 
-                # WCU
-                wcu = _build_wcu(row)
+        transformer = RowTransformer([c.strip() for c in column_ids])
 
-                # Block name
-                tech_suffix = tech.replace(",", "_")
-                block_name = f"{test_id}_{step}_{tech_suffix}"
+        for raw_row in reader:
+            for block_name, recipe in transformer.transform(raw_row):
 
                 # Handle duplicate block names
-                if block_name in allrcps:
+                if block_name in names:
                     counter = 2
-                    while f"{block_name}_{counter}" in allrcps:
+                    while f"{block_name}_{counter}" in names:
                         counter += 1
                     block_name = f"{block_name}_{counter}"
+                names.add(block_name)
+
+                yield block_name, recipe
+
+
+def writeYAML(recipes, yaml_path):
+    """
+    Write (block name, recipe) pairs to a YAML file one block at a time,
+    giving the same file as dumping the dict of all the recipes.
+
+    Returns the number of blocks written.
+    """
+    n = 0
+    with Path(yaml_path).open("w", encoding="utf-8") as yf:
+        for name, recipe in recipes:
+            yaml.dump({name: recipe}, yf, default_flow_style=False, sort_keys=False)
+            n += 1
+        if n == 0:
+            yaml.dump({}, yf, default_flow_style=False, sort_keys=False)
+    return n
+
 
-                allrcps[block_name] = {
-                    "do.catg": do_catg,
-                    "mode": mode,
-                    "source": source,
-                    "properties": properties,
-                    "wcu": wcu,
-                }
+def loadCSV(filepath, write_yaml=False):
+    """
+    Parse an AIT Performance Test Sequence CSV file into a dict of recipe
+    blocks compatible with the YAML input format used by setupSimulations.
+
+    If write_yaml is True, also writes the parsed recipes to a .yaml file
+    next to the CSV for inspection.
+    """
+    filepath = Path(filepath)
+    allrcps = dict(iterCSV(filepath))
 
     logger.info("Loaded %d recipe blocks from %s", len(allrcps), filepath)
     print(f"Loaded {len(allrcps)} recipe blocks from CSV: {filepath}")
 
     if write_yaml:
         yaml_path = filepath.with_suffix(".yaml")
-        with yaml_path.open("w", encoding="utf-8") as yf:
-            yaml.dump(allrcps, yf, default_flow_style=False, sort_keys=False)
+        writeYAML(allrcps.items(), yaml_path)
         print(f"YAML written to: {yaml_path}")
 
     return allrcps
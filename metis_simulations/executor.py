@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""
+Parallel execution engine for a set of planned exposures.
+
+Each exposure is an exposurePlan.Exposure record, which contains
+everything scopesimWrapper.simulate needs. The exposures are handed to a fixed set of
+worker processes through a bounded work queue, so only a handful of
+exposures are waiting at any time and the exposures can be produced
+lazily by the caller.
+
+All the bookkeeping (filenames, MJD-OBS, TPL.EXPNO) is done when the
+exposures are planned, so the order in which the workers finish does
+not matter.
+
+With a single core the exposures are run in the current process, in order.
+
+If reuseSignal is set, consecutive exposures of the same group (the repeats
+of a dark or flat) are run as one task with scopesimWrapper.simulateRepeats,
+which observes once and only draws new detector noise for each repeat.
+
+If a journal.RunJournal is given, every finished or failed exposure is
+recorded in it by the parent process, so an interrupted run can be resumed.
+Likewise, if a headerIndex.IndexSet is given, the headers of every written
+file are added to it by the parent, so the tools reading the output do not
+have to scan the directory again.
+An onDone callback is called in the parent with the exposures of every
+finished task, e.g. to start post-processing (see runGraph), and a
+progress.ProgressReporter is told about every finished or failed task, with
+the time the worker spent on it.
+
+Each worker measures the memory of its tasks (the resident memory before
+and after, and the peak during the task), and a memoryBudget.MemoryBudget
+keeps the largest increase of each mode as its estimate. If the budget has a
+limit, no tasks are queued ahead of the workers: the next task is chosen by
+the budget from the next queueSize tasks of the plan when a worker is free,
+so heavy IFU exposures are mixed with light ones, and only started when
+their estimated memory fits (see memoryBudget).
+
+The workers keep optical trains and sources cached between tasks, and memory
+that is freed is not always given back to the system, so a worker is
+replaced by a fresh process after maxTasks tasks, or when its resident memory
+after a task is above maxRssMB (MSIM_WORKER_MAX_TASKS and
+MSIM_WORKER_MAX_RSS, no limit by default). With a single core, the caches
+are cleared instead (scopesimWrapper.releaseState).
+"""
+
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import time
+import traceback
+from multiprocessing import cpu_count
+
+from .memoryBudget import MemoryBudget, MemoryEstimates
+from .scopesimWrapper import releaseState, simulate, simulateRepeats
+from .stageTiming import rssMB, trackedPeakMB, trackPeakRss
+
+
+def getNCores(nCores):
+
+    """number of worker processes to use; always keep one core free"""
+
+    return max(min(int(nCores), cpu_count() - 1), 1)
+
+
+def groupTasks(plan, reuseSignal):
+
+    """yield tuples of exposures that are run as a single task"""
+
+    batch = []
+    for exposure in plan:
+        if batch and not (reuseSignal and exposure.group is not None
+                          and exposure.group == batch[0].group):
+            yield tuple(batch)
+            batch = []
+        batch.append(exposure)
+    if batch:
+        yield tuple(batch)
+
+
+def workerLimits(maxTasks=None, maxRssMB=None):
+
+    """the number of tasks and the resident memory in MB after which a worker is replaced; 0 for no limit"""
+
+    if maxTasks is None:
+        maxTasks = int(os.environ.get("MSIM_WORKER_MAX_TASKS", 0))
+    if maxRssMB is None:
+        maxRssMB = float(os.environ.get("MSIM_WORKER_MAX_RSS", 0))
+    return maxTasks, maxRssMB
+
+
+def retireReason(nTasks, memory, maxTasks, maxRssMB):
+
+    """
+    why a worker should be replaced after nTasks tasks, the last of which
+    left it with memory (resident before, peak, resident after) in MB;
+    None if it shouldn't
+    """
+
+    before, peak, after = memory
+    rss = after if after is not None else peak
+    if maxTasks and nTasks >= maxTasks:
+        return f"{nTasks} tasks"
+    if maxRssMB and rss > maxRssMB:
+        return f"{rss:.0f} MB resident"
+    return None
+
+
+def runTask(exposures):
+
+    """run the exposures of a task, returning only the filenames to the parent"""
+
+    if len(exposures) == 1:
+        exposure = exposures[0]
+        simulate(exposure.fname, exposure.recipe(), small=exposure.small)
+    else:
+        simulateRepeats([exp.fname for exp in exposures],
+                        [exp.recipe() for exp in exposures],
+                        small=exposures[0].small)
+    return [exp.fname for exp in exposures]
+
+
+def _worker(taskQueue, resultQueue, maxTasks=0, maxRssMB=0):
+
+    """
+    worker process: run exposures from the queue until told to stop, or
+    until it has reached one of its limits and has to be replaced
+    """
+
+    nTasks = 0
+    while True:
+        task = taskQueue.get()
+        if task is None:
+            break
+        taskId, exposures = task
+        t0 = time.perf_counter()
+        before = trackPeakRss()
+        try:
+            fnames, error = runTask(exposures), None
+        except Exception:
+            fnames, error = None, traceback.format_exc()
+        memory = (before, trackedPeakMB(), rssMB()[0])
+        nTasks += 1
+        retire = retireReason(nTasks, memory, maxTasks, maxRssMB)
+        resultQueue.put((taskId, fnames, error, os.getpid(), time.perf_counter() - t0, memory, retire))
+        if retire is not None:
+            break
+
+
+def runExposures(plan, nCores=1, queueSize=None, reuseSignal=False, journal=None,
+                 onDone=None, index=None, progress=None, memory=None, maxTasks=None, maxRssMB=None):
+
+    """
+    Run a set of exposures in parallel.
+
+    plan is any iterable of Exposure records. If reuseSignal is set, the
+    repeats of each group are simulated from a single observation. If
+    journal is given, the state of every exposure is recorded in it, and if
+    index is given, the headers of every written file are added to it.
+    onDone(exposures) is called for every finished task, and progress (a
+    progress.ProgressReporter) is told about every finished or failed task.
+    memory (a memoryBudget.MemoryBudget) is told the memory used by every
+    task, and chooses the tasks to start if it has a limit.
+
+    nCores is the requested number of worker processes (one core is
+    always kept free). queueSize is the maximum number of exposures waiting
+    in the work queue, by default twice the number of workers; with a
+    memory limit, it is the number of planned tasks the next one is chosen
+    from. A worker is replaced after maxTasks tasks, or if its resident
+    memory is above maxRssMB after a task (by default MSIM_WORKER_MAX_TASKS
+    and MSIM_WORKER_MAX_RSS; 0 for no limit).
+
+    If an exposure fails, no further exposures are started; the ones
+    already running are allowed to finish, and a RuntimeError is raised.
+
+    Returns the list of filenames that were written, in order of completion.
+    """
+
+    nCores = getNCores(nCores)
+    done = []
+    if memory is None:
+        memory = MemoryBudget(MemoryEstimates())
+    maxTasks, maxRssMB = workerLimits(maxTasks, maxRssMB)
+
+    if nCores == 1:
+        nTasks = 0
+        for taskId, exposures in enumerate(groupTasks(plan, reuseSignal)):
+            t0 = time.perf_counter()
+            before = trackPeakRss()
+            try:
+                fnames = runTask(exposures)
+            except Exception:
+                if journal is not None:
+                    journal.record(exposures, "failed")
+                if progress is not None:
+                    progress.failed([exp.fname for exp in exposures])
+                raise
+            used = (before, trackedPeakMB(), rssMB()[0])
+            memory.finished(taskId, exposures, os.getpid(), used)
+            nTasks += 1
+            reason = retireReason(nTasks, used, maxTasks, maxRssMB)
+            if reason is not None:
+                print(f"Clearing the caches of the simulations after {reason}")
+                releaseState()
+                nTasks = 0
+                rss = rssMB()[0]
+                if maxRssMB and rss is not None and rss > maxRssMB:
+                    print(f"Still {rss:.0f} MB resident without the caches; no longer clearing them for memory")
+                    maxRssMB = 0
+            done.extend(fnames)
+            if journal is not None:
+                journal.record(exposures, "done")
+            if progress is not None:
+                progress.finished(fnames, time.perf_counter() - t0, 0)
+            if index is not None:
+                index.add([exp.fname for exp in exposures])
+            if onDone is not None:
+                onDone(exposures)
+        return done
+
+    if queueSize is None:
+        queueSize = 2 * nCores
+
+    taskQueue = mp.Queue(maxsize=queueSize)
+    resultQueue = mp.Queue()
+    def startWorker():
+        w = mp.Process(target=_worker, args=(taskQueue, resultQueue, maxTasks, maxRssMB), daemon=True)
+        w.start()
+        return w
+
+    workers = [startWorker() for _ in range(nCores)]
+
+    pending = {}
+    failures = []
+
+    def collect(timeout):
+        """wait up to timeout seconds for one result; True if one arrived"""
+        try:
+            taskId, fnames, error, worker, seconds, used, retire = resultQueue.get(timeout=timeout)
+        except queue.Empty:
+            dead = [w for w in workers if w.exitcode not in (None, 0)]
+            if dead:
+                raise RuntimeError(f"{len(dead)} worker process(es) died unexpectedly "
+                                   f"(exit code {dead[0].exitcode})")
+            if progress is not None:
+                progress.tick()
+            return False
+        exposures = pending.pop(taskId)
+        memory.finished(taskId, exposures, worker, used, ok=error is None)
+        # the progress is reported per slot, which keeps its number when its worker is replaced
+        slot = [w.pid for w in workers].index(worker)
+        if retire is not None:
+            # the worker has stopped; wait for it to exit, and start a fresh one
+            print(f"Replacing worker {worker} after {retire}")
+            workers[slot].join()
+            workers[slot] = startWorker()
+            memory.retired(worker)
+        if error is None:
+            done.extend(fnames)
+        else:
+            failures.append(error)
+        if journal is not None:
+            journal.record(exposures, "done" if error is None else "failed")
+        if error is None and index is not None:
+            index.add(fnames)
+        if progress is not None:
+            if error is None:
+                progress.finished(fnames, seconds, slot)
+            else:
+                progress.failed([exp.fname for exp in exposures])
+        if error is None and onDone is not None:
+            onDone(exposures)
+        return True
+
+    # with a memory limit, tasks are only started on free workers, chosen from the next queueSize
+    if memory.limited:
+        maxPending, lookahead = nCores, queueSize
+    else:
+        maxPending, lookahead = queueSize + nCores, 1
+    tasks = enumerate(groupTasks(plan, reuseSignal))
+    waiting = []
+
+    try:
+        while not failures:
+            for task in itertools.islice(tasks, lookahead - len(waiting)):
+                waiting.append(task)
+            if not waiting:
+                break
+            task = memory.choose(waiting) if len(pending) < maxPending else None
+            if task is None:
+                # wait for a free slot (or memory), so the queue stays bounded
+                collect(5)
+                continue
+            taskQueue.put(task)
+            pending[task[0]] = task[1]
+            while collect(0.001):
+                pass
+
+        while pending:
+            collect(5)
+
+        for _ in workers:
+            taskQueue.put(None)
+        for w in workers:
+            w.join()
+    finally:
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+
+    if failures:
+        raise RuntimeError(f"{len(failures)} exposure(s) failed; first error:\n{failures[0]}")
+
+    return done
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Serialisable exposure plans.
+
+Planning a set of simulations (setupSimulations._run, calculateDarks,
+calculateFlats) produces a list of Exposure records, one per output file,
+with all the time related bookkeeping (dateobs, MJD-OBS, tplstart, tplexpno)
+already filled in. The plan can be written to a JSON file and executed
+later, or by a different process, with executor.runExposures.
+
+datetime values (dateobs, tplstart) are written as {"__datetime__": isoformat}
+so that they are read back as datetime objects.
+
+The records can't be changed: the contents of the recipe (props, wcu,
+source) are kept as read only copies, with the dicts as MappingProxyType and
+the lists as tuples, and recipe() and toDict() give back plain copies.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, fields
+from datetime import datetime
+from pathlib import Path
+from types import MappingProxyType
+
+# the fields with the contents of the recipe, which are frozen
+RECIPE_FIELDS = ("props", "wcu", "source")
+
+
+def _freeze(value):
+
+    """a read only copy of a value of a recipe: dicts as MappingProxyType, lists as tuples"""
+
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+
+    """a plain copy of a frozen value, as it was in the recipe"""
+
+    if isinstance(value, MappingProxyType):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+@dataclass(frozen=True)
+class Exposure:
+
+    """
+    A single planned exposure: the output filename, the ScopeSim mode and the
+    contents of the recipe (properties, wcu, source) for this exposure.
+
+    Exposures with the same group (e.g. the repeats of a dark) differ only in
+    their timestamps, so they can share the same noiseless signal. expId
+    names the exposure uniquely in its block, e.g. detlinLM:DETLIN_2RG_RAW1/0;
+    its random seed is derived from it (see outputCache.getSeed).
+    """
+
+    fname: str
+    doCatg: str
+    mode: str
+    props: MappingProxyType
+    wcu: MappingProxyType = None
+    source: object = None
+    small: bool = False
+    group: str = None
+    expId: str = None
+
+    def __post_init__(self):
+        for name in RECIPE_FIELDS:
+            object.__setattr__(self, name, _freeze(getattr(self, name)))
+
+    def __hash__(self):
+        # equal exposures have the same filename; the frozen dicts can't be hashed
+        return hash(self.fname)
+
+    def __reduce__(self):
+        # a MappingProxyType can't be pickled, e.g. to send the exposure to a worker process
+        return (self.__class__.fromDict, (self.toDict(),))
+
+    @classmethod
+    def fromRecipe(cls, fname, recipe, small=False, group=None, expId=None):
+
+        """make an Exposure from a recipe dictionary, which is copied"""
+
+        return cls(fname=str(fname), doCatg=recipe["do.catg"], mode=recipe["mode"],
+                   props=recipe["properties"], wcu=recipe.get("wcu"),
+                   source=recipe.get("source"), small=bool(small), group=group, expId=expId)
+
+    @property
+    def dit(self):
+        return self.props["dit"]
+
+    @property
+    def ndit(self):
+        return self.props["ndit"]
+
+    @property
+    def mjd(self):
+        return self.props["MJD-OBS"]
+
+    def recipe(self):
+
+        """return a fresh recipe dictionary, as expected by scopesimWrapper.simulate"""
+
+        return {"do.catg": self.doCatg,
+                "mode": self.mode,
+                "source": _thaw(self.source),
+                "properties": _thaw(self.props),
+                "wcu": _thaw(self.wcu),
+                "expId": self.expId}
+
+    def toDict(self):
+        return {field.name: _thaw(getattr(self, field.name)) for field in fields(self)}
+
+    @classmethod
+    def fromDict(cls, d):
+        return cls(**d)
+
+    def contentHash(self):
+
+        """sha256 of the full exposure record, including the filename"""
+
+        text = json.dumps(self.toDict(), sort_keys=True, default=_encodeDefault)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _encodeDefault(obj):
+
+    """JSON encoder for the values that appear in recipes"""
+
+    if isinstance(obj, datetime):
+        return {"__datetime__": obj.isoformat()}
+    if isinstance(obj, Path):
+        return str(obj)
+    # numpy scalars
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"Cannot serialise {type(obj).__name__} in an exposure plan")
+
+
+def _decodeHook(d):
+    if len(d) == 1 and "__datetime__" in d:
+        return datetime.fromisoformat(d["__datetime__"])
+    return d
+
+
+def writePlan(plan, fname):
+
+    """write a list of Exposures to a JSON file"""
+
+    with Path(fname).open("w", encoding="utf-8") as f:
+        json.dump([exp.toDict() for exp in plan], f, indent=1, default=_encodeDefault)
+
+
+def readPlan(fname):
+
+    """read a list of Exposures written by writePlan"""
+
+    with Path(fname).open(encoding="utf-8") as f:
+        return tuple(Exposure.fromDict(d) for d in json.load(f, object_hook=_decodeHook))
+
+
+def outputRoot(fnames):
+
+    """the directory that contains the output files of a plan, None for no files"""
+
+    dirs = {os.path.dirname(os.path.abspath(str(fname))) for fname in fnames}
+    if not dirs:
+        return None
+    return os.path.commonpath(sorted(dirs))
@@ -1,90 +1,85 @@
 #!/usr/bin/env python
-from astropy.io import fits
-import numpy as np
-import pandas as pd
-from importlib import reload
-import glob
-import os
 import argparse
+import os
 
-def generateSummary(fNames,outFileName):
+from .headerScan import scanHeaders
+from .headerIndex import IndexSet
 
-    # get the fits files in the directory
-    outFile = open(outFileName,"w")
+HEADERLINE = "Block\tFile\tDIT\tNDIT\tTech\tCATG\tTYPE\tINS.MODE\tTPL.NAME\tTPL.START\tTPL.EXPNO\tDRS.SLIT\tDRS.FILTER\tDRS.IFU\tDRS.MASK."
 
-    #header line
-    
-    line = "Block\tFile\tDIT\tNDIT\tTech\tCATG\tTYPE\tINS.MODE\tTPL.NAME\tTPL.START\tTPL.EXPNO\tDRS.SLIT\tDRS.FILTER\tDRS.IFU\tDRS.MASK."
-    print(line,file=outFile)
+# the keywords in the summary; pulling as wildcards returns all the matching
+# keywords, to handle different cases
+SUMMARY_KEYWORDS = ['HIERARCH ESO DET DIT', 'HIERARCH ESO DET NDIT',
+                    'HIERARCH ESO DPR TECH', 'HIERARCH ESO DPR CATG', 'HIERARCH ESO DPR TYPE',
+                    'HIERARCH ESO INS MODE',
+                    'HIERARCH ESO TPL NAME', 'HIERARCH ESO TPL START', 'HIERARCH ESO TPL EXPNO',
+                    '*DRS SLIT*', '*DRS FILTER*', '*DRS IFU*']
+
+def generateSummary(fNames,outFileName,nThreads=None):
+
+    """write the summary of a set of files; the headers are read in parallel"""
+
+    table = scanHeaders(fNames,SUMMARY_KEYWORDS,nThreads=nThreads)
+    print(f"Read the headers of {len(table)} files")
+    writeSummary(summaryLines(table),outFileName)
+
+
+def writeSummary(lines,outFileName):
+
+    """write the summary lines of a set of files, with the header line"""
+
+    with open(outFileName,"w") as outFile:
+        print(HEADERLINE,file=outFile)
+        for line in lines:
+            print(line,file=outFile)
+
+
+def summaryLine(fName):
+
+    """the tab separated summary line of a single file"""
+
+    return summaryLines(scanHeaders([fName],SUMMARY_KEYWORDS))[0]
 
-    
-    for fName in fNames:
-        print(fName)
-        hdul = fits.open(fName)
-
-        # pull out the values
-        
-        dit = hdul[0].header['HIERARCH ESO DET DIT']
-        ndit = hdul[0].header['HIERARCH ESO DET NDIT']
-        
-        tech = hdul[0].header['HIERARCH ESO DPR TECH']
-        catg = hdul[0].header['HIERARCH ESO DPR CATG']
-        tipe = hdul[0].header['HIERARCH ESO DPR TYPE']
-
-        tpl = hdul[0].header['HIERARCH ESO TPL NAME']
-        tplStart = hdul[0].header['HIERARCH ESO TPL START']
-        tplExpno = hdul[0].header['HIERARCH ESO TPL EXPNO']
-
-        # pulling as wildcards reuturns a list of the variable names + values, to handle different cases
-
-        slit = hdul[0].header['*DRS SLIT*']
-        filt = hdul[0].header['*DRS FILTER*']
-        ifu = hdul[0].header['*DRS IFU*']
-        mask = hdul[0].header['*DRS MASK*']
-        
-        #ins = hdul[0].header['*INS OPTI*']
-        mode = hdul[0].header['HIERARCH ESO INS MODE']
-
-        #get the fine name w/o pasth
-        
-        fShort = fName.split("/")[1]
-        block = fName.split("/")[2]
-        
+
+def summaryLines(table):
+
+    """the summary lines of the files in a table from headerScan.scanHeaders"""
+
+    wildcards = table.attrs["wildcards"]
+
+    lines = []
+    for fName, row in zip(table.index, table.to_dict("records")):
+
+        # the keywords that are read directly must be there
+        for key in SUMMARY_KEYWORDS:
+            if key not in wildcards and row[key] is None:
+                raise KeyError(f"Keyword '{key}' not found in {fName}")
+
+        # the block is the name of the directory of the file, for any output directory
+
+        block = os.path.basename(os.path.dirname(str(fName)))
+        fShort = os.path.basename(str(fName))
 
         # assemble the output line, tab separated
-        
-        line = f'{fShort}\t{block}\t{dit}\t{ndit}\t{tech}\t{catg}\t{tipe}\t{mode}\t{tpl}\t{tplStart}\t{tplExpno}'
+
+        line = (f"{block}\t{fShort}\t{row['HIERARCH ESO DET DIT']}\t{row['HIERARCH ESO DET NDIT']}"
+                f"\t{row['HIERARCH ESO DPR TECH']}\t{row['HIERARCH ESO DPR CATG']}\t{row['HIERARCH ESO DPR TYPE']}"
+                f"\t{row['HIERARCH ESO INS MODE']}\t{row['HIERARCH ESO TPL NAME']}"
+                f"\t{row['HIERARCH ESO TPL START']}\t{row['HIERARCH ESO TPL EXPNO']}")
 
         # single value, or empty
-        for elem in slit:
-            line = f'{line}{hdul[0].header[elem]}'
-        line=line+"\t"
-        for elem in filt:
-            line = f'{line}{hdul[0].header[elem]}'
+        for group in ('*DRS SLIT*', '*DRS FILTER*', '*DRS IFU*'):
+            for key in wildcards[group]:
+                if row[key] is not None:
+                    line = f'{line}{row[key]}'
+            line=line+"\t"
+        # DRS.MASK is not filled in yet
         line=line+"\t"
-        for elem in ifu:
-            line = f'{line}{hdul[0].header[elem]}'
-        line=line+"\t"
-        #for elem in mask:
-        #    print(ins)
 
-        #    line = f'{line}{hdul[0].header[elem]}'
-        line=line+"\t"
-        
-        ## multiple values
-        #nIns = 0
-        #for elem in ins:
-        #    line = f'{line}{elem}={hdul[0].header[elem]},'
-        #    nIns += 1
-        #
-        #if(nIns > 0):
-        #    # remove the trailing comma
-        #    line=f'{line[:-1]}\t'
-
-        # dump line to file 
-        print(line,file=outFile)
-        hdul.close()
-    outFile.close()
+        lines.append(line)
+
+    return lines
+
 
 if __name__ == "__main__":
 
@@ -103,17 +98,20 @@ if __name__ == "__main__":
     if(args.inDir):
         inDir = args.inDir.split(",")
     else:
-        inDir = "output"
-
+        inDir = ["output"]
 
+    # the headers are taken from the index of each directory, which only
+    # rereads the files that changed since it was last updated
+    indexes = IndexSet()
     fNames = []
     for dirName in inDir:
-        temp = glob.glob(os.path.join(f"{dirName}","METIS*.fits"))
-        fNames = fNames + temp
+        index = indexes.indexFor(dirName)
+        index.update()
+        fNames = fNames + index.select("METIS*.fits")
 
     # sort for tidier output
     fNames.sort()
-    generateSummary(fNames,outFile)
+    writeSummary(summaryLines(indexes.table(fNames,SUMMARY_KEYWORDS)),outFile)
     
  
 
@@ -1,60 +1,62 @@
 #!/usr/bin/env python
-from astropy.io import fits
-import numpy as np
-from importlib import reload
-import glob
-import os
 from pathlib import Path
 
+from metis_simulations.headerIndex import HeaderIndex
+
 dir_output = Path(__file__).parent / "output"
-fNames = list(dir_output.glob("METIS*.fits"))
-fNames.sort()
+index = HeaderIndex(dir_output)
+index.update()
+fNames = index.select("METIS*.fits")
 
 outFile = open("summary.csv","w")
 
 line = "File\tDIT\tNDIT\tTech\tCATG\tTYPE\tDRS.SLIT\tDRS.FILTER\tDRS.IFU\tDRS.MASK\tINS."
 print(line,file=outFile)
 
-for fName in fNames:
+# the headers of all the files are taken from the header index
+table = index.table(fNames, ['HIERARCH ESO DET DIT', 'HIERARCH ESO DET NDIT',
+                             'HIERARCH ESO DPR TECH', 'HIERARCH ESO DPR CATG', 'HIERARCH ESO DPR TYPE',
+                             '*DRS SLIT*', '*DRS FILTER*', '*DRS IFU*', '*DRS MASK*', '*INS OPTI*'])
+wildcards = table.attrs["wildcards"]
+
+for fName, row in zip(table.index, table.to_dict("records")):
     print(fName)
-    hdul = fits.open(fName)
-    dit = hdul[0].header['HIERARCH ESO DET DIT']
-    ndit = hdul[0].header['HIERARCH ESO DET NDIT']
+    dit = row['HIERARCH ESO DET DIT']
+    ndit = row['HIERARCH ESO DET NDIT']
     
-    tech = hdul[0].header['HIERARCH ESO DPR TECH']
-    catg = hdul[0].header['HIERARCH ESO DPR CATG']
-    tipe = hdul[0].header['HIERARCH ESO DPR TYPE']
+    tech = row['HIERARCH ESO DPR TECH']
+    catg = row['HIERARCH ESO DPR CATG']
+    tipe = row['HIERARCH ESO DPR TYPE']
 
-    slit = hdul[0].header['*DRS SLIT*']
-    filt = hdul[0].header['*DRS FILTER*']
-    ifu = hdul[0].header['*DRS IFU*']
-    mask = hdul[0].header['*DRS MASK*']
+    slit = [key for key in wildcards['*DRS SLIT*'] if row[key] is not None]
+    filt = [key for key in wildcards['*DRS FILTER*'] if row[key] is not None]
+    ifu = [key for key in wildcards['*DRS IFU*'] if row[key] is not None]
+    mask = [key for key in wildcards['*DRS MASK*'] if row[key] is not None]
 
-    ins = hdul[0].header['*INS OPTI*']
+    ins = [key for key in wildcards['*INS OPTI*'] if row[key] is not None]
     
-    fShort = os.path.basename(fName)
+    fShort = Path(fName).name
     line = ""
     line = f'{fShort}\t{dit}\t{ndit}\t{tech}\t{catg}\t{tipe}\t'
 
     for elem in slit:
-        line = f'{line}{hdul[0].header[elem]}'
+        line = f'{line}{row[elem]}'
     line=line+"\t"
     for elem in filt:
-        line = f'{line}{hdul[0].header[elem]}'
+        line = f'{line}{row[elem]}'
     line=line+"\t"
     for elem in ifu:
-        line = f'{line}{hdul[0].header[elem]}'
+        line = f'{line}{row[elem]}'
     line=line+"\t"
     for elem in mask:
-        line = f'{line}{hdul[0].header[elem]}'
+        line = f'{line}{row[elem]}'
     line=line+"\t"
 
 
         
     for elem in ins:
-        line = f'{line}{elem}={hdul[0].header[elem]},'
+        line = f'{line}{elem}={row[elem]},'
     line=f'{line[:-1]}\t'
 
     print(line,file=outFile)
-    hdul.close()
 outFile.close()
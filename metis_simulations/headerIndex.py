@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""
+Persistent index of the primary headers of the files in an output directory.
+
+The summary, header and checking tools all need a few header keywords of
+every file in the output directory; rather than each of them listing and
+opening the whole tree, the keywords are kept in a SQLite database in the
+directory (INDEXNAME), with one row per file (makeSOF only needs the names,
+and lists the tree once itself):
+
+    name, mtime, size, doCatg, dprCatg, dprType, dprTech, insMode,
+    dit, ndit, tplName, tplStart, tplExpno, cards
+
+cards holds the values of all of INDEX_KEYWORDS (including the wildcard
+ones) as JSON, so that headerScan tables can be rebuilt from the index. The
+executor adds every file as soon as it is written, and update() rereads only
+the files whose mtime or size changed since they were indexed (and drops the
+ones that are gone), so it stays cheap after reruns.
+
+    index = HeaderIndex("output")
+    index.update()
+    fNames = index.select("METIS.*DARK*", dprTech="IMAGE,LM")
+    table = index.table(fNames, ['HIERARCH ESO DET DIT', '*DRS FILTER*'])
+
+The output directory may be on a network file system, where SQLite locking
+is not reliable; MSIM_HEADER_INDEX can then name a local directory that
+holds the indexes instead, one per output directory (indexPath). If the
+database can't be used anyway (locked or corrupt), the index falls back to
+one in memory, filled by rescanning the directory.
+
+The index can also be brought up to date from the command line:
+
+    python -m metis_simulations.headerIndex output/imgN output/imgLM
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+from fnmatch import fnmatchcase
+
+from astropy.io.fits.verify import VerifyError
+
+from .headerScan import headerTable, scanValues
+
+INDEXNAME = "headerIndex.sqlite"
+
+# the database of an index that falls back to memory
+MEMORY = ":memory:"
+
+# increase when the columns or INDEX_KEYWORDS change, to rebuild old indexes
+INDEX_FORMAT = 1
+
+# the keywords with a column of their own, that can be used in select()
+COLUMNS = {"dprCatg": 'HIERARCH ESO DPR CATG',
+           "dprType": 'HIERARCH ESO DPR TYPE',
+           "dprTech": 'HIERARCH ESO DPR TECH',
+           "insMode": 'HIERARCH ESO INS MODE',
+           "dit": 'HIERARCH ESO DET DIT',
+           "ndit": 'HIERARCH ESO DET NDIT',
+           "tplName": 'HIERARCH ESO TPL NAME',
+           "tplStart": 'HIERARCH ESO TPL START',
+           "tplExpno": 'HIERARCH ESO TPL EXPNO'}
+
+# all the keywords in the index
+INDEX_KEYWORDS = list(COLUMNS.values()) + ['*DRS SLIT*', '*DRS FILTER*', '*DRS IFU*',
+                                           '*DRS MASK*', '*INS OPTI*']
+
+FITS_PATTERN = "*.fits"
+
+# the errors of reading a header that leave a single file out of the index
+SCAN_ERRORS = (OSError, ValueError, VerifyError)
+
+
+def doCatg(fName):
+
+    """the DO.CATG of a file, from its name (METIS.<DO.CATG>.<date>.fits)"""
+
+    parts = os.path.basename(fName).split(".")
+    return parts[1] if parts[0] == "METIS" and len(parts) > 2 else parts[0]
+
+
+def _checkKeywords(keywords):
+
+    """raise a ValueError if any of the keywords is not in the index"""
+
+    missing = [key for key in keywords if key not in INDEX_KEYWORDS]
+    if missing:
+        raise ValueError(f"Keywords not in the header index: {missing}")
+
+
+def indexPath(directory):
+
+    """
+    the database of the index of an output directory: INDEXNAME in the
+    directory, or in MSIM_HEADER_INDEX, named after the directory, if set
+    """
+
+    indexDir = os.environ.get("MSIM_HEADER_INDEX")
+    if not indexDir:
+        return os.path.join(str(directory), INDEXNAME)
+    absDir = os.path.abspath(str(directory))
+    digest = hashlib.sha256(absDir.encode()).hexdigest()[:16]
+    os.makedirs(indexDir, exist_ok=True)
+    return os.path.join(indexDir, f"{os.path.basename(absDir)}-{digest}-{INDEXNAME}")
+
+
+def _orRescan(method):
+
+    """
+    run a method of HeaderIndex; if its database fails (locked or corrupt),
+    move the index to memory, rescan the directory and run the method again
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except sqlite3.DatabaseError as e:
+            if self.path == MEMORY:
+                raise
+            self._fallBack(e)
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class HeaderIndex():
+
+    def __init__(self, directory):
+
+        self.directory = str(directory)
+        self.path = indexPath(self.directory)
+        self.db = None
+        try:
+            self._open(self.path)
+        except sqlite3.DatabaseError as e:
+            self._fallBack(e)
+
+    def _open(self, path):
+
+        self.db = sqlite3.connect(path, timeout=60)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != INDEX_FORMAT:
+            self.db.execute("DROP TABLE IF EXISTS headers")
+        columns = ", ".join(COLUMNS)
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS headers (name TEXT PRIMARY KEY, "
+                        f"mtime INTEGER, size INTEGER, doCatg TEXT, {columns}, cards TEXT)")
+        self.db.execute(f"PRAGMA user_version = {INDEX_FORMAT}")
+        self.db.commit()
+
+    def _fallBack(self, error):
+
+        """replace an unusable database by an index in memory, filled by scanning the directory"""
+
+        print(f"Header index {self.path} can't be used ({error}); rescanning {self.directory} instead")
+        if self.db is not None:
+            try:
+                self.db.close()
+            except sqlite3.Error:
+                pass
+        self.path = MEMORY
+        self._open(self.path)
+        self.update()
+
+    def close(self):
+        self.db.close()
+
+    def _stored(self):
+
+        """the (mtime, size) of the indexed files, by name"""
+
+        return {name: (mtime, size) for name, mtime, size in
+                self.db.execute("SELECT name, mtime, size FROM headers")}
+
+    @_orRescan
+    def add(self, fNames, nThreads=None):
+
+        """
+        read the headers of files in this directory and store them in the index.
+
+        Files whose header can't be read (e.g. still being written, or with a
+        malformed card) are left out, and tried again by the next update().
+        Returns the number stored.
+        """
+
+        # the stamps are taken first, so a file that changes while it is read is read again later
+        names, paths, stamps = [], [], []
+        for fName in fNames:
+            name = os.path.basename(str(fName))
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            names.append(name)
+            paths.append(path)
+            stamps.append((st.st_mtime_ns, st.st_size))
+
+        try:
+            allValues = scanValues(paths, INDEX_KEYWORDS, nThreads=nThreads)
+        except SCAN_ERRORS:
+            allValues = []
+            for path in paths:
+                try:
+                    allValues.extend(scanValues([path], INDEX_KEYWORDS))
+                except SCAN_ERRORS as e:
+                    print(f"Not indexed: {path}: {e}")
+                    allValues.append(None)
+
+        rows = []
+        for name, (mtime, size), values in zip(names, stamps, allValues):
+            if values is None:
+                continue
+            rows.append((name, mtime, size, doCatg(name))
+                        + tuple(values.get(key[len("HIERARCH "):]) for key in COLUMNS.values())
+                        + (json.dumps(values),))
+
+        self.db.executemany(f"INSERT OR REPLACE INTO headers VALUES ({', '.join('?' * (len(COLUMNS) + 5))})",
+                            rows)
+        self.db.commit()
+        return len(rows)
+
+    @_orRescan
+    def update(self, nThreads=None):
+
+        """
+        bring the index up to date with the FITS files in the directory, reading
+        only new files and files whose mtime or size changed.
+
+        Returns the number of files that were read.
+        """
+
+        onDisk = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if fnmatchcase(entry.name, FITS_PATTERN) and entry.is_file():
+                    st = entry.stat()
+                    onDisk[entry.name] = (st.st_mtime_ns, st.st_size)
+
+        stored = self._stored()
+        gone = [(name,) for name in stored if name not in onDisk]
+        if gone:
+            self.db.executemany("DELETE FROM headers WHERE name = ?", gone)
+            self.db.commit()
+
+        changed = sorted(name for name, stamp in onDisk.items() if stored.get(name) != stamp)
+        if changed:
+            self.add(changed, nThreads=nThreads)
+        return len(changed)
+
+    @_orRescan
+    def select(self, pattern=FITS_PATTERN, **conditions):
+
+        """
+        the indexed files whose name matches a glob pattern and whose columns
+        (see COLUMNS, and doCatg) have the given values, sorted by name.
+        """
+
+        for col in conditions:
+            if col not in COLUMNS and col != "doCatg":
+                raise ValueError(f"'{col}' is not a column of the header index")
+        where = "".join(f" AND {col} = ?" for col in conditions)
+        rows = self.db.execute(f"SELECT name FROM headers WHERE name GLOB ?{where} ORDER BY name",
+                               (pattern, *conditions.values()))
+        return [os.path.join(self.directory, name) for name, in rows]
+
+    @_orRescan
+    def values(self, fNames):
+
+        """the dict of keyword: value of each of a list of indexed files"""
+
+        names = [os.path.basename(str(fName)) for fName in fNames]
+        cards = {}
+        for i in range(0, len(names), 500):
+            chunk = names[i:i+500]
+            cards.update(self.db.execute(f"SELECT name, cards FROM headers WHERE name IN "
+                                         f"({', '.join('?' * len(chunk))})", chunk))
+        missing = [name for name in names if name not in cards]
+        if missing:
+            raise KeyError(f"{len(missing)} file(s) not in the header index of "
+                           f"{self.directory}, e.g. {missing[0]}")
+        return [json.loads(cards[name]) for name in names]
+
+    def table(self, fNames=None, keywords=INDEX_KEYWORDS):
+
+        """the headerScan.scanHeaders table of indexed files (default all of them)"""
+
+        if fNames is None:
+            fNames = self.select()
+        _checkKeywords(keywords)
+        return headerTable(fNames, self.values(fNames), keywords)
+
+
+class IndexSet():
+
+    """the header indexes of several output directories, by directory"""
+
+    def __init__(self):
+
+        self.indexes = {}
+
+    def indexFor(self, directory):
+
+        key = os.path.normpath(str(directory))
+        if key not in self.indexes:
+            self.indexes[key] = HeaderIndex(directory)
+        return self.indexes[key]
+
+    def add(self, fNames):
+
+        """add freshly written files to the indexes of their directories"""
+
+        byDir = {}
+        for fName in fNames:
+            byDir.setdefault(os.path.dirname(str(fName)), []).append(fName)
+        for directory, group in byDir.items():
+            self.indexFor(directory).add(group, nThreads=1)
+
+    def table(self, fNames, keywords=INDEX_KEYWORDS):
+
+        """the headerScan.scanHeaders table of files in any of the directories"""
+
+        _checkKeywords(keywords)
+        byDir = {}
+        for i, fName in enumerate(fNames):
+            byDir.setdefault(os.path.dirname(str(fName)), []).append(i)
+        allValues = [None] * len(fNames)
+        for directory, positions in byDir.items():
+            values = self.indexFor(directory).values([fNames[i] for i in positions])
+            for i, value in zip(positions, values):
+                allValues[i] = value
+        return headerTable(fNames, allValues, keywords)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inDir', nargs='*', default=["output"],
+                        help='output directories to index')
+    args = parser.parse_args()
+
+    for dirName in args.inDir:
+        index = HeaderIndex(dirName)
+        nRead = index.update()
+        print(f"{dirName}: {len(index.select())} files indexed, {nRead} read")
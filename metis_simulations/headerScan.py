@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Read keywords from the primary headers of many FITS files.
+
+Only the primary header is read, block by block up to the END card, and
+only the cards of the requested keywords are parsed; the data and the
+extensions are never touched. The files are read by a pool of threads.
+readHeaderCards gives the cards of all the headers of a file, skipping the
+data.
+
+    table = scanHeaders(fNames, ['HIERARCH ESO DET DIT', 'HIERARCH ESO DPR TECH', '*DRS FILTER*'])
+
+returns a pandas DataFrame with a row for each file (indexed by file name)
+and a column for each keyword. A keyword with wildcards (as in
+astropy: * any characters, ? one character, ... any non-blank characters)
+gives a column for each keyword that it matches in any of the files,
+named as astropy names them (e.g. 'ESO DRS FILTER'); these are listed in
+table.attrs['wildcards']. Missing keywords are None.
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from astropy.io import fits
+
+from .headers import CARD, dataSize, readHeaderBlocks
+
+# the keywords that give the size of the data of an HDU
+_STRUCTURE = re.compile(r"(NAXIS\d*|BITPIX|PCOUNT|GCOUNT)$")
+
+
+def _normalise(keyword):
+
+    """a keyword as it is matched against the cards: upper case, without HIERARCH"""
+
+    keyword = " ".join(keyword.upper().split())
+    if keyword.startswith("HIERARCH "):
+        keyword = keyword[len("HIERARCH "):]
+    return keyword
+
+
+def _isWildcard(keyword):
+    return any(w in keyword for w in ("*", "?", "..."))
+
+
+def _pattern(keyword):
+
+    """the regular expression of a keyword, which may have wildcards"""
+
+    pattern = re.escape(_normalise(keyword))
+    return pattern.replace(r"\.\.\.", r"\S*").replace(r"\*", ".*").replace(r"\?", ".")
+
+
+def _literal(keyword):
+
+    """the longest part of a keyword without wildcards, which is in every card it matches"""
+
+    parts = re.split(r"\*|\?|\.\.\.", _normalise(keyword))
+    return max(parts, key=len)
+
+
+def cardKeyword(card):
+
+    """the keyword of a card image, without HIERARCH"""
+
+    if card.startswith("HIERARCH "):
+        end = card.find("=")
+        key = card[len("HIERARCH "):end if end > 0 else None].strip()
+        return " ".join(key.split()) if "  " in key else key
+    return card[:8].rstrip()
+
+
+# the common kinds of values; anything else is parsed by astropy
+_VALUE = re.compile(r"""\s*(?:'(?P<str>(?:[^']|'')*)'|(?P<bool>[TF])|(?P<int>[+-]?\d+)|"""
+                    r"""(?P<float>[+-]?(?:\d+\.?\d*|\.\d+)(?:[EeDd][+-]?\d+)?))\s*(?:/.*)?$""")
+
+
+def cardValue(image):
+
+    """the value of a card image, as astropy would give it"""
+
+    if len(image) == CARD:
+        start = image.find("=") + 1 if image.startswith("HIERARCH ") else 10
+        match = _VALUE.match(image, start)
+        if match is not None:
+            if match["str"] is not None:
+                return match["str"].replace("''", "'").rstrip()
+            if match["bool"] is not None:
+                return match["bool"] == "T"
+            if match["int"] is not None:
+                return int(match["int"])
+            return float(match["float"].replace("D", "E").replace("d", "e"))
+    return fits.Card.fromstring(image).value
+
+
+def readPrimaryHeader(fName):
+
+    """the primary header of a FITS file as text, up to the END card"""
+
+    with open(fName, "rb") as f:
+        return readHeaderBlocks(f).decode("ascii")
+
+
+def readHeaderCards(fName):
+
+    """the card images of all the headers of a FITS file, without END, as a list per HDU"""
+
+    allCards = []
+    with open(fName, "rb") as f:
+        fileSize = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset < fileSize:
+            f.seek(offset)
+            blocks = readHeaderBlocks(f)
+            text = blocks.decode("ascii")
+            cards = []
+            for i in range(0, len(text), CARD):
+                card = text[i:i+CARD]
+                if card.startswith("END     "):
+                    break
+                cards.append(card)
+            structure = {key: cardValue(card) for card in cards
+                         if _STRUCTURE.match(key := card[:8].rstrip())}
+            offset += len(blocks) + dataSize(structure)
+            allCards.append(cards)
+    return allCards
+
+
+def _scanHeader(fName, wanted, literals):
+
+    """
+    the values of the keywords in the primary header of a file.
+
+    wanted is a compiled regular expression matching all the keywords, and
+    literals one that finds the parts of the keywords without wildcards.
+    Returns a dict of keyword: value, with the first card of each keyword.
+    """
+
+    text = readPrimaryHeader(fName)
+    end = text.find("END     ")
+    while end % CARD != 0:
+        end = text.find("END     ", end + 1)
+
+    # only look at the cards that contain one of the literals
+    candidates = {match.start() // CARD for match in literals.finditer(text, 0, end)}
+
+    values = {}
+    for i in sorted(candidates):
+        card = text[i*CARD:(i+1)*CARD]
+        key = cardKeyword(card)
+        if key in values or not wanted.match(key) or key in ("CONTINUE", "COMMENT", "HISTORY"):
+            continue
+
+        # a long string value continues on the following cards
+        image = card
+        while text.startswith("CONTINUE", (i+1)*CARD):
+            i += 1
+            image += text[i*CARD:(i+1)*CARD]
+        values[key] = cardValue(image)
+    return values
+
+
+def scanValues(fNames, keywords, nThreads=None):
+
+    """
+    read keywords from the primary headers of a list of files, in parallel.
+
+    Returns a list with a dict of keyword: value for each file, with the
+    keywords as they are in the header (without HIERARCH).
+    nThreads is the number of reading threads (default as ThreadPoolExecutor).
+    """
+
+    fNames = [str(fName) for fName in fNames]
+    wanted = re.compile("(?:" + "|".join(_pattern(k) for k in keywords) + ")$")
+    literals = re.compile("|".join(re.escape(lit) for lit in
+                                   sorted({_literal(k) for k in keywords}, key=len, reverse=True)))
+
+    def scan(fName):
+        return _scanHeader(fName, wanted, literals)
+
+    if nThreads == 1 or len(fNames) <= 1:
+        return [scan(fName) for fName in fNames]
+    with ThreadPoolExecutor(max_workers=nThreads) as pool:
+        return list(pool.map(scan, fNames))
+
+
+def headerTable(fNames, allValues, keywords):
+
+    """the DataFrame of the values of a list of files, as returned by scanHeaders"""
+
+    fNames = [str(fName) for fName in fNames]
+    wildcards = {k: re.compile(_pattern(k) + "$") for k in keywords if _isWildcard(k)}
+
+    # the keywords matching each wildcard, in order of appearance
+    matched = {k: [] for k in wildcards}
+    for values in allValues:
+        for key in values:
+            for k, pattern in wildcards.items():
+                if pattern.match(key) and key not in matched[k]:
+                    matched[k].append(key)
+
+    columns = {}
+    for k in keywords:
+        if k in wildcards:
+            for key in matched[k]:
+                columns[key] = [values.get(key) for values in allValues]
+        else:
+            columns[k] = [values.get(_normalise(k)) for values in allValues]
+
+    table = pd.DataFrame(columns, index=pd.Index(fNames, name="fName"), dtype=object)
+    table.attrs["wildcards"] = matched
+    return table
+
+
+def scanHeaders(fNames, keywords, nThreads=None):
+
+    """
+    read keywords from the primary headers of a list of files, in parallel.
+
+    Returns a pandas DataFrame, see the module documentation.
+    nThreads is the number of reading threads (default as ThreadPoolExecutor).
+    """
+
+    return headerTable(fNames, scanValues(fNames, keywords, nThreads), keywords)
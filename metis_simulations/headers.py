@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""
+Header fixes for simulated raw files.
+
+fixHeaders adds and corrects the keywords that aren't handled by ScopeSim.
+It works on an in-memory HDUList, so it is applied to the output of
+metis.readout before the file is written (see scopesimWrapper._writeReadout),
+and the pixel data only need to be written once.
+
+patchHeaders applies the same rules to files that were already written. Only
+the header blocks are read and rewritten, in place, as long as the new headers
+fit in the 2880 byte blocks of the old ones; otherwise the file is rewritten,
+copying the data in chunks. The rules can be applied more than once: the
+original TECH of the coronagraphic modes is recovered from INS.MODE.
+
+    python -m metis_simulations.headers file1.fits file2.fits ...
+"""
+
+import argparse
+import os
+
+import numpy as np
+from astropy.io import fits
+
+BLOCK = 2880
+CARD = 80
+
+# INS.MODE of the modes for which fixHeaders changes DPR.TECH, and the original TECH
+FIXEDTECH = {"IMG_LM_RAVC": "RAVC,LM",
+             "IMG_LM_APP": "APP,LM",
+             "IFU_nominal_RAVC": "RAVC,IFU"}
+
+
+def fixHeaders(hdul, mjd):
+
+    """
+    add keywords to an HDUList, fixing anything that isn't handled by ScopeSim.
+
+    DPR .TECH, .FILTER and .TYPE are set by ScopeSim, DRS.FILTER .ND_FILTER,
+    and DET.DIT and .NDIT are set in ScopeSim
+
+    We use the TECH to get INS.MODE
+    Sets the DRS.SLIT to the default value for now (will fix later). TODO.
+    Sets INS.OPTI*.NAME to the filter, slit as indicated by the TECH, FILTER and SLIT keyword
+
+    For HCI / Coronagraph modes, we set the TECH keyword to a non valid value in Scopesim,
+    and use that to set the DRS.MASK, correct DPR.TECH, and INS.OPTI*.NAME values. This is kludgy,
+    and will be fixed later. TODO.
+
+    We check the TYPE keyword for LASER Sources.
+
+    The correct MJD date is written
+
+    The HDUList is changed in place, and returned.
+    """
+
+    for hdu in hdul:
+        removeLowerCase(hdu.header)
+    fixPrimaryHeader(hdul[0].header, mjd)
+
+    return hdul
+
+
+def removeLowerCase(header):
+
+    """Remove lower case keywords, in particular pixel_size"""
+
+    for k in list(header):
+        if k.upper() != k:
+            print(f"Lower case keyword found and removed: {k}")
+            header.pop(k)
+
+
+def fixPrimaryHeader(header, mjd=None):
+
+    """the rules of fixHeaders for the primary header; mjd=None keeps MJD-OBS"""
+
+    # fix for the occasional keyword that gets written as boolean not string
+    for elem in header:
+        if("OPTI" in elem and "NAME" in elem):
+            if isinstance(header[elem], bool):
+                header[elem] = str(header[elem])
+        if("CUBE MODE" in elem):
+            if isinstance(header[elem], bool):
+                header[elem] = str(header[elem])
+
+    if mjd is not None:
+        header['MJD-OBS'] = mjd
+
+    # get the tech and filter keywords
+
+    tech = header['HIERARCH ESO DPR TECH']
+    # headers that were fixed before
+    tech = FIXEDTECH.get(header.get('HIERARCH ESO INS MODE'), tech)
+    filt = header['HIERARCH ESO DRS FILTER']
+
+    if(tech == "LSS,LM"):
+        header['HIERARCH ESO INS MODE'] = "SPEC_LM"
+        #header['HIERARCH ESO INS OPTI9 NAME'] = filt
+        #header['HIERARCH ESO INS DRS SLIT'] = "C-38_1"
+    if(tech == "LSS,N"):
+        header['HIERARCH ESO INS MODE'] = "SPEC_N_LOW"
+        #header['HIERARCH ESO INS OPTI12 NAME'] = filt
+        header['HIERARCH ESO INS DRS SLIT'] = "C-38_1"
+
+    #IMAGING
+    if(tech == "IMAGE,LM"):
+        header['HIERARCH ESO INS MODE'] = "IMG_LM"
+        #header['HIERARCH ESO INS OPTI10 NAME'] = filt
+    if(tech == "IMAGE,N"):
+        header['HIERARCH ESO INS MODE'] = "IMG_N"
+        #header['HIERARCH ESO INS OPTI13 NAME'] = filt
+
+    #IFU
+    if(tech == "IFU"):
+        header['HIERARCH ESO INS MODE'] = "IFU_nominal"
+        #header['HIERARCH ESO INS OPTI6 NAME'] = filt
+        header['HIERARCH ESO DRS IFU'] = filt
+        header['HIERARCH ESO DPR TECH'] = "IFU"
+
+    #HCI
+    if(tech == "RAVC,LM"):
+        #header['HIERARCH ESO INS OPTI10 NAME'] = filt
+        header['HIERARCH ESO INS MODE'] = "IMG_LM_RAVC"
+        header['HIERARCH ESO DRS MASK'] = "VPM-L,RAP-LM,RLS-LMS"
+        header['HIERARCH ESO INS OPTI1 NAME'] = "RAP-LM"
+        header['HIERARCH ESO INS OPTI3 NAME'] = "VPM-L"
+        header['HIERARCH ESO INS OPTI5 NAME'] = "RLS-LMS"
+        header['HIERARCH ESO DPR TECH'] = "IMAGE,LM"
+
+    if(tech == "APP,LM"):
+        #header['HIERARCH ESO INS OPTI10 NAME'] = filt
+        header['HIERARCH ESO INS MODE'] = "IMG_LM_APP"
+        header['HIERARCH ESO DPR TECH'] = "IMAGE,LM"
+        header['HIERARCH ESO INS OPTI1 NAME'] = "RAP-LM"
+        header['HIERARCH ESO INS OPTI3 NAME'] = "VPM-L"
+        header['HIERARCH ESO INS OPTI5 NAME'] = "APP-LMS"
+        header['HIERARCH ESO DRS MASK'] = "VPM-L,RAP-LM,APP-LMS"
+
+    if(tech == "RAVC,IFU"):
+        header['HIERARCH ESO INS OPTI6 NAME'] = filt
+        header['HIERARCH ESO INS MODE'] = "IFU_nominal_RAVC"
+        header['HIERARCH ESO DRS IFU'] = filt
+        header['HIERARCH ESO DPR TECH'] = "IFU"
+        header['HIERARCH ESO INS OPTI1 NAME'] = "RAP-LM"
+        header['HIERARCH ESO INS OPTI3 NAME'] = "VPM-L"
+        header['HIERARCH ESO INS OPTI5 NAME'] = "RLS-LMS"
+        header['HIERARCH ESO DRS MASK'] = "VPM-L,RAP-LM,RLS-LMS"
+
+    #OTHER
+    if(header['HIERARCH ESO DPR TYPE'] == "WAVE"):
+        header['HIERARCH ESO SEQ WCU LASER1 NAME'] = "LASER1"
+
+    #OTHER
+    if(tech == "PUP,LM"):
+        header['HIERARCH ESO INS MODE'] = "IMG_LM"
+        header['HIERARCH ESO INS OPTI15 NAME'] = "PUPIL1"
+    if(tech == "PUP,N"):
+        header['HIERARCH ESO INS MODE'] = "IMG_N"
+        header['HIERARCH ESO INS OPTI15 NAME'] = "PUPIL2"
+
+
+def dataSize(header):
+
+    """size in bytes of the data of an HDU, including the padding"""
+
+    naxis = header.get("NAXIS", 0)
+    if naxis == 0:
+        return 0
+    nPix = int(np.prod([header[f"NAXIS{i}"] for i in range(1, naxis+1)]))
+    size = abs(header["BITPIX"]) // 8 * header.get("GCOUNT", 1) * (header.get("PCOUNT", 0) + nPix)
+    return -(-size // BLOCK) * BLOCK
+
+
+def readHeaderBlocks(f):
+
+    """
+    read the header blocks at the current position of an open FITS file,
+    up to and including the block with the END card
+    """
+
+    offset = f.tell()
+    blocks = b""
+    while True:
+        block = f.read(BLOCK)
+        if len(block) < BLOCK:
+            raise OSError(f"{f.name}: truncated header at byte {offset}")
+        blocks += block
+        # END is always at the start of a card
+        cards = [block[i:i+8] for i in range(0, BLOCK, CARD)]
+        if b"END     " in cards:
+            return blocks
+
+
+def _readHeaders(f):
+
+    """
+    list the headers in an open FITS file, without reading the data.
+
+    Returns a list of (offset, size of the header blocks, Header, size of the data).
+    """
+
+    hdus = []
+    f.seek(0, os.SEEK_END)
+    fileSize = f.tell()
+    offset = 0
+    while offset < fileSize:
+        f.seek(offset)
+        blocks = readHeaderBlocks(f)
+        header = fits.Header.fromstring(blocks.decode("ascii"))
+        size = dataSize(header)
+        hdus.append((offset, len(blocks), header, size))
+        offset += len(blocks) + size
+    return hdus
+
+
+def _headerBytes(header, size=None):
+
+    """
+    the header as bytes, padded with blanks to size, or to a whole number of
+    blocks; None if it does not fit in size
+    """
+
+    text = header.tostring(padding=False).encode("ascii")
+    if size is None:
+        size = -(-len(text) // BLOCK) * BLOCK
+    if len(text) > size:
+        return None
+    return text + b" " * (size - len(text))
+
+
+def patchHeaders(fname, mjd=None):
+
+    """
+    apply the header fixes to an existing file, without rewriting the data if possible.
+
+    mjd is the MJD-OBS to set; by default the value in the file is kept.
+    Returns True if the headers were changed in place, False if the file was rewritten.
+    """
+
+    with open(fname, "rb+") as f:
+        hdus = _readHeaders(f)
+        newHeaders = []
+        for i, (offset, size, header, dataSize) in enumerate(hdus):
+            removeLowerCase(header)
+            if i == 0:
+                fixPrimaryHeader(header, mjd)
+            newHeaders.append(_headerBytes(header, size))
+
+        if all(text is not None for text in newHeaders):
+            for (offset, size, header, dataSize), text in zip(hdus, newHeaders):
+                f.seek(offset)
+                f.write(text)
+            return True
+
+        # at least one header has grown by a block; stream into a new file
+        tmpName = f"{fname}.{os.getpid()}.tmp"
+        with open(tmpName, "wb") as out:
+            for offset, size, header, dataSize in hdus:
+                out.write(_headerBytes(header))
+                f.seek(offset + size)
+                _copyBytes(f, out, dataSize)
+
+    os.replace(tmpName, fname)
+    return False
+
+
+def _copyBytes(src, dst, nBytes, chunk=16*1024*1024):
+
+    """copy nBytes from one open file to another, in chunks"""
+
+    while nBytes > 0:
+        data = src.read(min(chunk, nBytes))
+        if not data:
+            raise OSError(f"{src.name}: unexpected end of file")
+        dst.write(data)
+        nBytes -= len(data)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="apply the header fixes to existing raw files")
+    parser.add_argument("files", nargs="+", help="FITS files to update in place")
+    args = parser.parse_args()
+
+    for fName in args.files:
+        inPlace = patchHeaders(fName)
+        print(f"{fName}: {'updated in place' if inPlace else 'rewritten'}")
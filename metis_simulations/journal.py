@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Run journal for resumable simulations.
+
+The journal is an append-only JSON lines file in the output directory, with
+one line per finished (or failed) exposure:
+
+    {"fname": ..., "hash": ..., "state": "done", "time": ...}
+
+The states are "done" and "failed".
+
+hash is Exposure.contentHash(), so an exposure only counts as done if it was
+run with exactly the same inputs (filename, mode, properties, wcu, source).
+Lines are only ever appended, and only by the parent process, so a run that
+is killed leaves at worst an incomplete last line, which is ignored.
+
+JournalSet keeps one journal per output directory, for plans that write to
+several directories (e.g. a campaign of several blocks).
+"""
+
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+JOURNALNAME = "runJournal.jsonl"
+
+
+class RunJournal():
+
+    def __init__(self, path):
+
+        self.path = Path(path)
+        self.states = {}
+        self.load()
+
+    def load(self):
+
+        """read the journal; later lines override earlier ones"""
+
+        self.states = {}
+        if not self.path.exists():
+            return
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.states[entry["fname"]] = (entry["hash"], entry["state"])
+
+    def isDone(self, exposure):
+
+        """True if the exposure was finished with the same inputs and its output exists"""
+
+        return (self.states.get(exposure.fname) == (exposure.contentHash(), "done")
+                and os.path.exists(exposure.fname))
+
+    def record(self, exposures, state):
+
+        """append the state of a list of exposures to the journal"""
+
+        now = datetime.now().isoformat(timespec="seconds")
+        lines = []
+        for exposure in exposures:
+            digest = exposure.contentHash()
+            self.states[exposure.fname] = (digest, state)
+            lines.append(json.dumps({"fname": exposure.fname, "hash": digest,
+                                     "state": state, "time": now}) + "\n")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remaining(self, plan):
+
+        """split a plan into the exposures still to run and the number skipped"""
+
+        todo = [exposure for exposure in plan if not self.isDone(exposure)]
+        return todo, len(plan) - len(todo)
+
+
+class JournalSet():
+
+    """the journals of all the output directories of a plan, with the interface of RunJournal"""
+
+    def __init__(self):
+
+        self.journals = {}
+
+    def journalFor(self, exposure):
+
+        directory = Path(exposure.fname).parent
+        if directory not in self.journals:
+            self.journals[directory] = RunJournal(directory / JOURNALNAME)
+        return self.journals[directory]
+
+    def isDone(self, exposure):
+        return self.journalFor(exposure).isDone(exposure)
+
+    def record(self, exposures, state):
+
+        """append the state of a list of exposures to their journals"""
+
+        byJournal = {}
+        for exposure in exposures:
+            byJournal.setdefault(self.journalFor(exposure), []).append(exposure)
+        for journal, group in byJournal.items():
+            journal.record(group, state)
+
+    def remaining(self, plan):
+
+        """split a plan into the exposures still to run and the number skipped"""
+
+        todo = [exposure for exposure in plan if not self.isDone(exposure)]
+        return todo, len(plan) - len(todo)
@@ -1,47 +1,155 @@
 #!/usr/bin/env python3
 
 """
-Script to generate SOF files from the templates, to add 
+Script to generate SOF files from the templates, to add
 the real file names.
 
-Note that as of Nov 15 2024, the Coronagraphic recipes have the same 
+Note that as of Nov 15 2024, the Coronagraphic recipes have the same
 format for input data as standard LM/N/IFU science imaging routines.
-Therefore the LM/N/IFU SCI imaging routines need a quick fix to 
-remove those data. 
+Therefore the LM/N/IFU SCI imaging routines need a quick fix to
+remove those data.
 
 The routine reads in the SOF templates from sofTemplates, and creates
-an identical list of files in sofFiles. 
+an identical list of files in sofFiles.
 
+The data directory is listed once, and the wildcards of all the templates
+are matched against the sorted lists of names in each directory: only the
+names that start with the part of a pattern before its first wildcard are
+compared, which are found by bisection, and each pattern is only matched
+once. It can be run from the command line
+
+    python -m metis_simulations.makeSOF [--templateDir sofTemplates] [--outDir sofFiles] [--dataDir output]
+
+or at the end of a run, with makeSOF(templateDir, outDir, dataDir).
 """
 
+import argparse
 import glob
+import os
+import re
+from bisect import bisect_left
+from fnmatch import fnmatchcase, translate
+
+
+def listFiles(dataDir):
+
+    """the paths of all the files below dataDir, relative to it, sorted; hidden ones are left out"""
+
+    names = []
+    for root, dirs, files in os.walk(dataDir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        rel = os.path.relpath(root, dataDir)
+        for f in files:
+            if not f.startswith("."):
+                names.append(f if rel == "." else os.path.join(rel, f).replace(os.sep, "/"))
+    names.sort()
+    return names
+
+
+_WILDCARD = re.compile(r"[*?\[]")
+
+
+def _prefixRange(names, prefix):
+
+    """the slice of a sorted list of names that start with prefix"""
+
+    if not prefix:
+        return names
+    lo = bisect_left(names, prefix)
+    hi = bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo)
+    return names[lo:hi]
+
+
+class FileMatcher():
+
+    """match glob patterns against a fixed list of relative file names"""
+
+    def __init__(self, names):
 
-# read the list of files from the template directory
-fList = glob.glob("sofTemplates/*.sof")
+        # the names in each directory, sorted
+        self.dirs = {}
+        for name in sorted(names):
+            head, _, tail = name.rpartition("/")
+            self.dirs.setdefault(head, []).append(tail)
+        self.cache = {}
 
-# cycle through, read in line by line. If there is a "*" in the filename
-# do wildcard pattern matching for the list of files, otherwise just copy
+    def match(self, pattern):
 
-for fNameIn in fList:
-    ffIn = open(fNameIn)
-    fNameOut = fNameIn.replace("sofTemplates","sofFiles")
-    ffOut = open(fNameOut,"w")
-    print(fNameOut)
-    for line in ffIn:
+        """the names matching a glob pattern, as glob.glob would find them, sorted"""
+
+        if pattern not in self.cache:
+            head, _, tail = pattern.rpartition("/")
+            if _WILDCARD.search(head):
+                depth = head.count("/")
+                dirs = sorted(d for d in self.dirs if d and d.count("/") == depth and fnmatchcase(d, head))
+            else:
+                dirs = [head] if head in self.dirs else []
+
+            # only the names that start with the part before the first wildcard are compared
+            prefix = _WILDCARD.split(tail, maxsplit=1)[0]
+            regex = re.compile(translate(tail))
+            matched = []
+            for d in dirs:
+                candidates = _prefixRange(self.dirs[d], prefix)
+                if tail != prefix + "*":
+                    candidates = filter(regex.match, candidates)
+                matched.extend(f"{d}/{name}" if d else name for name in candidates)
+            self.cache[pattern] = matched
+        return self.cache[pattern]
+
+
+def resolveTemplate(lines, matcher):
+
+    """the lines of a SOF file for the lines of a template"""
+
+    sofLines = []
+    for line in lines:
         aa = line.split()
+        if not aa:
+            continue
         if("*" in aa[0]):
-            infList = glob.glob(f"output/{aa[0]}")
-            
-            for f in infList:
-                print(aa)
-                temp=f.replace("output","$SOF_DATA")
-                print(f'{temp} {aa[1]}',file=ffOut)
+            for name in matcher.match(aa[0]):
+                sofLines.append(f'$SOF_DATA/{name} {aa[1]}')
         else:
-            print(f'$SOF_DATA/{line.strip()}',file=ffOut)
-    ffOut.close()
-    ffIn.close()
-                
-            
-            
-    
-    
+            sofLines.append(f'$SOF_DATA/{line.strip()}')
+    return sofLines
+
+
+def makeSOF(templateDir="sofTemplates", outDir="sofFiles", dataDir="output", names=None):
+
+    """
+    write a SOF file in outDir for each template in templateDir, with the
+    wildcards replaced by the matching files in dataDir.
+
+    names is the list of files in dataDir (relative to it); by default the
+    directory is listed. Returns the list of SOF files written.
+    """
+
+    matcher = FileMatcher(listFiles(dataDir) if names is None else names)
+    os.makedirs(outDir, exist_ok=True)
+
+    written = []
+    for fNameIn in sorted(glob.glob(os.path.join(templateDir, "*.sof"))):
+        with open(fNameIn) as ffIn:
+            sofLines = resolveTemplate(ffIn, matcher)
+        fNameOut = os.path.join(outDir, os.path.basename(fNameIn))
+        print(fNameOut)
+        with open(fNameOut, "w") as ffOut:
+            for line in sofLines:
+                print(line, file=ffOut)
+        written.append(fNameOut)
+    return written
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--templateDir', type=str, default="sofTemplates",
+                        help='directory with the SOF templates')
+    parser.add_argument('--outDir', type=str, default="sofFiles",
+                        help='directory for the SOF files')
+    parser.add_argument('--dataDir', type=str, default="output",
+                        help='directory with the simulated files')
+    args = parser.parse_args()
+
+    makeSOF(args.templateDir, args.outDir, args.dataDir)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+Admission of exposures to the workers under a memory budget.
+
+IFU (lms) exposures build large cubes and four detector arrays, and need
+many times the memory of an imaging exposure, so the number of workers that
+is safe for a campaign is set by its worst exposures. Instead, the executor
+can be given a MemoryBudget: a task is only handed to a free worker if the
+memory of all the workers, plus the expected increase of the running tasks
+and of the new one, stays within the budget.
+
+The increase of each task is measured by its worker (the peak resident
+memory during the task minus the resident memory before it, see
+stageTiming.rssMB), and the largest increase seen for each mode (and size)
+is kept in MemoryEstimates, a JSON file (ESTIMATENAME in the output
+directory, or MSIM_MEMORY_ESTIMATES), so the footprints are only measured
+once. A task of a mode that hasn't been measured yet is run on its own.
+
+The tasks are started in the order of the plan, except that lighter tasks
+further down the queue may overtake a task that doesn't fit, at most
+MAX_OVERTAKES times per free worker, after which the workers are left to
+drain until it fits. A task that doesn't fit even in an empty budget is run
+on its own.
+"""
+
+import json
+import os
+from datetime import datetime
+
+from .exposurePlan import outputRoot
+
+ESTIMATENAME = "memoryEstimates.json"
+
+# the estimate of a task is its largest measured increase, plus this fraction
+MARGIN = 0.1
+
+# the number of tasks that can overtake one that doesn't fit, per worker
+MAX_OVERTAKES = 2
+
+
+def taskKey(exposures):
+
+    """the key of the memory estimate of a task: its mode, and ',small' for small detectors"""
+
+    exposure = exposures[0]
+    return f"{exposure.mode},small" if exposure.small else exposure.mode
+
+
+def estimatesPath(fnames):
+
+    """the estimates file for a run: MSIM_MEMORY_ESTIMATES, or ESTIMATENAME in its output directory"""
+
+    path = os.environ.get("MSIM_MEMORY_ESTIMATES")
+    if path:
+        return path
+    root = outputRoot(fnames)
+    return None if root is None else os.path.join(root, ESTIMATENAME)
+
+
+class MemoryEstimates():
+
+    """the largest memory increase measured for each kind of task, in MB"""
+
+    def __init__(self, path=None):
+
+        self.path = path
+        self.estimates = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.estimates = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Memory estimates in {path} can't be read, measuring again: {e}")
+
+    def estimate(self, exposures):
+
+        """the expected memory increase of a task in MB, None if it was never measured"""
+
+        entry = self.estimates.get(taskKey(exposures))
+        if entry is None:
+            return None
+        return entry["increaseMB"] * (1 + MARGIN)
+
+    def measured(self, exposures, increaseMB):
+
+        """record the measured memory increase of a task; the file is written if the estimate went up"""
+
+        key = taskKey(exposures)
+        entry = self.estimates.setdefault(key, {"increaseMB": 0.0, "tasks": 0})
+        entry["tasks"] += 1
+        if increaseMB > entry["increaseMB"] or entry["tasks"] == 1:
+            entry["increaseMB"] = round(max(increaseMB, entry["increaseMB"]), 1)
+            entry["updated"] = datetime.now().isoformat(timespec="seconds")
+            self.save()
+
+    def save(self):
+
+        """write the estimates, under a temporary name that is then renamed"""
+
+        if self.path is None:
+            return
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.estimates, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class MemoryBudget():
+
+    """
+    the memory in use by the workers and the running tasks, and the choice
+    of the next task to start. budgetMB None only measures the tasks.
+    """
+
+    def __init__(self, estimates, budgetMB=None, nWorkers=1):
+
+        self.estimates = estimates
+        self.budgetMB = budgetMB
+        self.nWorkers = nWorkers
+        # resident memory of each worker after its last task, and the reserved increase of each running task
+        self.resident = {}
+        self.running = {}
+        self.overtaken = 0
+
+    @property
+    def limited(self):
+        return self.budgetMB is not None
+
+    def used(self):
+
+        """the memory of the workers and the increases reserved for the running tasks, in MB"""
+
+        return sum(self.resident.values()) + sum(self.running.values())
+
+    def need(self, exposures):
+
+        """the memory to reserve for a task; all of the budget if it was never measured"""
+
+        estimate = self.estimates.estimate(exposures)
+        return self.budgetMB if estimate is None else min(estimate, self.budgetMB)
+
+    def choose(self, waiting):
+
+        """
+        take the next task to start from the list of waiting (taskId, exposures);
+        None if none of them fits until a running task finishes.
+        """
+
+        if not waiting:
+            return None
+        if not self.limited:
+            return waiting.pop(0)
+
+        for i, (taskId, exposures) in enumerate(waiting):
+            if i > 0 and self.overtaken >= MAX_OVERTAKES * self.nWorkers:
+                break
+            need = self.need(exposures)
+            if not self.running or self.used() + need <= self.budgetMB:
+                self.overtaken = 0 if i == 0 else self.overtaken + 1
+                self.running[taskId] = need
+                return waiting.pop(i)
+        return None
+
+    def finished(self, taskId, exposures, worker, memory, ok=True):
+
+        """
+        a task finished on a worker. memory is the (resident before, peak,
+        resident after) memory of the worker in MB, as measured by it.
+        """
+
+        self.running.pop(taskId, None)
+        if memory is None:
+            return
+        before, peak, after = memory
+        self.resident[worker] = after if after is not None else peak
+        if ok:
+            self.estimates.measured(exposures, max(peak - (before or 0.0), 0.0))
+
+    def retired(self, worker):
+
+        """a worker has exited, and no longer uses memory"""
+
+        self.resident.pop(worker, None)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Content addressed cache of simulated raw files.
+
+Many exposures are simulated with exactly the same inputs in different
+blocks and campaigns (e.g. the darks and detector linearity frames). The
+cache stores the written FITS file of an exposure under a hash of everything
+that determines its content:
+
+- the ScopeSim mode
+- the !OBS properties, minus the timestamps and nObs
+- the WCU settings and the source
+- the random seed, the small detector flag
+- the versions of ScopeSim and of the IRDB packages
+- the header rules (the source of headers.py), as the file is cached with
+  its headers fixed
+
+The random seed is derived from the same inputs and the name of the
+exposure in its block (Exposure.expId: the input file, the recipe and the
+number of the exposure, or the calibration and the number of the repeat),
+not from its time. Every exposure of a block gets its own noise, even two
+recipes with the same inputs (e.g. a pair of detector linearity frames with
+the same DIT), and sharedSeeds checks this when a block is planned; only the
+same exposure planned again, in another block or on another date, is found
+in the cache.
+
+On a hit, the cached file is copied to the new filename and only the
+timestamp keywords (STAMP_KEYWORDS) are updated.
+
+The cache is enabled by setting the environment variable MSIM_OUTPUT_CACHE
+to a directory (the --cacheDir command line option does this), so that it
+is inherited by the worker processes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from functools import cache
+from pathlib import Path
+
+from astropy.io import fits
+
+# increase when the content of the written files changes, to invalidate old entries
+CACHE_FORMAT = 4
+
+# properties that only end up in the header, and the keywords they are written to
+STAMP_KEYWORDS = {"dateobs": "DATE-OBS",
+                  "MJD-OBS": "MJD-OBS",
+                  "tplstart": "HIERARCH ESO TPL START",
+                  "tplexpno": "HIERARCH ESO TPL EXPNO"}
+
+
+# properties that don't change the pixels: the timestamps, and the number of exposures of the template
+NONPIXEL_KEYS = list(STAMP_KEYWORDS) + ["nObs"]
+
+
+def _pixelInputs(rcp):
+
+    """the inputs of an exposure that determine its pixels, other than the seed"""
+
+    props = {k: v for k, v in rcp["properties"].items() if k not in NONPIXEL_KEYS}
+    return [rcp["mode"], props, rcp.get("wcu"), rcp.get("source")]
+
+
+def getSeed(rcp):
+
+    """
+    the random seed of an exposure, derived from the inputs that determine
+    its pixels and its name in the block (or, for a recipe that wasn't
+    planned, the start of its template and its number in it)
+    """
+
+    props = rcp["properties"]
+    name = rcp.get("expId") or [props.get("tplstart"), props.get("tplexpno")]
+    inputs = _pixelInputs(rcp) + [name]
+    text = json.dumps(inputs, sort_keys=True, default=str)
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+
+
+def sharedSeeds(plan):
+
+    """the lists of filenames of the exposures of a plan that have the same random seed"""
+
+    bySeed = {}
+    for exposure in plan:
+        bySeed.setdefault(getSeed(exposure.recipe()), []).append(exposure.fname)
+    return [fnames for fnames in bySeed.values() if len(fnames) > 1]
+
+
+def cacheDir():
+
+    """the cache directory, or None if the cache is not enabled"""
+
+    path = os.environ.get("MSIM_OUTPUT_CACHE")
+    return Path(path) if path else None
+
+
+@cache
+def getVersions():
+
+    """versions of ScopeSim and of the installed IRDB packages"""
+
+    import scopesim as sim
+
+    versions = {"scopesim": sim.__version__}
+    irdb = Path(os.environ.get("DEFAULT_IRDB_LOCATION", "inst_pkgs"))
+    for vfile in sorted(irdb.glob("*/version.yaml")):
+        versions[vfile.parent.name] = vfile.read_text(encoding="utf-8")
+    return versions
+
+
+@cache
+def headerRules():
+
+    """hash of the header rules, so the cached files are made again when they change"""
+
+    rules = Path(__file__).with_name("headers.py").read_bytes()
+    return hashlib.sha256(rules).hexdigest()
+
+
+def cacheKey(rcp, small=False):
+
+    """hash of all the inputs of an exposure that determine its pixels and headers"""
+
+    inputs = [CACHE_FORMAT] + _pixelInputs(rcp) + [getSeed(rcp), bool(small), getVersions(), headerRules()]
+    text = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _cachePath(key):
+    return cacheDir() / key[:2] / f"{key}.fits"
+
+
+def _stampValue(value, old):
+
+    """format a property in the same way as the value already in the header"""
+
+    if isinstance(value, datetime) and isinstance(old, str):
+        return value.isoformat()
+    return value
+
+
+def fetch(fname, rcp, small=False):
+
+    """
+    copy a cached exposure to fname and update its timestamps.
+
+    Returns True if the exposure was taken from the cache.
+    """
+
+    if cacheDir() is None:
+        return False
+    cached = _cachePath(cacheKey(rcp, small))
+    if not cached.exists():
+        return False
+
+    props = rcp["properties"]
+    with fits.open(cached) as hdul:
+        header = hdul[0].header
+        for prop, keyword in STAMP_KEYWORDS.items():
+            if prop in props and keyword in header:
+                header[keyword] = _stampValue(props[prop], header[keyword])
+        hdul.writeto(fname, overwrite=True)
+    print(f"{fname} taken from the output cache")
+    return True
+
+
+def store(fname, rcp, small=False):
+
+    """add a freshly written exposure to the cache"""
+
+    if cacheDir() is None:
+        return
+    cached = _cachePath(cacheKey(rcp, small))
+    cached.parent.mkdir(parents=True, exist_ok=True)
+
+    # copy under a temporary name, so other processes never see a partial file
+    tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+    shutil.copyfile(fname, tmp)
+    os.replace(tmp, cached)
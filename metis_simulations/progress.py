@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+Progress of a run of planned exposures.
+
+A ProgressReporter is made from the exposure plan, and told by the executor
+about every finished, failed or skipped (resumed) task. At most every
+MSIM_PROGRESS_INTERVAL seconds (default 60) it prints
+
+    [PROGRESS] 120/480 exposures (25%) in 0:41:10, 2.9 frames/min (3.1 in the last 10 min),
+               workers 94% busy (min 88%), ETA 2027-01-25 16:40 (1:56:03 left)
+    [PROGRESS] imgLM 60/60, ifu 40/120, lssLM 20/300
+
+and writes the same numbers, with the counts of each block and the time each
+worker spent simulating, as JSON to the status file (by default STATUSNAME
+in the output directory of the run), which can be read from another host:
+
+    python -m metis_simulations.progress output/runStatus.json
+
+The file is replaced, never partly written. The rate and the ETA only count
+the exposures that were simulated in this run, not the skipped ones, and the
+ETA uses the rate of the last RECENT seconds. The busy time of a worker is
+counted when its task finishes.
+"""
+
+import argparse
+import json
+import os
+import socket
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+from .exposurePlan import outputRoot
+
+STATUSNAME = "runStatus.json"
+
+# seconds of recent exposures used for the ETA
+RECENT = 600
+
+
+def defaultBlock(fname):
+
+    """the block of an exposure: the name of its output directory"""
+
+    return os.path.basename(os.path.dirname(str(fname))) or "."
+
+
+def _duration(seconds):
+    return str(timedelta(seconds=round(seconds)))
+
+
+class ProgressReporter():
+
+    def __init__(self, fnames, blockOf=defaultBlock, nWorkers=1, statusFile=None, interval=None):
+
+        """
+        fnames are the files of all the exposures of the run; blockOf gives the
+        block of a file. statusFile is the JSON status file, None for no file.
+        """
+
+        fnames = [str(fname) for fname in fnames]
+        self.blockOf = {fname: blockOf(fname) for fname in fnames}
+        self.total = Counter(self.blockOf.values())
+        self.done = Counter()
+        self.nFailed = 0
+        self.nSkipped = 0
+        self.nWorkers = nWorkers
+        self.workers = {}
+        self.statusFile = statusFile
+        if interval is None:
+            interval = float(os.environ.get("MSIM_PROGRESS_INTERVAL", 60))
+        self.interval = interval
+
+        self.t0 = time.monotonic()
+        self.started = datetime.now()
+        self.recent = deque()
+        self.nSimulated = 0
+        self.lastReport = self.t0
+
+    def skipped(self, fnames):
+
+        """files that were already done in an earlier run"""
+
+        for fname in fnames:
+            self.done[self.blockOf.get(str(fname), defaultBlock(fname))] += 1
+            self.nSkipped += 1
+        self.tick()
+
+    def finished(self, fnames, seconds=None, worker=None):
+
+        """files written by a task, which took seconds on the given worker"""
+
+        now = time.monotonic()
+        for fname in fnames:
+            self.done[self.blockOf.get(str(fname), defaultBlock(fname))] += 1
+        self.nSimulated += len(fnames)
+        self.recent.append((now, len(fnames)))
+        if seconds is not None:
+            stats = self.workers.setdefault(str(worker), {"tasks": 0, "frames": 0, "busySeconds": 0.0})
+            stats["tasks"] += 1
+            stats["frames"] += len(fnames)
+            stats["busySeconds"] += seconds
+        self.tick()
+
+    def failed(self, fnames):
+
+        """files of a task that failed"""
+
+        self.nFailed += len(fnames)
+        self.tick()
+
+    def tick(self):
+
+        """report, if the last report is more than interval seconds old"""
+
+        if time.monotonic() - self.lastReport >= self.interval:
+            self.report()
+
+    def status(self, state="running"):
+
+        """the progress as a dictionary, as written to the status file"""
+
+        now = time.monotonic()
+        elapsed = now - self.t0
+        while self.recent and self.recent[0][0] < now - RECENT:
+            self.recent.popleft()
+
+        nDone = sum(self.done.values())
+        nTotal = sum(self.total.values())
+        rate = 60 * self.nSimulated / elapsed if elapsed > 0 else 0.0
+        window = min(elapsed, RECENT)
+        recentRate = 60 * sum(n for t, n in self.recent) / window if window > 0 else 0.0
+
+        remaining = nTotal - nDone - self.nFailed
+        etaRate = recentRate or rate
+        left = 60 * remaining / etaRate if etaRate > 0 else None
+
+        workers = {name: dict(stats, utilisation=round(stats["busySeconds"] / elapsed, 3) if elapsed > 0 else 0.0)
+                   for name, stats in self.workers.items()}
+        busy = [stats["utilisation"] for stats in workers.values()]
+        # workers that haven't finished anything yet count as idle
+        busy += [0.0] * max(self.nWorkers - len(busy), 0)
+
+        return {"state": state, "host": socket.gethostname(), "pid": os.getpid(),
+                "started": self.started.isoformat(timespec="seconds"),
+                "updated": datetime.now().isoformat(timespec="seconds"),
+                "elapsedSeconds": round(elapsed, 1),
+                "total": nTotal, "done": nDone, "failed": self.nFailed, "skipped": self.nSkipped,
+                "framesPerMinute": round(rate, 3), "recentFramesPerMinute": round(recentRate, 3),
+                "secondsLeft": None if left is None else round(left),
+                "eta": None if left is None else (datetime.now() + timedelta(seconds=left)).isoformat(timespec="seconds"),
+                "utilisation": round(sum(busy) / len(busy), 3) if busy else 0.0,
+                "minUtilisation": min(busy) if busy else 0.0,
+                "blocks": {block: {"done": self.done[block], "total": total}
+                           for block, total in sorted(self.total.items())},
+                "workers": workers}
+
+    def report(self, state="running"):
+
+        """print the progress, and write it to the status file"""
+
+        self.lastReport = time.monotonic()
+        status = self.status(state)
+        print(formatStatus(status))
+        if self.statusFile is not None:
+            writeStatus(status, self.statusFile)
+        return status
+
+    def finish(self, state="finished"):
+
+        """the final report"""
+
+        return self.report(state)
+
+
+def formatStatus(status):
+
+    """the lines printed for a status"""
+
+    total = status["total"]
+    line = (f"[PROGRESS] {status['done']}/{total} exposures ({100 * status['done'] / max(total, 1):.0f}%)"
+            f" in {_duration(status['elapsedSeconds'])}, {status['framesPerMinute']:.1f} frames/min"
+            f" ({status['recentFramesPerMinute']:.1f} in the last {RECENT // 60} min),"
+            f" workers {100 * status['utilisation']:.0f}% busy (min {100 * status['minUtilisation']:.0f}%)")
+    if status["failed"]:
+        line += f", {status['failed']} failed"
+    if status["skipped"]:
+        line += f", {status['skipped']} skipped"
+    if status["state"] != "running":
+        line += f", {status['state']}"
+    elif status["eta"] is not None:
+        line += f", ETA {status['eta'][:16].replace('T', ' ')} ({_duration(status['secondsLeft'])} left)"
+
+    blocks = ", ".join(f"{block} {counts['done']}/{counts['total']}"
+                       for block, counts in status["blocks"].items())
+    return f"{line}\n[PROGRESS] {blocks}"
+
+
+def writeStatus(status, fName):
+
+    """write a status to a file, under a temporary name that is then renamed"""
+
+    tmp = f"{fName}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(status, f, indent=1)
+    os.replace(tmp, fName)
+
+
+def statusPath(fnames, statusFile=None):
+
+    """the status file of a run: statusFile, or STATUSNAME in the common output directory of the files"""
+
+    if statusFile:
+        return statusFile
+    root = outputRoot(fnames)
+    return None if root is None else os.path.join(root, STATUSNAME)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="print the progress of a run from its status file")
+    parser.add_argument("statusFile", nargs="?", default=os.path.join("output", STATUSNAME),
+                        help=f"status file of the run (default output/{STATUSNAME})")
+    args = parser.parse_args()
+
+    with open(args.statusFile, encoding="utf-8") as f:
+        status = json.load(f)
+    print(f"{status['host']}:{status['pid']}, updated {status['updated']}")
+    print(formatStatus(status))
+    for name, stats in sorted(status["workers"].items()):
+        print(f"  worker {name}: {stats['tasks']} tasks, {stats['frames']} frames, "
+              f"{100 * stats['utilisation']:.0f}% busy")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Run simulation blocks as a graph of dependent steps.
+
+    exposure (worker pool, headers fixed on write) -> summary line -> summary file
+    static calibrations (no dependencies)
+
+The exposures of all the blocks, science and calibrations, are run by one
+executor pool, in any order. Everything else is done in a few threads of the
+parent process, as soon as its inputs are there: the static calibrations are
+written while the first exposures are simulated, the summary line of a file
+is read as soon as the file is written, and the summary of a block is
+written when its last exposure is done. There is no barrier at the end of a
+block, other than for the steps that need all of its files.
+"""
+
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from . import setupSimulations as ss
+from . import makeCalibPrototypes as mcp
+from .generateSummary import summaryLine, writeSummary
+
+
+class RunGraph():
+
+    def __init__(self, params):
+
+        """params are the options for the whole run (nCores, testRun, resume, ...)"""
+
+        self.params = params
+        self.plan = []
+        self.blockOf = {}
+        self.blocks = {}
+        self.tasks = []
+
+    def addTask(self, fct, *args):
+
+        """add a step without dependencies"""
+
+        self.tasks.append((fct, args))
+
+    def addBlock(self, name, plan, params):
+
+        """
+        add the exposures of a block, and the steps that depend on them, as
+        set in the block parameters: doStatic and summaryFile (a file name
+        relative to the output directory of the block)
+        """
+
+        # blocks can share an output directory, so they are kept by number
+        key = len(self.blocks)
+        self.plan.extend(plan)
+        for exp in plan:
+            self.blockOf[exp.fname] = key
+        block = {"name": name, "pending": {exp.fname for exp in plan}, "lines": [],
+                 "summaryFile": None}
+        if params.get('summaryFile'):
+            block["summaryFile"] = os.path.join(params['outputDir'], params['summaryFile'])
+        self.blocks[key] = block
+        if not plan and block["summaryFile"] is not None:
+            self.addTask(writeSummary, [], block["summaryFile"])
+
+        if params.get('doStatic'):
+            self.addTask(mcp.generateStaticCalibs, params['outputDir'])
+
+    def run(self, nThreads=2):
+
+        """
+        run the exposures and all the steps that depend on them. With testRun,
+        only the steps without dependencies are run.
+        """
+
+        futures = []
+
+        with ThreadPoolExecutor(max_workers=nThreads) as post:
+            for fct, args in self.tasks:
+                futures.append(post.submit(fct, *args))
+
+            def onDone(exposures):
+                """called by the executor in this process for every finished task"""
+                for exp in exposures:
+                    block = self.blocks[self.blockOf[exp.fname]]
+                    if block["summaryFile"] is not None:
+                        block["lines"].append((exp.fname, post.submit(summaryLine, exp.fname)))
+                    block["pending"].discard(exp.fname)
+                    if not block["pending"] and block["summaryFile"] is not None:
+                        futures.append(post.submit(self._finishSummary, block))
+
+            simulationSet = ss.setupSimulations()
+            simulationSet.params = self.params
+            simulationSet.plan = self.plan
+            simulationSet.executeSimulations(onDone=onDone,
+                                             blockOf=lambda fname: self.blocks[self.blockOf[fname]]["name"])
+
+        errors = [traceback.format_exception(fut.exception()) for fut in futures
+                  if fut.exception() is not None]
+        if errors:
+            raise RuntimeError(f"{len(errors)} post-processing step(s) failed; first error:\n"
+                               + "".join(errors[0]))
+
+    @staticmethod
+    def _finishSummary(block):
+
+        """write the summary of a block, once the lines of all its files are read"""
+
+        lines = [fut.result() for fname, fut in sorted(block["lines"], key=lambda x: x[0])]
+        writeSummary(lines, block["summaryFile"])
@@ -1,21 +1,60 @@
 #!/usr/bin/env python
 
+from contextlib import contextmanager
+from pathlib import Path
+
 from . import setupSimulations as ss
-from . import makeCalibPrototypes as mcp
+from .exposurePlan import writePlan, readPlan
+from .outputCache import sharedSeeds
+from .runGraph import RunGraph
 
-def runSimulationBlock(yamlFiles, params, args):
+# set by collectBlocks, for the campaign scheduler
+_collectedBlocks = None
+
+
+@contextmanager
+def collectBlocks():
+
+    """
+    collect the arguments of runSimulationBlock calls instead of running them.
+
+    Used by campaign.py to read the block definitions in simulationBlocks/
+    by running the scripts. Yields the list of (yamlFiles, params) tuples.
+    """
+
+    global _collectedBlocks
+    _collectedBlocks = []
+    try:
+        yield _collectedBlocks
+    finally:
+        _collectedBlocks = None
+
+
+def planSimulationBlock(yamlFiles, params, args):
+
+    """
+    plans a sequence of yaml files with a set of command line parameters,
+    without running any simulations.
 
-    """runs a sequence of yaml files with a set of command line parameters"""
+    Returns a tuple of Exposure records for all the exposures in the block,
+    including the darks and flats, or None if only YAML files are to be
+    written (testRun and writeYaml). Raises a ValueError if two exposures
+    would get the same random seed (e.g. a YAML file given twice).
+    """
 
     allDarks = []
     allFlats = []
+    plan = []
     # parse any command line overrides
-    
-    for yamlFile in yamlFiles:
+
+    for n, yamlFile in enumerate(yamlFiles):
         params['inputFile'] = yamlFile
+        # the exposures are named after the file; a file planned again in the block gets its own names
+        repeat = yamlFiles[:n].count(yamlFile)
+        params['inputName'] = Path(yamlFile).stem + (f"#{repeat + 1}" if repeat else "")
 
         # instantiate a simulation set and assign the general parameters
-    
+
         simulationSet = ss.setupSimulations()
         extraParams = simulationSet.parseCommandLine(args)
         simulationSet.params = params
@@ -37,42 +76,83 @@ def runSimulationBlock(yamlFiles, params, args):
         # get the start date
         simulationSet.getStartDate()
 
-        # run the simulations
-        simulationSet.runSimulations()
-
-        if not params['testRun']:
-            simulationSet.updateHeaders()
+        # plan the simulations
+        simulationSet.runSimulations(execute=False)
+        plan = plan + simulationSet.plan
 
         # keep track of the date for the next template
         params['startMJD'] = simulationSet.endDate.strftime('%Y-%m-%d %H:%M:%S')
 
         # and a running tally of the parameters for darks and flats
-        
+
         if(params['doCalib'] > 0):
             simulationSet.calculateCalibs()
             allDarks = allDarks + simulationSet.darkParms
             allFlats = allFlats + simulationSet.flatParms
 
     if params.get('testRun') and params.get('writeYaml'):
-        return
+        return None
 
-    # now do all the calibrations
+    # now plan all the calibrations
 
-    allDarks = list(set(allDarks))
-    allFlats = list(set(allFlats))
+    # in the order of first appearance, so the plan doesn't depend on the hash seed
+    allDarks = list(dict.fromkeys(allDarks))
+    allFlats = list(dict.fromkeys(allFlats))
 
-    simulationSet.allFileNames = []
-    simulationSet.allmjd = []
+    simulationSet.plan = []
+    simulationSet.calculateDarks(allDarks,execute=False)
+    simulationSet.calculateFlats(allFlats,"skyFlat",execute=False)
+    simulationSet.calculateFlats(allFlats,"lampFlat",execute=False)
 
-    simulationSet.calculateDarks(allDarks)
-    simulationSet.calculateFlats(allFlats,"skyFlat")
-    simulationSet.calculateFlats(allFlats,"lampFlat")
+    plan = tuple(plan + simulationSet.plan)
+    shared = sharedSeeds(plan)
+    if shared:
+        raise ValueError(f"{len(shared)} sets of exposures in the block would get the same noise, "
+                         f"e.g. {', '.join(map(str, shared[0]))}")
+    return plan
 
-    
-    if(params['doStatic'] == True):
-        mcp.generateStaticCalibs(params['outputDir'])
-    if not params['testRun']:
-        simulationSet.updateHeaders()
+
+def executePlan(plan, params):
+
+    """
+    run all the exposures in a plan in parallel. The headers are fixed
+    before each file is written. Nothing is done if testRun is set.
+    """
+
+    simulationSet = ss.setupSimulations()
+    simulationSet.params = params
+    simulationSet.plan = list(plan)
+
+    simulationSet.executeSimulations()
+
+
+def runSimulationBlock(yamlFiles, params, args):
+
+    """
+    runs a sequence of yaml files with a set of command line parameters
+
+    All the exposures in the block, including the darks and flats, are
+    planned first and then run together, so they can be spread over nCores processes.
+    The static calibrations and the summary (params['summaryFile']) are made
+    while the exposures are running (see runGraph).
+    If params['planFile'] is set, the plan is also written to that file.
+    """
+
+    if _collectedBlocks is not None:
+        _collectedBlocks.append((list(yamlFiles), dict(params)))
+        return
+
+    plan = planSimulationBlock(yamlFiles, params, args)
+    if plan is None:
+        return
+
+    if params.get('planFile'):
+        writePlan(plan, params['planFile'])
+        print(f"Plan of {len(plan)} exposures written to {params['planFile']}")
+
+    graph = RunGraph(params)
+    graph.addBlock(params['outputDir'], plan, params)
+    graph.run()
 
 if __name__ == "__main__":
     import sys
@@ -82,13 +162,20 @@ if __name__ == "__main__":
 
     if params['inputFile'] is None:
         sys.exit("error: -i/--inputFile is required")
-    if params['outputDir'] is None:
-        sys.exit("error: -o/--outputDir is required")
 
     for key, default in (('small', False), ('doStatic', False),
                          ('doCalib', 0), ('testRun', False), ('nCores', 1),
-                         ('writeYaml', False)):
+                         ('writeYaml', False), ('reuseSignal', False),
+                         ('resume', False)):
         if params[key] is None:
             params[key] = default
 
+    # a previously written plan can be run directly
+    if params['inputFile'].endswith('.json'):
+        executePlan(readPlan(params['inputFile']), params)
+        sys.exit()
+
+    if params['outputDir'] is None:
+        sys.exit("error: -o/--outputDir is required")
+
     runSimulationBlock([params['inputFile']], params, sys.argv[1:])
@@ -36,10 +36,6 @@ def runRecipes(argv):
         simulationSet.calculateDarks(simulationSet.darkParms)
         simulationSet.calculateFlats(simulationSet.flatParms)
 
-    # if simulations were done, update the headers
-    if(not simulationSet.params['testRun']):
-        simulationSet.updateHeaders()
-        
     if(simulationSet.params['doStatic']):
         makeCalibPrototypes.generateStaticCalibs(simulationSet.params['outputDir'])
         
@@ -10,6 +10,10 @@ from pathlib import Path
 from itertools import product, cycle, chain
 from collections.abc import Mapping
 import os
+import copy
+import gc
+import json
+from collections import OrderedDict
 
 import numpy as np
 from more_itertools import value_chain
@@ -21,63 +25,45 @@ import astropy.units as u
 
 from .simulationDefinitions import *
 from .sources import *
+from . import outputCache
+from .headers import fixHeaders
+from .stageTiming import NOTIMER, StageTimer
 DEFAULT_IRDB_LOCATION = os.environ["DEFAULT_IRDB_LOCATION"]
 sim.rc.__config__["!SIM.file.local_packages_path"] = DEFAULT_IRDB_LOCATION
 
 logger = get_logger(__file__)
 
-# HACK: closed filter is not yet implemented:
-# changed the hack below, because changing kwargs here changes the props dictionary from which
-# kwargs is generated, outside of this subroutine, for reasons I do not understant.
+# Optical trains are expensive to build (the whole IRDB YAML tree and the
+# effect data files are read), so they are cached per process, keyed by
+# everything in the recipe except the values that change from exposure to
+# exposure. Those are updated in the !OBS properties before each observation.
 
-def simulate(fname, rcp, small=False):
+MAX_CACHED_TRAINS = int(os.environ.get("MSIM_TRAIN_CACHE", 4))
 
-    """
-    Workhorse for an individual simulation.
-    
-    """
+# properties that change between exposures and are not part of the cache key
+PER_EXPOSURE_KEYS = ["dateobs", "MJD-OBS", "tplstart", "tplexpno", "dit", "ndit", "nObs"]
 
-    props = rcp["properties"]
-    wcu = rcp["wcu"]
-    source = rcp["source"]
+_trainCache = OrderedDict()
 
-    
-    # some massaging of the source object, to get into the right
-    # format and units
-    
-    if isinstance(source, Mapping):
-        src_name = source["name"]
-    else:
-        src_name = source
-    src_fct, src_kwargs = SOURCEDICT[src_name]
 
-    if isinstance(source, Mapping):
-        src_kwargs |= source["kwargs"]
+def _trainKey(rcp, small):
 
-    # Fix units
-    if "temperature" in src_kwargs and not isinstance(src_kwargs["temperature"], u.Quantity):
-        src_kwargs["temperature"] <<= u.K
-    if "amplitude" in src_kwargs and not isinstance(src_kwargs["amplitude"], u.Quantity):
-        src_kwargs["amplitude"] <<= u.ABmag
+    """cache key for the optical train of a recipe"""
 
-    src = src_fct(**src_kwargs)
-    #logger.info("Source function: %s", src_fct.__name__)
-    #logger.debug("Source kwargs: %s", src_kwargs)
-    #logger.info("ScopeSim mode: %s", mode)
+    props = {k: v for k, v in rcp["properties"].items() if k not in PER_EXPOSURE_KEYS}
+    return json.dumps([rcp["mode"], props, rcp["wcu"], bool(small)], sort_keys=True, default=str)
 
-    # set up the cmd structure to pass to ScopeSim. This is a bit clunky, but it works, so I'm not
-    # going to mess with it for now. 
-    
-    #set up the simulation
 
-    mode = rcp['mode']
-    
-    if("wavelen" in rcp['properties']):
-        cmd = sim.UserCommands(use_instrument="METIS", set_modes=[mode],properties={"!OBS.wavelen": rcp['properties']['wavelen']})
-    else:
-        cmd = sim.UserCommands(use_instrument="METIS", set_modes=[mode])
+def _setObsProperties(cmd, rcp):
+
+    """
+    copy the properties of a recipe to the !OBS keywords, and set the random
+    seed (see outputCache.getSeed).
 
-    #copy over the OBS settings directly, then set up the optical train
+    Returns True if the shutter should be closed.
+    """
+
+    props = rcp["properties"]
 
     # the shutter stuff is a hack to deal with the fact that closed shutter is not
     # implemented in ScopeSim yet
@@ -90,8 +76,6 @@ def simulate(fname, rcp, small=False):
     keyDefaults["nd_filter_name"] = "open"
     keyDefaults["filter_name"] = "open"
     
-    
-    
     # set required keys
     shutter = False
     for elem in reqKeys:
@@ -101,14 +85,6 @@ def simulate(fname, rcp, small=False):
     for elem in keyDefaults:
         cmd[f"!OBS.{elem}"] = props.get(elem,keyDefaults[elem])
 
-    #cmd["!OBS.catg"] = props["catg"]
-    #cmd["!OBS.type"] = props["type"]
-    #cmd["!OBS.tech"] = props["tech"]
-    #cmd["!OBS.mjd-obs"] = props["MJD-OBS"]
-    #cmd["!OBS.dateobs"] = props["dateobs"]
-    #cmd["!OBS.nd_filter_name"] = props.get("nd_filter_name", "open")
-    #cmd["!OBS.filter_name"] = props["filter_name"]
-
     # now assigning remaining keys
     # TODO add checks of valid values
     for elem in props:
@@ -120,35 +96,64 @@ def simulate(fname, rcp, small=False):
         cmd["!OBS.filter_name"] = "open"
         shutter = True
 
-    #if("tplname" in props.keys()):
-    #    cmd["!OBS.tplname"] = props["tplname"]
-    #if("tplexpno" in props.keys()):
-    #    cmd["!OBS.tplexpno"] = props["tplexpno"]
-    #if("tplstart" in props.keys()):
-    #    cmd["!OBS.tplstart"] = props["tplstart"]
+    cmd["!SIM.random.seed"] = outputCache.getSeed(rcp)
+
+    return shutter
+
+
+def _setWCU(metis, wcu):
+
+    """set the WCU black body, focal plane mask and aperture of an optical train"""
+
+    # set temperatures of black body
+    if(np.all(["bb_temp" in wcu,"is_temp" in wcu, "wcu_temp" in wcu])):
+        metis['wcu_source'].set_temperature(bb_temp=wcu['bb_temp']*u.K, is_temp=wcu['is_temp']*u.K,wcu_temp=wcu['wcu_temp']*u.K)
+
+    # set focal plane mask
+    if("current_fpmask" in wcu):
+        if("xshift") in wcu:
+            metis['wcu_source'].set_fpmask(wcu['current_fpmask'],shift=(wcu['xshift'],wcu['yshift']))
+        else:
+            metis['wcu_source'].set_fpmask(wcu['current_fpmask'])
+
+    # set aperture
+    if("bb_aperture" in wcu):
+        metis['wcu_source'].set_bb_aperture(wcu['bb_aperture'])
+
+
+def _buildOpticalTrain(rcp, small=False, timer=NOTIMER):
+
+    """set up a new optical train for a recipe, including the WCU settings"""
+
+    props = rcp["properties"]
+    wcu = rcp["wcu"]
+
+    # set up the cmd structure to pass to ScopeSim. This is a bit clunky, but it works, so I'm not
+    # going to mess with it for now. 
+    
+    #set up the simulation
+
+    mode = rcp['mode']
+    
+    with timer.stage("commands"):
+        if("wavelen" in rcp['properties']):
+            cmd = sim.UserCommands(use_instrument="METIS", set_modes=[mode],properties={"!OBS.wavelen": rcp['properties']['wavelen']})
+        else:
+            cmd = sim.UserCommands(use_instrument="METIS", set_modes=[mode])
+
+        #copy over the OBS settings directly, then set up the optical train
+
+        shutter = _setObsProperties(cmd, rcp)
 
     # set up the optical train
 
-    cmd["!SIM.random.seed"] = int((props["MJD-OBS"]-60000)*100000)
-    metis = sim.OpticalTrain(cmd)
+    with timer.stage("opticalTrain"):
+        metis = sim.OpticalTrain(cmd)
 
     #set the WCU mode arguments
     if(rcp['wcu'] is not None):
-        
-        # set temperatures of black body
-        if(np.all(["bb_temp" in wcu,"is_temp" in wcu, "wcu_temp" in wcu])):
-            metis['wcu_source'].set_temperature(bb_temp=wcu['bb_temp']*u.K, is_temp=wcu['is_temp']*u.K,wcu_temp=wcu['wcu_temp']*u.K)
-
-        # set focal plane mask
-        if("current_fpmask" in wcu):
-            if("xshift") in wcu:
-                metis['wcu_source'].set_fpmask(wcu['current_fpmask'],shift=(wcu['xshift'],wcu['yshift']))
-            else:
-                metis['wcu_source'].set_fpmask(wcu['current_fpmask'])
-
-        # set aperture
-        if("bb_aperture" in wcu):
-            metis['wcu_source'].set_bb_aperture(wcu['bb_aperture'])
+        with timer.stage("wcu"):
+            _setWCU(metis, wcu)
 
     if small:
         # Hack to make the detectors smaller, so we can run the simulations
@@ -176,14 +181,240 @@ def simulate(fname, rcp, small=False):
     if shutter:
         metis.optics_manager["METIS"].add_effect(sim.effects.Shutter())
 
+    return metis
+
+
+def getOpticalTrain(rcp, small=False, timer=NOTIMER):
+
+    """
+    return an optical train for a recipe, ready to observe.
+
+    A cached train with the same configuration is reused if possible. Many
+    effects resolve their !-keywords into their meta data when they are
+    applied (e.g. the random seed of the detector noise), so the meta data
+    of all effects is restored to the state it had just after the train was
+    built, before the !OBS properties of this exposure are set.
+
+    The stages are timed with timer, a stageTiming.StageTimer.
+    """
+
+    key = _trainKey(rcp, small)
+
+    if key in _trainCache:
+        with timer.stage("trainReset"):
+            _trainCache.move_to_end(key)
+            metis, metas = _trainCache[key]
+            for eff, meta in metas:
+                eff.meta = copy.deepcopy(meta)
+            _setObsProperties(metis.cmds, rcp)
+        return metis
+
+    metis = _buildOpticalTrain(rcp, small=small, timer=timer)
+    metas = [(eff, copy.deepcopy(eff.meta)) for eff in metis.optics_manager.all_effects]
+    _trainCache[key] = (metis, metas)
+    while len(_trainCache) > MAX_CACHED_TRAINS:
+        _trainCache.popitem(last=False)
+
+    return metis
+
+
+# Sources are identical for all the exposures of a recipe (and often between
+# recipes), and some are slow to build (e.g. star fields with spectra from a
+# spectral library), so they are cached per process as well, keyed by the
+# source name and the keyword arguments given in the recipe. This is safe as
+# OpticalTrain.observe works on a copy of the source.
+
+MAX_CACHED_SOURCES = int(os.environ.get("MSIM_SOURCE_CACHE", 16))
+
+_sourceCache = OrderedDict()
+
+
+def getSource(source):
+
+    """
+    return the ScopeSim source for the source entry of a recipe, which is either
+    a name in SOURCEDICT, or a dictionary with the name and extra kwargs.
+    """
+
+    # some massaging of the source object, to get into the right
+    # format and units
+    
+    if isinstance(source, Mapping):
+        src_name = source["name"]
+        kwargs = source.get("kwargs") or {}
+    else:
+        src_name = source
+        kwargs = {}
+
+    key = json.dumps([src_name, kwargs], sort_keys=True, default=str)
+    if key in _sourceCache:
+        _sourceCache.move_to_end(key)
+        return _sourceCache[key]
+
+    # copy the defaults, so that the kwargs of one recipe don't end up
+    # in SOURCEDICT for the next one
+    src_fct, src_kwargs = SOURCEDICT[src_name]
+    src_kwargs = dict(src_kwargs) | kwargs
+
+    # Fix units
+    if "temperature" in src_kwargs and not isinstance(src_kwargs["temperature"], u.Quantity):
+        src_kwargs["temperature"] <<= u.K
+    if "amplitude" in src_kwargs and not isinstance(src_kwargs["amplitude"], u.Quantity):
+        src_kwargs["amplitude"] <<= u.ABmag
+
+    src = src_fct(**src_kwargs)
+    #logger.info("Source function: %s", src_fct.__name__)
+    #logger.debug("Source kwargs: %s", src_kwargs)
+
+    _sourceCache[key] = src
+    while len(_sourceCache) > MAX_CACHED_SOURCES:
+        _sourceCache.popitem(last=False)
+
+    return src
+
+
+# HACK: closed filter is not yet implemented:
+# changed the hack below, because changing kwargs here changes the props dictionary from which
+# kwargs is generated, outside of this subroutine, for reasons I do not understant.
+
+def simulate(fname, rcp, small=False):
+
+    """
+    Workhorse for an individual simulation.
+
+    If the output cache is enabled and has an exposure with the same inputs,
+    that is used instead. The time of each stage is logged (see stageTiming).
+
+    The readout is closed once it is written, so nothing of the exposure
+    but the cached optical train and source stays in the process; returns
+    the filename.
+    """
+
+    props = rcp["properties"]
+    source = rcp["source"]
+    timer = StageTimer(fname, rcp)
+
+    with timer.stage("cache"):
+        cached = outputCache.fetch(fname, rcp, small=small)
+    if cached:
+        timer.done(cached=True)
+        return fname
+
+    with timer.stage("source"):
+        src = getSource(source)
+
+    metis = getOpticalTrain(rcp, small=small, timer=timer)
+
     # now observe and readout
-    metis.observe(src)
-    hdus = metis.readout(dit=props['dit'],ndit=props['ndit'])
+    with timer.stage("observe"):
+        metis.observe(src)
+    with timer.stage("readout"):
+        hdus = metis.readout(dit=props['dit'],ndit=props['ndit'])
+
+    with timer.stage("write"):
+        _writeReadout(hdus[0], fname, props)
+    del hdus
+    _releaseExposure(metis)
+    with timer.stage("cache"):
+        outputCache.store(fname, rcp, small=small)
+    timer.done()
+    return fname
+
+
+def simulateRepeats(fnames, rcps, small=False):
+
+    """
+    Simulate a set of exposures that differ only in their timestamps, e.g. the
+    repeats of a dark or flat.
+
+    The source is observed once, and each exposure is a separate readout of
+    the same noiseless image plane, with its own !OBS properties and random
+    seed, so each gets an independent realisation of the detector noise.
+
+    The shared stages are timed as part of the first exposure that is simulated.
+    Each readout is closed once it is written; returns the filenames.
+    """
+
+    timers = [StageTimer(fname, rcp, repeats=len(fnames)) for fname, rcp in zip(fnames, rcps)]
+    cached = []
+    for fname, rcp, timer in zip(fnames, rcps, timers):
+        with timer.stage("cache"):
+            cached.append(outputCache.fetch(fname, rcp, small=small))
+        if cached[-1]:
+            timer.done(cached=True)
+    if all(cached):
+        return list(fnames)
+
+    timer = timers[cached.index(False)]
+    metis = getOpticalTrain(rcps[0], small=small, timer=timer)
+    with timer.stage("source"):
+        src = getSource(rcps[0]["source"])
+    with timer.stage("observe"):
+        metis.observe(src)
+
+    # the detector effects resolve their meta data (e.g. the seed) on readout
+    metas = [(eff, copy.deepcopy(eff.meta)) for eff in metis.optics_manager.all_effects]
+
+    for i, (fname, rcp) in enumerate(zip(fnames, rcps)):
+        if cached[i]:
+            continue
+        props = rcp["properties"]
+        timer = timers[i]
+        with timer.stage("trainReset"):
+            for eff, meta in metas:
+                eff.meta = copy.deepcopy(meta)
+            _setObsProperties(metis.cmds, rcp)
+
+        # don't reset, as that would clear the properties that were just set
+        with timer.stage("readout"):
+            hdus = metis.readout(dit=props['dit'],ndit=props['ndit'],reset=False)
+        with timer.stage("write"):
+            _writeReadout(hdus[0], fname, props)
+        del hdus
+        with timer.stage("cache"):
+            outputCache.store(fname, rcp, small=small)
+        timer.done()
+
+    _releaseExposure(metis)
+    return list(fnames)
+
+
+def _writeReadout(hdul, fname, props):
+
+    """final header changes for a readout, write it to fname and close it"""
 
     # can't remember why this is here, check \TODO
-    hdus[0][0].header['HIERARCH ESO DPR TECH'] = props["tech"]
-    hdus[0].writeto(fname,overwrite=True)
-    return hdus[0]
+    hdul[0].header['HIERARCH ESO DPR TECH'] = props["tech"]
+    fixHeaders(hdul, props["MJD-OBS"])
+    hdul.writeto(fname,overwrite=True)
+    hdul.close()
+
+
+def _releaseExposure(metis):
+
+    """
+    drop what an optical train keeps of its last exposure (the fields of
+    view, the copy of the source, the image planes and the readouts), so a
+    cached train only holds its configuration; observe makes them again
+    """
+
+    metis._last_fovs = None
+    metis._last_source = None
+    metis.image_planes = []
+    for manager in metis.detector_managers:
+        manager._latest_exposure = None
+
+
+def releaseState():
+
+    """
+    drop the cached optical trains and sources of this process, and collect
+    the garbage. Used when a process that can't be recycled gets too large.
+    """
+
+    _trainCache.clear()
+    _sourceCache.clear()
+    gc.collect()
 
 
 def _logger_setup(verbosity: int) -> None:
@@ -32,10 +32,19 @@ import json
 import astropy
 import copy
 import sys
+import os
+import time
 
 from . import simulationDefinitions as sd
-from .scopesimWrapper import simulate
+from .executor import getNCores, runExposures
+from .exposurePlan import Exposure
+from .journal import JournalSet
+from .headerIndex import IndexSet
+from .headers import patchHeaders
+from .memoryBudget import MemoryBudget, MemoryEstimates, estimatesPath
+from .progress import ProgressReporter, defaultBlock, statusPath
 from .csvParser import loadCSV
+from .timeline import resolveTimes
 import importlib.resources as resources
 
 class setupSimulations():
@@ -45,9 +54,15 @@ class setupSimulations():
         self.calibSet = None
         self.tObs = None
         self.firstIt = True
-        self.tDelt = TimeDelta(0, format='sec') 
+        self.tDelt = 0.0
+        self.pending = []
         self.allFileNames = []
         self.allmjd = []
+        self.plan = []
+        self.journal = None
+        self.headerIndex = None
+        self.progress = None
+        self.memory = None
 
         with resources.open_text('metis_simulations', 'templates.yaml') as file:
             self.templates =  yaml.safe_load(file)
@@ -99,6 +114,27 @@ class setupSimulations():
         parser.add_argument('-w', '--writeYaml', action="store_true", default=None,
                             help='write a YAML file with the parsed recipes next to the input CSV (only meaningful with .csv input). Combine with --testRun to skip simulation entirely.')
 
+        parser.add_argument('-r', '--reuseSignal', action="store_true", default=None,
+                            help='simulate the noiseless signal of repeated darks and flats once, and only draw new detector noise for each repeat')
+
+        parser.add_argument('-c', '--resume', action="store_true", default=None,
+                            help='skip exposures that were already simulated with the same inputs in a previous (interrupted) run')
+
+        parser.add_argument('-a', '--cacheDir', type=str, default=None,
+                            help='directory of a cache of simulated files; exposures with the same inputs as a cached one are copied from the cache, with new timestamps')
+
+        parser.add_argument('-y', '--summaryFile', type=str, default=None,
+                            help='write a summary of the headers of the simulated files to this file in the output directory')
+
+        parser.add_argument('-p', '--planFile', type=str, default=None,
+                            help='write the list of planned exposures to a JSON file, which can be run later by passing it as the input file. Combine with --testRun to only plan.')
+
+        parser.add_argument('-u', '--statusFile', type=str, default=None,
+                            help='file for the progress of the run, updated while it runs (default runStatus.json in the output directory)')
+
+        parser.add_argument('-m', '--memoryBudget', type=float, default=None,
+                            help='memory in GB that all the worker processes together may use; exposures are only started when their estimated memory fits (default MSIM_MEMORY_BUDGET, or no limit)')
+
         inArgs = parser.parse_args(args)
         params = vars(inArgs)
 
@@ -114,6 +150,23 @@ class setupSimulations():
 
         return params
 
+    @property
+    def tObs(self):
+
+        """
+        the observation time; kept as a start time and an offset in seconds,
+        so that the times of the exposures can be converted in one go
+        """
+
+        if(self.tStart is None):
+            return None
+        return self.tStart + TimeDelta(self.tOffset, format='sec')
+
+    @tObs.setter
+    def tObs(self, value):
+        self.tStart = value
+        self.tOffset = 0.0
+
     def loadInput(self):
 
         """
@@ -180,7 +233,7 @@ class setupSimulations():
         in the first entry in the YAML file, or set to default
         """
         
-        recipe =  self.allrcps[list(self.allrcps.keys())[0]]
+        recipe =  next(iter(self.allrcps.values()))
 
         if(self.params['startMJD'] is not None):
             self.tObs = Time(datetime.strptime(self.params['startMJD'], '%Y-%m-%d %H:%M:%S'))
@@ -195,11 +248,83 @@ class setupSimulations():
         self.tplStart = self.startMJD
         self.tempNExp = 0 # exposure number
         
-    def runSimulations(self):
+    def runSimulations(self,execute=True):
 
-        """Calls _run for main recipes"""
+        """
+        Calls _run for main recipes. If execute is False, the exposures are
+        only planned, and are run by a later call to executeSimulations
+        """
         
         self._run(self.allrcps)
+        if(execute):
+            self.executeSimulations()
+
+    def executeSimulations(self, onDone=None, blockOf=defaultBlock):
+
+        """
+        Run all the exposures planned so far in parallel, using nCores processes.
+        Nothing is simulated if testRun is set.
+
+        Finished exposures are recorded in a journal in the output directory;
+        with resume set, exposures that were already finished with the same
+        inputs are skipped. The headers of the written files are added to the
+        header index of the output directory (see headerIndex).
+
+        The progress is reported per block (blockOf(fname), by default the
+        output directory), and written to the status file (see progress).
+
+        The memory used by each mode is measured and kept in the estimates
+        file of the output directory; with a memoryBudget (in GB), the
+        exposures are started so that the workers stay within it (see
+        memoryBudget).
+
+        onDone(exposures) is called for each set of finished (or skipped) exposures.
+        """
+
+        plan = self.plan
+        self.plan = []
+        if(self.params['testRun'] or len(plan) == 0):
+            return
+
+        # picked up by scopesimWrapper in the worker processes
+        if(self.params.get('cacheDir')):
+            os.environ["MSIM_OUTPUT_CACHE"] = str(self.params['cacheDir'])
+
+        self.journal = JournalSet()
+        self.headerIndex = IndexSet()
+        fnames = [exp.fname for exp in plan]
+        self.progress = ProgressReporter(fnames, blockOf=blockOf, nWorkers=getNCores(self.params['nCores']),
+                                         statusFile=statusPath(fnames, self.params.get('statusFile')))
+        if(self.params.get('resume')):
+            todo, nSkipped = self.journal.remaining(plan)
+            print(f"Resuming: {nSkipped} exposures already done, {len(todo)} to run")
+            if(nSkipped > 0):
+                skipped = [exp for exp in plan if self.journal.isDone(exp)]
+                self.progress.skipped([exp.fname for exp in skipped])
+                if(onDone is not None):
+                    onDone(skipped)
+            plan = todo
+
+        budget = self.params.get('memoryBudget') or os.environ.get("MSIM_MEMORY_BUDGET")
+        self.memory = MemoryBudget(MemoryEstimates(estimatesPath(fnames)),
+                                   budgetMB=1024 * float(budget) if budget else None,
+                                   nWorkers=getNCores(self.params['nCores']))
+        if(self.memory.limited):
+            print(f"Memory budget of {float(budget):g} GB for {self.memory.nWorkers} workers")
+
+        self.progress.report()
+        try:
+            runExposures(plan, self.params['nCores'],
+                         reuseSignal=bool(self.params.get('reuseSignal')),
+                         journal=self.journal, onDone=onDone, index=self.headerIndex,
+                         progress=self.progress, memory=self.memory)
+        except KeyboardInterrupt:
+            self.progress.finish("interrupted")
+            raise
+        except Exception:
+            self.progress.finish("failed")
+            raise
+        self.progress.finish()
 
 
     def increment(self,recipe):
@@ -207,29 +332,71 @@ class setupSimulations():
         """
         increment time/nobs related variables for a recipe
         
-        update dateobs, mjd-obs, teplexpno in the recipe
+        update teplexpno in the recipe; dateobs and mjd-obs are set by resolveTimes
         update tDelt, tplExpno for the next recipe
-        set the filename
         """
 
-        self.tObs = self.tObs + self.tDelt
+        self.tOffset += self.tDelt
         dit = recipe["properties"]['dit']
         if isinstance(dit, (list, tuple)):
             assert len(dit) == 1, f"{dit=} is a list"
             dit = dit[0]
+        self.dit = dit
 
-        self.tDelt =  TimeDelta(float(dit)*recipe['properties']['ndit']*1.2+1, format='sec')
+        self.tDelt = float(dit)*recipe['properties']['ndit']*1.2+1
 
-        recipe["properties"]["dateobs"] = self.tObs.tt.datetime
-        recipe["properties"]["MJD-OBS"] = self.tObs.mjd
+        # placeholders, to keep the order of the keywords
+        recipe["properties"]["dateobs"] = None
+        recipe["properties"]["MJD-OBS"] = None
 
         recipe["properties"]["tplexpno"] = self.tplExpno
 
-        self.fname = self.outDir / self.generateFilename(recipe["properties"]['dateobs'],recipe['mode'],dit,recipe["do.catg"])
         self.tplExpno += 1
 
         return recipe
 
+    def addExposure(self,recipe,expId,group=None,tplOffset=None):
+
+        """
+        add an exposure at the current observation time; it is added to the
+        plan by resolveTimes. expId names the exposure uniquely in the block
+        (its random seed is derived from it, see outputCache.getSeed).
+        tplOffset is the offset of the template start, for templates that
+        don't have a tplstart yet.
+        """
+
+        # copied, as increment updates the recipe in place for the next exposure
+        self.pending.append((copy.deepcopy(recipe), self.tOffset, self.dit, group, tplOffset, expId))
+
+    def resolveTimes(self):
+
+        """
+        set dateobs, mjd-obs (and tplstart) of the exposures added since the
+        last call, converting all the times at once, and add them to the plan
+        """
+
+        if(len(self.pending) == 0):
+            return
+
+        offsets = [p[1] for p in self.pending]
+        tplOffsets = [p[4] for p in self.pending if p[4] is not None]
+        mjds, dates = resolveTimes(self.tStart, offsets + tplOffsets)
+        tplDates = iter(dates[len(offsets):])
+
+        for i, (recipe, offset, dit, group, tplOffset, expId) in enumerate(self.pending):
+            recipe["properties"]["dateobs"] = dates[i]
+            recipe["properties"]["MJD-OBS"] = mjds[i]
+            if(tplOffset is not None):
+                recipe["properties"]["tplstart"] = next(tplDates)
+
+            fname = self.outDir / self.generateFilename(dates[i],recipe['mode'],dit,recipe["do.catg"])
+            self.allFileNames.append(fname)
+            self.allmjd.append(mjds[i])
+            self.plan.append(Exposure.fromRecipe(fname,recipe,self.params["small"],group=group,
+                                                 expId=expId))
+
+        self.pending = []
+
     def copyRecipe(self,tpe,band):
 
         recipe = None
@@ -241,12 +408,11 @@ class setupSimulations():
             recipe = json.loads(json.dumps(self.templates[tpe]["ifu"]))
         return recipe
 
-    def calculateFlats(self,flatParams,tpe):
+    def calculateFlats(self,flatParams,tpe,execute=True):
         
-        allArgs = []
         for elem in flatParams:
             # do a separate template for each set of parameters
-            tplStart = self.tObs.tt.datetime
+            tplOffset = self.tOffset
 
             # now for each iteration
             for i in range(self.params['doCalib']):
@@ -265,36 +431,27 @@ class setupSimulations():
                 if("wcu" not in recipe.keys()):
                     recipe["wcu"] = None
 
-                recipe["properties"]["tplstart"] = tplStart
+                recipe["properties"]["tplstart"] = None
                 recipe["properties"]["filter_name"] = elem[0]
                 recipe["properties"]["nd_filter_name"] = elem[1]
 
                 recipe = self.increment(recipe)
 
-                self.allFileNames.append(self.fname)
-                self.allmjd.append(self.tObs.mjd)
+                # add the exposure to the plan; the repeats only differ in time
+                self.addExposure(recipe, f"{tpe}{elem}/{i}", group=f"{tpe}{elem}", tplOffset=tplOffset)
 
-                # append the arguments to the list
-                allArgs.append((self.fname,recipe,self.params["small"]))
-                simulate(self.fname, recipe, small=self.params['small'])
+        self.resolveTimes()
         # now actually run
-        #if(not self.params['testRun']):
-        #    nCores = max(min(self.params['nCores'], cpu_count() - 1), 1)
-        #
-        #    with Pool(nCores) as pool:
-        #        pool.starmap(simulate, allArgs)
-        #        #simulate(fname, recipe, small=self.params['small'])
-        #        pool.close()
-        #        pool.join()
+        if(execute):
+            self.executeSimulations()
 
                 
-    def calculateDarks(self,darkParams):
+    def calculateDarks(self,darkParams,execute=True):
 
         # do a separate template for each set of parameters
         
-        allArgs = []
         for elem in darkParams:
-            tplStart = self.tObs.tt.datetime
+            tplOffset = self.tOffset
             # now for each iteration
 
             for i in range(self.params['doCalib']):
@@ -305,37 +462,28 @@ class setupSimulations():
                     continue
 
                 recipe["wcu"] = None
-                recipe["properties"]["tplstart"] = tplStart
+                recipe["properties"]["tplstart"] = None
                 recipe["properties"]["dit"] = elem[0]
                 recipe["properties"]["ndit"] = elem[1]
  
                 recipe = self.increment(recipe)
 
-                self.allFileNames.append(self.fname)
-                self.allmjd.append(self.tObs.mjd)
-
-                # append teh arguments to the 
-                allArgs.append((self.fname,recipe,self.params["small"]))
+                # add the exposure to the plan; the repeats only differ in time
+                self.addExposure(recipe, f"dark{elem}/{i}", group=f"dark{elem}", tplOffset=tplOffset)
 
+        self.resolveTimes()
         self.endDate = self.tObs.tt.datetime.replace(microsecond=0)
         # now actually run
-        if(not self.params['testRun']):
-            # Always keep one core free.
-            nCores = max(min(self.params['nCores'], cpu_count() - 1), 1)
-        
-            with Pool(nCores) as pool:
-                pool.starmap(simulate, allArgs)
-                #simulate(fname, recipe, small=self.params['small'])
-                pool.close()
-                pool.join()
+        if(execute):
+            self.executeSimulations()
 
             
     def _run(self,allrcps):
         
         """
-        Run the set of recipes contained for a single template
-        
-        If testRun is set, everything except the simulation will be done. 
+        Plan the set of recipes contained for a single template. An
+        Exposure record for each output file is added to self.plan; the
+        plan is run by executeSimulations.
 
         Most of the routines handles some bookkeeping/formatting with the dictionaries,
         and handling the various options for the observation date/time. 
@@ -346,16 +494,18 @@ class setupSimulations():
         self.outDir = Path(self.params['outputDir'])
         self.outDir.mkdir(parents=True, exist_ok=True)
 
-        allArgs = []
-        
+        # the exposures are named after the input file (see planSimulationBlock), the recipe and their number
+        inputName = self.params.get('inputName') or Path(self.params.get('inputFile') or "").stem
+
         # cycle through all the recipes
+        nRecipes = 0
         for name, recipe in allrcps.items():
 
             # force dit to be a float
             recipe["properties"]["dit"] = float(recipe["properties"]["dit"])
+            nRecipes += 1
             
             # get the mode and the prefix for the title
-            print(recipe)
             mode = recipe["mode"]
             prefix = recipe["do.catg"]
             nObs = recipe["properties"]["nObs"]
@@ -367,26 +517,22 @@ class setupSimulations():
 
             # for nObs exposures of each set of parameters
             # this loop mostly calculates the time variables for each
-            # observation, and saves the arguments for the simulation in
-            # a list. The actually calling occurs afterwards, for parallelization
+            # observation, and saves an Exposure record for the simulation in
+            # the plan. The actually calling occurs afterwards, for parallelization
             
-            for _ in range(nObs):        
+            for i in range(nObs):        
 
                 # set the time related keywords and increment the observing time.
                 # note that tDelt = 0 on the first iteration
 
                 recipe = self.increment(recipe)
 
-                self.allFileNames.append(self.fname)
-                self.allmjd.append(self.tObs.mjd)
-
                 # set WCU to None if this isn't WCU data
                 if("wcu" not in recipe.keys()):
                    recipe["wcu"] = None
 
-                # add the arguments to the list
-                allArgs.append((self.fname,recipe,self.params["small"]))
-                simulate(self.fname, recipe, small=self.params['small'])
+                # add the exposure to the plan; the times are set at the end
+                self.addExposure(recipe, f"{inputName}:{name}/{i}")
 
                 # if the observation is WCU, add a WCU frame to the image, as WCU darks are part of the
                 # same template. TODO: set to > 1 if desired
@@ -401,29 +547,16 @@ class setupSimulations():
                         recipeDark["properties"]["nd_filter_name"] = recipe["properties"]["nd_filter_name"] 
                         recipeDark["properties"]["filter_name"] = recipe["properties"]["filter_name"] 
                         recipeDark = self.increment(recipeDark)
-                        
-                        self.allFileNames.append(self.fname)
-                        self.allmjd.append(self.tObs.mjd)
-                        
-                        allArgs.append((self.fname, recipeDark, self.params["small"]))
-                        simulate(self.fname, recipeDark, small=self.params['small'])
+                        self.addExposure(recipeDark, f"{inputName}:{name}/wcuOff/{i}")
 
         # calculate the observation date for the next observation, for
         # stringing a sequence of templates together
         
-        self.tObs = self.tObs + self.tDelt
+        self.tOffset += self.tDelt
+        nPlanned = len(self.plan)
+        self.resolveTimes()
         self.endDate = self.tObs.tt.datetime.replace(microsecond=0)
-
-        # now actually run
-        if(not self.params['testRun']):
-            # Always keep one core free.
-            nCores = max(min(self.params['nCores'], cpu_count() - 1), 1)
-        
-            #with Pool(nCores) as pool:
-            #    pool.starmap(simulate, allArgs)
-            #    #simulate(fname, recipe, small=self.params['small'])
-            #    pool.close()
-            #    pool.join()
+        print(f"Planned {len(self.plan) - nPlanned} exposures from {nRecipes} recipes")
 
     def calculateCalibs(self):
 
@@ -464,126 +597,21 @@ class setupSimulations():
     def updateHeaders(self):
     
         """
-        add keywords to a list of files, fixing anything that isn't handled by ScopeSim. 
-        
-        DPR .TECH, .FILTER and .TYPE are set by ScopeSim, DRS.FILTER .ND_FILTER, 
-        and DET.DIT and .NDIT are set in ScopeSim
-    
-        We use the TECH to get INS.MODE
-        Sets the DRS.SLIT to the default value for now (will fix later). TODO.
-        Sets INS.OPTI*.NAME to the filter, slit as indicated by the TECH, FILTER and SLIT keyword
-    
-        For HCI / Coronagraph modes, we set the TECH keyword to a non valid value in Scopesim, 
-        and use that to set the DRS.MASK, correct DPR.TECH, and INS.OPTI*.NAME values. This is kludgy,
-        and will be fixed later. TODO.
-    
-        We check the TYPE keyword for LASER Sources. 
-    
-        The correct MJD date is written
+        apply the header fixes of headers.fixHeaders to a list of files that
+        were already written, e.g. after a change of the rules.
+
+        The headers of newly simulated files are fixed before they are written, so
+        this is only needed for older files. Only the headers are rewritten if
+        possible (see headers.patchHeaders).
 
         Adjusted files **WILL OVERWRITE EXISTING FILES**
 
         The list of files is compiled during the previous running of the simulations
         """
         
-    
+        progress = ProgressReporter(self.allFileNames)
         for fName,mjd in zip(self.allFileNames,self.allmjd):
-            print(f'Processing {fName}')
-            # open the file
-            hdul = fits.open(fName)
-
-            for hdu in hdul:
-                # Remove lower case keywords, in particular "pixel_size"
-                for k in hdu.header:
-                    if k.upper() != k:
-                        print(f"Lower case keyword found and removed: {k}")
-                        hdu.header.pop(k)
-
-
-            # fix for the occasional keyword that gets written as boolean not string
-            for elem in hdul[0].header:
-                if("OPTI" in elem and "NAME" in elem):
-                    if isinstance(hdul[0].header[elem], bool):
-                        hdul[0].header[elem] = str(hdul[0].header[elem])
-                if("CUBE MODE" in elem):
-                    if isinstance(hdul[0].header[elem], bool):
-                        hdul[0].header[elem] = str(hdul[0].header[elem])
-                
-            hdul[0].header['MJD-OBS'] = mjd
-            
-            #if type(hdul[0].header['MJD-OBS']) == str:
-            #    mjdobs = hdul[0].header['MJD-OBS']
-            #    hdul[0].header['MJD-OBS'] = astropy.time.Time(mjdobs,format="isot").mjd
-            # get the tech and filter keywords
-           
-            tech = hdul[0].header['HIERARCH ESO DPR TECH']
-            filt = hdul[0].header['HIERARCH ESO DRS FILTER']
-
-            
-            if(tech == "LSS,LM"):
-                hdul[0].header['HIERARCH ESO INS MODE'] = "SPEC_LM"
-                #hdul[0].header['HIERARCH ESO INS OPTI9 NAME'] = filt
-                #hdul[0].header['HIERARCH ESO INS DRS SLIT'] = "C-38_1"
-            if(tech == "LSS,N"):
-                hdul[0].header['HIERARCH ESO INS MODE'] = "SPEC_N_LOW"
-                #hdul[0].header['HIERARCH ESO INS OPTI12 NAME'] = filt
-                hdul[0].header['HIERARCH ESO INS DRS SLIT'] = "C-38_1"
-            
-            #IMAGING
-            if(tech == "IMAGE,LM"):
-                hdul[0].header['HIERARCH ESO INS MODE'] = "IMG_LM"
-                #hdul[0].header['HIERARCH ESO INS OPTI10 NAME'] = filt
-            if(tech == "IMAGE,N"):
-                hdul[0].header['HIERARCH ESO INS MODE'] = "IMG_N"
-                #hdul[0].header['HIERARCH ESO INS OPTI13 NAME'] = filt
-            
-            #IFU
-            if(tech == "IFU"):
-                hdul[0].header['HIERARCH ESO INS MODE'] = "IFU_nominal"
-                #hdul[0].header['HIERARCH ESO INS OPTI6 NAME'] = filt
-                hdul[0].header['HIERARCH ESO DRS IFU'] = filt
-                hdul[0].header['HIERARCH ESO DPR TECH'] = "IFU"
-                
-            #HCI
-            if(tech == "RAVC,LM"):
-                #hdul[0].header['HIERARCH ESO INS OPTI10 NAME'] = filt
-                hdul[0].header['HIERARCH ESO INS MODE'] = "IMG_LM_RAVC"
-                hdul[0].header['HIERARCH ESO DRS MASK'] = "VPM-L,RAP-LM,RLS-LMS"
-                hdul[0].header['HIERARCH ESO INS OPTI1 NAME'] = "RAP-LM"
-                hdul[0].header['HIERARCH ESO INS OPTI3 NAME'] = "VPM-L"
-                hdul[0].header['HIERARCH ESO INS OPTI5 NAME'] = "RLS-LMS"
-                hdul[0].header['HIERARCH ESO DPR TECH'] = "IMAGE,LM"
-            
-            if(tech == "APP,LM"):
-                #hdul[0].header['HIERARCH ESO INS OPTI10 NAME'] = filt
-                hdul[0].header['HIERARCH ESO INS MODE'] = "IMG_LM_APP"
-                hdul[0].header['HIERARCH ESO DPR TECH'] = "IMAGE,LM"
-                hdul[0].header['HIERARCH ESO INS OPTI1 NAME'] = "RAP-LM"
-                hdul[0].header['HIERARCH ESO INS OPTI3 NAME'] = "VPM-L"
-                hdul[0].header['HIERARCH ESO INS OPTI5 NAME'] = "APP-LMS"
-                hdul[0].header['HIERARCH ESO DRS MASK'] = "VPM-L,RAP-LM,APP-LMS"
-            
-            if(tech == "RAVC,IFU"):
-                hdul[0].header['HIERARCH ESO INS OPTI6 NAME'] = filt
-                hdul[0].header['HIERARCH ESO INS MODE'] = "IFU_nominal_RAVC"
-                hdul[0].header['HIERARCH ESO DRS IFU'] = filt
-                hdul[0].header['HIERARCH ESO DPR TECH'] = "IFU"
-                hdul[0].header['HIERARCH ESO INS OPTI1 NAME'] = "RAP-LM"
-                hdul[0].header['HIERARCH ESO INS OPTI3 NAME'] = "VPM-L"
-                hdul[0].header['HIERARCH ESO INS OPTI5 NAME'] = "RLS-LMS"
-                hdul[0].header['HIERARCH ESO DRS MASK'] = "VPM-L,RAP-LM,RLS-LMS"
-    
-            #OTHER
-            if(hdul[0].header['HIERARCH ESO DPR TYPE'] == "WAVE"):   
-                hdul[0].header['HIERARCH ESO SEQ WCU LASER1 NAME'] = "LASER1"
-    
-            #OTHER
-            if(tech == "PUP,LM"):
-                hdul[0].header['HIERARCH ESO INS MODE'] = "IMG_LM"
-                hdul[0].header['HIERARCH ESO INS OPTI15 NAME'] = "PUPIL1"
-            if(tech == "PUP,N"):
-                hdul[0].header['HIERARCH ESO INS MODE'] = "IMG_N"
-                hdul[0].header['HIERARCH ESO INS OPTI15 NAME'] = "PUPIL2"
-    
-            hdul.writeto(fName,overwrite=True)
-            hdul.close()
+            t0 = time.perf_counter()
+            patchHeaders(fName, mjd)
+            progress.finished([fName], time.perf_counter() - t0, os.getpid())
+        progress.finish()
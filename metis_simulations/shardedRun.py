@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""
+Sharded execution of an exposure plan over several hosts.
+
+A coordinator writes the plan to a directory that all the hosts can see
+(e.g. on NFS scratch), and any number of worker processes, on any host,
+take tasks from it until there are none left:
+
+    python -m metis_simulations.shardedRun init /scratch/run1 --plan plan.json
+    python -m metis_simulations.shardedRun work /scratch/run1            (on each host)
+    python -m metis_simulations.shardedRun local /scratch/run1 -n 8      (8 workers on this host)
+    python -m metis_simulations.shardedRun status /scratch/run1
+
+Instead of --plan, the blocks of a campaign can be given with --only/--from
+(see campaign.py). The plan is written by runSimulationBlock with --planFile.
+
+The shared directory contains
+
+    plan.json        the exposures, with absolute file names
+    config.json      the options of the run, e.g. reuseSignal
+    claims/N         created by the worker that runs task N (O_CREAT|O_EXCL, so
+                     only one worker can claim a task); the worker touches it
+                     regularly while it is running
+    status/N.done    written when task N is finished
+    status/N.failed  written with the traceback if task N failed
+
+A task is an exposure, or the repeats of a dark or flat with reuseSignal.
+Tasks that are done are never run again, so a worker can be restarted at
+any time. With --staleAfter, a claim that has not been touched for that many
+seconds (e.g. the host died) is taken over by another worker; the takeover
+is guarded by its own lock file (claims/N.takeover.*), and the old claim is
+kept as claims/N.stale.*.
+
+The workers follow the limits of executor.workerLimits (MSIM_WORKER_MAX_TASKS
+and MSIM_WORKER_MAX_RSS): with local, a worker that reaches one stops and is
+replaced by a fresh process while there are tasks waiting; a single worker
+started with work clears its caches instead.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from dataclasses import replace
+from multiprocessing.connection import wait
+from pathlib import Path
+
+from .executor import groupTasks, retireReason, runTask, workerLimits
+from .scopesimWrapper import releaseState
+from .stageTiming import rssMB, trackedPeakMB, trackPeakRss
+from .exposurePlan import readPlan, writePlan
+
+PLANNAME = "plan.json"
+CONFIGNAME = "config.json"
+
+# seconds between touches of the claim of a running task
+HEARTBEAT = 30
+
+
+def initShared(sharedDir, plan, reuseSignal=False):
+
+    """write a plan to the shared directory, for the workers"""
+
+    sharedDir = Path(sharedDir)
+    (sharedDir / "claims").mkdir(parents=True, exist_ok=True)
+    (sharedDir / "status").mkdir(parents=True, exist_ok=True)
+
+    # the workers may run in a different directory
+    plan = [replace(exp, fname=os.path.abspath(exp.fname)) for exp in plan]
+    for directory in {Path(exp.fname).parent for exp in plan}:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    writePlan(plan, sharedDir / PLANNAME)
+    with (sharedDir / CONFIGNAME).open("w", encoding="utf-8") as f:
+        json.dump({"reuseSignal": bool(reuseSignal)}, f)
+
+
+def loadTasks(sharedDir):
+
+    """the list of tasks in the shared directory, in the same order for all workers"""
+
+    sharedDir = Path(sharedDir)
+    with (sharedDir / CONFIGNAME).open(encoding="utf-8") as f:
+        config = json.load(f)
+    plan = readPlan(sharedDir / PLANNAME)
+    return list(groupTasks(plan, config["reuseSignal"]))
+
+
+def _workerName():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _writeAtomic(path, text):
+
+    """write a file under a temporary name and rename it, so readers never see part of it"""
+
+    tmp = path.with_name(f"{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _generation(st):
+    return f"{st.st_ino}-{st.st_mtime_ns}"
+
+
+def _takeOver(claim, staleAfter):
+
+    """
+    move a claim that was not touched for staleAfter seconds out of the way;
+    returns False if it is not stale, or another worker is taking it over.
+
+    The workers that find the same stale claim race for a lock file named
+    after it (its inode and mtime), created with O_EXCL, so only one of them
+    moves it; the locks are never removed, so a worker that measured the
+    claim before it was taken over can't move the new claim. A lock that is
+    itself stale (its worker died) is taken over in the same way.
+    """
+
+    try:
+        st = claim.stat()
+    except FileNotFoundError:
+        return True
+    if time.time() - st.st_mtime <= staleAfter:
+        return False
+
+    lock = claim.with_name(f"{claim.name}.takeover.{_generation(st)}")
+    while True:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                lockSt = lock.stat()
+            except FileNotFoundError:
+                return False
+            if time.time() - lockSt.st_mtime <= staleAfter:
+                return False
+            lock = lock.with_name(f"{lock.name}.{_generation(lockSt)}")
+
+    # the stale claim is kept under another name, so its inode is not reused
+    moved = claim.with_name(f"{claim.name}.stale.{_generation(st)}")
+    try:
+        os.rename(claim, moved)
+    except FileNotFoundError:
+        return False
+    if _generation(moved.stat()) != _generation(st):
+        # not the claim that was measured; put it back for its owner
+        os.rename(moved, claim)
+        return False
+    print(f"Taking over stale claim of task {claim.name}")
+    return True
+
+
+def claimTask(sharedDir, taskId, staleAfter=None):
+
+    """try to claim a task; returns True if this process now owns it"""
+
+    sharedDir = Path(sharedDir)
+    if any((sharedDir / "status" / f"{taskId}.{state}").exists() for state in ("done", "failed")):
+        return False
+
+    claim = sharedDir / "claims" / str(taskId)
+
+    if staleAfter is not None and claim.exists() and not _takeOver(claim, staleAfter):
+        return False
+
+    try:
+        fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{_workerName()} {time.time()}\n")
+    return True
+
+
+def _heartbeat(claim, stop):
+
+    """touch the claim of a running task until stop is set"""
+
+    while not stop.wait(HEARTBEAT):
+        try:
+            os.utime(claim)
+        except FileNotFoundError:
+            return
+
+
+def runWorker(sharedDir, staleAfter=None, recycle=False):
+
+    """
+    run tasks from the shared directory until all are claimed.
+
+    When the worker reaches one of its limits (see executor.workerLimits), it
+    stops if recycle is set, so that a fresh process can take over, and
+    otherwise clears its caches.
+
+    Returns the number of tasks run by this worker.
+    """
+
+    sharedDir = Path(sharedDir)
+    tasks = loadTasks(sharedDir)
+    maxTasks, maxRssMB = workerLimits()
+    nRun = 0
+    nSinceRelease = 0
+
+    for taskId, exposures in enumerate(tasks):
+        if not claimTask(sharedDir, taskId, staleAfter):
+            continue
+
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(sharedDir / "claims" / str(taskId), stop),
+                                daemon=True)
+        beat.start()
+        t0 = time.time()
+        before = trackPeakRss()
+        try:
+            fnames = runTask(exposures)
+            _writeAtomic(sharedDir / "status" / f"{taskId}.done",
+                         json.dumps({"worker": _workerName(), "fnames": fnames,
+                                     "seconds": time.time() - t0}))
+        except Exception:
+            _writeAtomic(sharedDir / "status" / f"{taskId}.failed",
+                         json.dumps({"worker": _workerName(),
+                                     "fnames": [exp.fname for exp in exposures],
+                                     "error": traceback.format_exc()}))
+            print(f"Task {taskId} failed:\n{traceback.format_exc()}")
+        finally:
+            stop.set()
+        nRun += 1
+        nSinceRelease += 1
+
+        reason = retireReason(nSinceRelease, (before, trackedPeakMB(), rssMB()[0]), maxTasks, maxRssMB)
+        if reason is not None and recycle:
+            print(f"{_workerName()}: stopping after {reason}, to be replaced")
+            break
+        if reason is not None:
+            print(f"{_workerName()}: clearing the caches of the simulations after {reason}")
+            releaseState()
+            nSinceRelease = 0
+
+    return nRun
+
+
+def runLocal(sharedDir, nWorkers, staleAfter=None):
+
+    """
+    run nWorkers workers on this host, and wait for them. A worker that
+    stops at one of its limits is replaced while there are tasks waiting.
+    """
+
+    def start():
+        w = mp.Process(target=runWorker, args=(sharedDir, staleAfter, True))
+        w.start()
+        return w
+
+    workers = [start() for _ in range(nWorkers)]
+    while workers:
+        wait([w.sentinel for w in workers])
+        for w in [w for w in workers if w.exitcode is not None]:
+            workers.remove(w)
+            if w.exitcode == 0 and getStatus(sharedDir)["waiting"] > 0:
+                workers.append(start())
+
+
+def getStatus(sharedDir):
+
+    """count the tasks that are done, failed, running and waiting"""
+
+    sharedDir = Path(sharedDir)
+    nTasks = len(loadTasks(sharedDir))
+    status = {"done": 0, "failed": 0, "running": 0}
+    for taskId in range(nTasks):
+        if (sharedDir / "status" / f"{taskId}.done").exists():
+            status["done"] += 1
+        elif (sharedDir / "status" / f"{taskId}.failed").exists():
+            status["failed"] += 1
+        elif (sharedDir / "claims" / str(taskId)).exists():
+            status["running"] += 1
+    status["waiting"] = nTasks - sum(status.values())
+    return status
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="run an exposure plan with workers on several hosts")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    init = sub.add_parser("init", help="write a plan to the shared directory")
+    init.add_argument("sharedDir")
+    init.add_argument("--plan", type=str, default=None, help="plan written with --planFile")
+    init.add_argument("--blockDir", type=str, default="simulationBlocks")
+    init.add_argument("--only", action="append", default=None, help="block to plan (can be repeated)")
+    init.add_argument("--from", dest="start", type=str, default=None, help="plan from this block to the end")
+    init.add_argument("-r", "--reuseSignal", action="store_true",
+                      help="run the repeats of darks and flats as one task")
+
+    for name, helpText in (("work", "run tasks until there are none left"),
+                           ("local", "run several workers on this host")):
+        cmd = sub.add_parser(name, help=helpText)
+        cmd.add_argument("sharedDir")
+        cmd.add_argument("--staleAfter", type=float, default=None,
+                         help="take over claims that were not touched for this many seconds")
+        if name == "local":
+            cmd.add_argument("-n", "--nWorkers", type=int, default=1)
+
+    status = sub.add_parser("status", help="print the number of tasks in each state")
+    status.add_argument("sharedDir")
+
+    args, blockArgs = parser.parse_known_args()
+    if blockArgs and args.command != "init":
+        parser.error(f"unrecognized arguments: {' '.join(blockArgs)}")
+
+    if args.command == "init":
+        if args.plan is not None:
+            plan = readPlan(args.plan)
+        else:
+            from . import campaign
+            planned = campaign.planCampaign(campaign.selectBlocks(args.only, args.start),
+                                            args.blockDir, blockArgs)
+            plan = [exp for name, blockPlan, params in planned for exp in blockPlan]
+        initShared(args.sharedDir, plan, args.reuseSignal)
+        print(f"{len(plan)} exposures written to {args.sharedDir}")
+    elif args.command == "work":
+        nRun = runWorker(args.sharedDir, args.staleAfter)
+        print(f"{_workerName()}: {nRun} tasks run")
+    elif args.command == "local":
+        runLocal(args.sharedDir, args.nWorkers, args.staleAfter)
+        print(getStatus(args.sharedDir))
+    else:
+        print(getStatus(args.sharedDir))
+
+    if args.command in ("work", "local") and getStatus(args.sharedDir)["failed"] > 0:
+        sys.exit(1)
@@ -10,12 +10,10 @@ import scopesim as sim
 import scopesim_templates as sim_tp
 import numpy as np
 import os
+from functools import cache
 
-import numpy as np
-import scipy
 import astropy.io.fits as fits
 from astropy import units as u
-import matplotlib.pyplot as plt
 
 # default location of IRDB
 DEFAULT_IRDB_LOCATION = os.environ["DEFAULT_IRDB_LOCATION"]
@@ -24,12 +22,17 @@ sim.rc.__config__["!SIM.file.local_packages_path"] = DEFAULT_IRDB_LOCATION
 
 ####################### Definitions used by the sources #########################
 
-# import  ScopeSim information needed for some of the sources
+# ScopeSim information needed for some of the sources. Building an optical
+# train is slow, so this is done on first use rather than on import, and
+# the result is kept for later sources.
+
+@cache
+def getSpecDict(mode):
 
-imgLM = sim.OpticalTrain(sim.UserCommands(use_instrument="METIS", set_modes=["img_lm"]))
-specDictLM = imgLM.cmds['!SIM.spectral']
-imgN = sim.OpticalTrain(sim.UserCommands(use_instrument="METIS", set_modes=["img_n"]))
-specDictN = imgN.cmds['!SIM.spectral']
+    """!SIM.spectral settings of the METIS optical train for a mode"""
+
+    opt = sim.OpticalTrain(sim.UserCommands(use_instrument="METIS", set_modes=[mode]))
+    return opt.cmds['!SIM.spectral']
 
 
 
@@ -65,12 +68,44 @@ skyStarT = ["a0v"]*25
 
 ################### Setup input Images here (e.g. HEEPS input for coronagraph) #################
 
+@cache
+def getHeepsHDU():
+
+    """placeholder input image for the coronagraph; also built on first use"""
+
+    from scipy import datasets
+
+    hdu = fits.ImageHDU(data=datasets.face(gray=True).astype('float'))
+
+    # Give the header some proper WCS info
+    hdu.header.update({"CDELT1": 1, "CUNIT1": "arcsec", "CRPIX1": 0, "CRVAL1": 0,
+                       "CDELT2": 1, "CUNIT2": "arcsec", "CRPIX2": 0, "CRVAL2": 0,})
+    return hdu
+
+
+# the spectral settings and the HEEPS image used to be module attributes,
+# built on import; keep them accessible under the old names
+
+def __getattr__(name):
+    if name == "specDictLM":
+        return getSpecDict("img_lm")
+    if name == "specDictN":
+        return getSpecDict("img_n")
+    if name == "hdu":
+        return getHeepsHDU()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# wrappers for the sources that need the objects above
+
+def laser_spectrum_lm(**kwargs):
+    return sim_tp.metis.laser.laser_spectrum_lm(specdict=getSpecDict("img_lm"), **kwargs)
 
-hdu = fits.ImageHDU(data=scipy.datasets.face(gray=True).astype('float'))
+def laser_spectrum_n(**kwargs):
+    return sim_tp.metis.laser.laser_spectrum_n(specdict=getSpecDict("img_n"), **kwargs)
 
-# Give the header some proper WCS info
-hdu.header.update({"CDELT1": 1, "CUNIT1": "arcsec", "CRPIX1": 0, "CRVAL1": 0,
-                   "CDELT2": 1, "CUNIT2": "arcsec", "CRPIX2": 0, "CRVAL2": 0,})
+def heeps_image(**kwargs):
+    return sim.Source(image_hdu=getHeepsHDU(), **kwargs)
 
 
 
@@ -189,21 +224,18 @@ SOURCEDICT = {
         }
         ),
     "laser_spectrum_lm": (
-        sim_tp.metis.laser.laser_spectrum_lm,
+        laser_spectrum_lm,
         {
-            "specdict":specDictLM,
         }
         ),
     "laser_spectrum_n": (
-        sim_tp.metis.laser.laser_spectrum_n,
+        laser_spectrum_n,
         {
-            "specdict":specDictN,
         }
         ),
     "heeps_image": (
-        sim.Source,
+        heeps_image,
         {
-            "image_hdu":hdu,
             "flux":10*u.ABmag,
         }
         ),
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+Per stage timing of the simulated exposures.
+
+scopesimWrapper.simulate times each stage of an exposure with a StageTimer:
+the output cache, building the source, the UserCommands and the optical
+train, setting the WCU, observe, readout and writing the file. When the
+exposure is done, a line is printed to the run log, and a record
+
+    {"fname": ..., "doCatg": ..., "mode": ..., "host": ..., "pid": ...,
+     "time": ..., "seconds": ..., "stages": {"source": 0.01, ...},
+     "peakRssMB": ..., "rssMB": ..., "repeats": 1, "cached": false}
+
+is appended to the stage log, STAGELOG in the output directory of the file,
+or the file given by the environment variable MSIM_STAGE_LOG. Each record is
+a single write to a file opened in append mode, so all the worker processes
+can write to the same log. With reuseSignal, the stages that are shared by
+the repeats of a group (source, optical train, observe) are in the record of
+the first file that is simulated.
+
+peakRssMB is the peak resident memory of the process during the exposure
+where the kernel allows the peak to be reset (Linux), and otherwise the peak
+over the life of the process.
+
+The median time of each stage, per mode, is printed by
+
+    python -m metis_simulations.stageTiming output/imgLM/stageTimes.jsonl ...
+"""
+
+import argparse
+import json
+import os
+import resource
+import socket
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+STAGELOG = "stageTimes.jsonl"
+
+# the largest peak RSS cleared by resetPeakRss since trackPeakRss, None if not tracking
+_trackedPeak = None
+
+
+def resetPeakRss():
+
+    """reset the peak RSS of this process, where supported (Linux)"""
+
+    global _trackedPeak
+    if _trackedPeak is not None:
+        _trackedPeak = max(_trackedPeak, rssMB()[1])
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def rssMB():
+
+    """the current and peak resident memory of this process, in MB"""
+
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        # ru_maxrss is in kB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak /= 1024 * 1024 if sys.platform == "darwin" else 1024
+        return None, peak
+
+
+def trackPeakRss():
+
+    """
+    start measuring the peak RSS of a task, which may time several exposures;
+    returns the current RSS in MB
+    """
+
+    global _trackedPeak
+    _trackedPeak = None
+    resetPeakRss()
+    _trackedPeak = 0.0
+    return rssMB()[0]
+
+
+def trackedPeakMB():
+
+    """the peak RSS in MB since trackPeakRss"""
+
+    return max(_trackedPeak or 0.0, rssMB()[1])
+
+
+def stageLogPath(fname):
+
+    """the stage log for an output file"""
+
+    return os.environ.get("MSIM_STAGE_LOG") or os.path.join(os.path.dirname(str(fname)), STAGELOG)
+
+
+class StageTimer():
+
+    """the time spent in each stage of a single exposure"""
+
+    def __init__(self, fname, rcp, repeats=1):
+
+        self.fname = str(fname)
+        self.doCatg = rcp.get("do.catg")
+        self.mode = rcp.get("mode")
+        self.repeats = repeats
+        self.stages = {}
+        self.started = False
+
+    @contextmanager
+    def stage(self, name):
+
+        """time a stage; the times of stages with the same name are added"""
+
+        if not self.started:
+            resetPeakRss()
+            self.started = True
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def done(self, cached=False):
+
+        """print the times of the exposure and append them to the stage log"""
+
+        rss, peak = rssMB()
+        record = {"fname": self.fname, "doCatg": self.doCatg, "mode": self.mode,
+                  "host": socket.gethostname(), "pid": os.getpid(),
+                  "time": datetime.now().isoformat(timespec="seconds"),
+                  "seconds": round(sum(self.stages.values()), 4),
+                  "stages": {name: round(t, 4) for name, t in self.stages.items()},
+                  "peakRssMB": round(peak), "rssMB": None if rss is None else round(rss),
+                  "repeats": self.repeats, "cached": cached}
+
+        stages = ", ".join(f"{name} {t:.2f}" for name, t in self.stages.items())
+        print(f"{self.fname}: {record['seconds']:.2f} s ({stages}), peak RSS {record['peakRssMB']} MB")
+
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        fd = os.open(stageLogPath(self.fname), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        return record
+
+
+class _NoTimer():
+
+    """a StageTimer that doesn't time anything, for calls outside an exposure"""
+
+    def stage(self, name):
+        return nullcontext()
+
+
+NOTIMER = _NoTimer()
+
+
+def readStageLog(fNames):
+
+    """the records of a list of stage logs, as a pandas DataFrame with a column per stage"""
+
+    import pandas as pd
+
+    records = []
+    for fName in fNames:
+        with open(fName, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    table = pd.json_normalize(records)
+    return table.rename(columns=lambda c: c.replace("stages.", ""))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="median time of each stage, per mode")
+    parser.add_argument("logs", nargs="+", help="stage logs (stageTimes.jsonl)")
+    args = parser.parse_args()
+
+    table = readStageLog(args.logs)
+    table = table[~table["cached"]]
+    columns = [c for c in table.columns if c not in
+               ("fname", "doCatg", "mode", "host", "pid", "time", "repeats", "cached", "rssMB")]
+    summary = table.groupby("mode")[columns].median()
+    summary.insert(0, "n", table.groupby("mode").size())
+    print(summary.round(2).to_string())
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+"""
+Bulk conversion of observation times.
+
+While a template is planned, the observation times are only kept as offsets
+in seconds from the start time of the template; converting each one to an
+astropy Time (and from there to a TT datetime and an MJD) is much slower than
+the rest of the planning. resolveTimes converts all of them in one call.
+"""
+
+import numpy as np
+from astropy.time import TimeDelta
+
+
+def resolveTimes(start, offsets):
+
+    """
+    convert offsets in seconds from the Time start to observation times.
+
+    Returns an array of MJD (UTC, as MJD-OBS) and a list of TT datetimes (as dateobs).
+    """
+
+    times = start + TimeDelta(np.asarray(offsets, dtype=float), format='sec')
+    return np.atleast_1d(times.mjd), list(np.atleast_1d(times.tt.datetime))
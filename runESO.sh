@@ -32,6 +32,7 @@ DEFAULT_BLOCKS=(
 # Initialize variables for command-line options
 PYTHON_BIN="${PYTHON_BIN:-python}" # Python executable (can be overridden by user)
 SMALL_MODE=false # Flag to enable small dataset mode
+CAMPAIGN_MODE=false # Flag to run all blocks through one shared worker pool
 FROM_BLOCK=""    # Block name to start execution from
 declare -a ONLY_BLOCKS=() # Array of specific blocks to run
 
@@ -46,6 +47,7 @@ Options:
 			--from <block>    Start execution from specified block to end
 			--only <block>    Run only specified block(s) (can be repeated)
 			--list            Print available blocks and exit
+			--campaign        Plan all blocks first and run them with one pool of MSIM_NCORES workers
 	-h, --help            Display this help message and exit
 
 Examples:
@@ -55,6 +57,7 @@ Examples:
 	./runESO.sh --small                # Run all blocks with small dataset
 	./runESO.sh --only imgLM --only ifu  # Execute specific blocks in order
 	./runESO.sh --from lssN --small    # Continue from lssN with small dataset
+	./runESO.sh --campaign             # Run all blocks in parallel with a shared pool
 EOF
 }
 
@@ -113,6 +116,10 @@ while [[ $# -gt 0 ]]; do
 			ONLY_BLOCKS+=("$2") # Add block to execution list
 			shift 2 # Move to next argument pair
 			;;
+		--campaign)
+			CAMPAIGN_MODE=true # Run the blocks through metis_simulations.campaign
+			shift # Move to next argument
+			;;
 		--list)
 			printf '%s\n' "${DEFAULT_BLOCKS[@]}" # Print block list and exit
 			exit 0
@@ -230,6 +237,21 @@ if [[ "$SMALL_MODE" == true ]]; then
 	echo "[INFO] Running in SMALL mode with output directory: ${METIS_ODIR}"
 fi
 
+# In campaign mode, all blocks are planned first and share one worker pool
+if [[ "$CAMPAIGN_MODE" == true ]]; then
+	current_block="campaign"
+	cmd=("${PYTHON_BIN}" -m metis_simulations.campaign --blockDir "${BLOCK_DIR}")
+	for block in "${RUN_BLOCKS[@]}"; do
+		cmd+=(--only "$block")
+	done
+	if [[ "$SMALL_MODE" == true ]]; then
+		cmd+=("--small")
+	fi
+	"${cmd[@]}"
+	echo "[INFO] Completed ${total} simulation blocks"
+	exit 0
+fi
+
 # Execute each simulation block in sequence
 for block in "${RUN_BLOCKS[@]}"; do
 	index=$((index + 1)) # Increment progress counter